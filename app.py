@@ -1,23 +1,41 @@
 import os
 import logging
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
-import schedule
+import heapq
+import bisect
 import hashlib
 import re
 import html
+import sqlite3
+import threading
+import queue
+import socket
+import weakref
 from datetime import datetime, timedelta
-from threading import Thread, Lock, RLock
-from flask import Flask, request, jsonify, render_template_string
+from types import MappingProxyType
+from collections import OrderedDict, deque, namedtuple
+from threading import Thread, Lock, RLock, Event, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, request, jsonify, render_template_string, g
 import pytz
 import random
 from dotenv import load_dotenv
-from functools import wraps
+from functools import wraps, partial
+from abc import ABC, abstractmethod
 import signal
 import sys
 import atexit
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -32,53 +50,424 @@ app = Flask(__name__)
 
 # ========== RENDER-COMPATIBLE CACHE SYSTEM ==========
 
+def open_sqlite(path):
+    """Открывает SQLite соединение, безопасное для нескольких потоков и процессов"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+class MemoryCacheBackend:
+    """Хранилище без персистентности: кэш живет только в памяти процесса"""
+    name = "memory"
+
+    def load_all(self, min_timestamp):
+        return []
+
+    def load(self, key, min_timestamp):
+        return None
+
+    def save(self, key, value, timestamp):
+        pass
+
+    def delete(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+class SQLiteCacheBackend:
+    """Персистентное хранилище кэша в SQLite - переживает рестарты и деплои"""
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.db_lock = Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = open_sqlite(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+        return self.connection
+
+    def load_all(self, min_timestamp):
+        """Загружает все актуальные записи и удаляет просроченные"""
+        with self.db_lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM cache_entries WHERE created_at < ?", (min_timestamp,))
+            return connection.execute(
+                "SELECT key, value, created_at FROM cache_entries"
+            ).fetchall()
+
+    def load(self, key, min_timestamp):
+        """Читает одну запись (могла быть записана другим процессом)"""
+        with self.db_lock:
+            return self._connect().execute(
+                "SELECT value, created_at FROM cache_entries WHERE key = ? AND created_at >= ?",
+                (key, min_timestamp)
+            ).fetchone()
+
+    def save(self, key, value, timestamp):
+        with self.db_lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, timestamp)
+            )
+
+    def delete(self, keys):
+        if not keys:
+            return
+        with self.db_lock:
+            self._connect().executemany("DELETE FROM cache_entries WHERE key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        with self.db_lock:
+            self._connect().execute("DELETE FROM cache_entries")
+
+def create_cache_backend():
+    """Создает хранилище кэша согласно конфигурации"""
+    if Config.CACHE_BACKEND == 'sqlite':
+        return SQLiteCacheBackend(Config.STORAGE_DB_PATH)
+    return MemoryCacheBackend()
+
+def parse_cache_quotas(spec):
+    """Разбирает квоты вида 'dessert:60,science:100' в словарь {категория: макс. записей}"""
+    quotas = {}
+    for part in (spec or '').split(','):
+        if ':' not in part:
+            continue
+        category, limit = part.split(':', 1)
+        try:
+            quotas[category.strip()] = int(limit)
+        except ValueError:
+            logger.warning(f"⚠️ Некорректная квота кэша: {part}")
+    return quotas
+
+def content_category(content_type):
+    """Категория контента для квот: 'friday_dessert' -> 'dessert', 'monday_science' -> 'science'"""
+    return content_type.rsplit('_', 1)[-1] if content_type else 'other'
+
+def guess_category(cache_key):
+    """Категория для записей из хранилища: тип контента — латинский префикс ключа до темы"""
+    tokens = []
+    for token in cache_key.split('_'):
+        if not re.fullmatch(r'[a-z]+', token):
+            break
+        tokens.append(token)
+    return tokens[-1] if tokens else 'other'
+
+class LRUEvictionPolicy:
+    """Порядок вытеснения по давности обращения: O(1) на обращение и выбор жертвы"""
+    name = 'lru'
+
+    def __init__(self):
+        self.order = OrderedDict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, key, tick):
+        self.order[key] = tick
+        self.order.move_to_end(key)
+
+    def touch(self, key, tick):
+        if key in self.order:
+            self.add(key, tick)
+
+    def remove(self, key):
+        self.order.pop(key, None)
+
+    def victim(self):
+        """Возвращает (ранг, ключ) кандидата на вытеснение; меньший ранг вытесняется раньше"""
+        if not self.order:
+            return None
+        key, tick = next(iter(self.order.items()))
+        return (tick,), key
+
+class LFUEvictionPolicy:
+    """Вытеснение реже всего используемых записей: корзины по частоте, внутри — по давности"""
+    name = 'lfu'
+
+    def __init__(self):
+        self.freq = {}
+        self.buckets = {}
+        self.min_freq = 0
+
+    def __len__(self):
+        return len(self.freq)
+
+    def _unlink(self, key):
+        count = self.freq.pop(key)
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if count == self.min_freq:
+                self.min_freq = min(self.buckets) if self.buckets else 0
+        return count
+
+    def _link(self, key, count, tick):
+        self.freq[key] = count
+        self.buckets.setdefault(count, OrderedDict())[key] = tick
+        if not self.min_freq or count < self.min_freq:
+            self.min_freq = count
+
+    def add(self, key, tick):
+        if key in self.freq:
+            self._unlink(key)
+        self._link(key, 1, tick)
+
+    def touch(self, key, tick):
+        if key in self.freq:
+            self._link(key, self._unlink(key) + 1, tick)
+
+    def remove(self, key):
+        if key in self.freq:
+            self._unlink(key)
+
+    def victim(self):
+        if not self.freq:
+            return None
+        key, tick = next(iter(self.buckets[self.min_freq].items()))
+        return (self.min_freq, tick), key
+
+EVICTION_POLICIES = {'lru': LRUEvictionPolicy, 'lfu': LFUEvictionPolicy}
+
 class RenderCompatibleCache:
-    def __init__(self, ttl_days=7):
+    def __init__(self, ttl_days=7, backend=None, max_entries=None, max_bytes=None, policy=None, quotas=None):
         self.cache = {}
-        self.cache_timestamps = {}
+        # Индекс истечения: записи упорядочены по времени создания, старейшие — в начале
+        self.cache_timestamps = OrderedDict()
+        self.entry_sizes = {}
+        self.entry_types = {}
+        self.total_bytes = 0
         self.cache_ttl = ttl_days * 24 * 3600
         self.cache_lock = Lock()
-        self._storage_type = "memory"
+        self.backend = backend if backend is not None else create_cache_backend()
+        self._storage_type = self.backend.name
+        self._loaded = False
+        # Меняется при полной очистке: чтение с диска вне блокировки не должно вернуть старые записи
+        self.generation = 0
+        # Ограничения размера: 0 — без ограничения
+        self.max_entries = Config.CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = Config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        policy = (policy or Config.CACHE_EVICTION_POLICY).lower()
+        if policy not in EVICTION_POLICIES:
+            logger.warning(f"⚠️ Неизвестная политика вытеснения {policy}, используем lru")
+            policy = 'lru'
+        self.policy_name = policy
+        self.quotas = parse_cache_quotas(Config.CACHE_TYPE_QUOTAS) if quotas is None else dict(quotas)
+        # Отдельный порядок вытеснения на каждую категорию, чтобы квоты вытесняли только свои записи
+        self.policies = {}
+        self.access_tick = 0
+        self.evictions = {'entries': 0, 'bytes': 0, 'quota': 0}
         
-        logger.info(f"💾 Кэш инициализирован в оперативной памяти (TTL: {ttl_days} дней)")
+        logger.info(f"💾 Кэш инициализирован (хранилище: {self._storage_type}, TTL: {ttl_days} дней, "
+                    f"лимит: {self.max_entries} записей / {self.max_bytes} байт, политика: {self.policy_name})")
+
+    @staticmethod
+    def _byte_size(value):
+        """Реальный размер значения в байтах UTF-8"""
+        return len(value.encode('utf-8')) if isinstance(value, str) else len(str(value).encode('utf-8'))
+
+    def _next_tick(self):
+        self.access_tick += 1
+        return self.access_tick
+
+    def _store(self, key, value, timestamp, category):
+        """Кладет запись в память и обновляет счетчики (вызывается под cache_lock)"""
+        if key in self.cache and self.entry_types[key] != category:
+            self._remove(key)
+        size = self._byte_size(value)
+        self.total_bytes += size - self.entry_sizes.get(key, 0)
+        self.entry_sizes[key] = size
+        self.cache[key] = value
+        # Перезапись переносит ключ в конец индекса истечения
+        self.cache_timestamps.pop(key, None)
+        self.cache_timestamps[key] = timestamp
+        self.entry_types[key] = category
+        if category not in self.policies:
+            self.policies[category] = EVICTION_POLICIES[self.policy_name]()
+        self.policies[category].add(key, self._next_tick())
+
+    def _remove(self, key):
+        """Удаляет запись из памяти и обновляет счетчики (вызывается под cache_lock)"""
+        self.total_bytes -= self.entry_sizes.pop(key, 0)
+        del self.cache[key]
+        del self.cache_timestamps[key]
+        category = self.entry_types.pop(key)
+        policy = self.policies[category]
+        policy.remove(key)
+        if not len(policy):
+            del self.policies[category]
+
+    def _over_limit(self):
+        if self.max_entries and len(self.cache) > self.max_entries:
+            return 'entries'
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            return 'bytes'
+        return None
+
+    def _pick_victim(self, categories):
+        """Лучший кандидат на вытеснение среди категорий: сравниваем только головы их очередей"""
+        best = None
+        for category in categories:
+            policy = self.policies.get(category)
+            candidate = policy.victim() if policy else None
+            if candidate and (best is None or candidate[0] < best[0]):
+                best = candidate
+        return best[1] if best else None
+
+    def _evict(self, key, reason):
+        self._remove(key)
+        self.evictions[reason] += 1
+        gpt_cache_evictions_total.inc(reason=reason)
+        return key
+
+    def _enforce_limits(self, protected_key=None):
+        """Вытесняет записи сверх квоты категории и общих лимитов (вызывается под cache_lock).
+
+        Категория с квотой вытесняет при переполнении только свои записи,
+        поэтому, например, десерты не вытесняют ежедневные научные посты.
+        """
+        evicted = []
+        category = self.entry_types.get(protected_key)
+        policy = self.policies.get(category)
+        # Новая запись не должна стать собственной жертвой
+        if policy is not None:
+            policy.remove(protected_key)
+
+        quota = self.quotas.get(category, 0)
+        while policy is not None and quota > 0 and len(policy) + 1 > quota and len(policy):
+            evicted.append(self._evict(self._pick_victim([category]), 'quota'))
+
+        reason = self._over_limit()
+        while reason:
+            victim = None
+            if category in self.quotas:
+                victim = self._pick_victim([category])
+            if victim is None:
+                victim = self._pick_victim(list(self.policies))
+            if victim is None:
+                break
+            evicted.append(self._evict(victim, reason))
+            reason = self._over_limit()
+
+        if protected_key is not None and protected_key in self.cache:
+            if category not in self.policies:
+                self.policies[category] = EVICTION_POLICIES[self.policy_name]()
+            self.policies[category].add(protected_key, self._next_tick())
+        if evicted:
+            self._persist('delete', evicted)
+            logger.debug(f"🧹 Вытеснено из кэша ({self.policy_name}): {len(evicted)}")
+        return evicted
+
+    def _ensure_loaded(self):
+        """Ленивая загрузка сохраненных записей при первом обращении (вызывается под cache_lock)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            rows = sorted(self.backend.load_all(time.time() - self.cache_ttl), key=lambda row: row[2])
+            for key, value, timestamp in rows:
+                self._store(key, value, timestamp, guess_category(key))
+            self._enforce_limits()
+            if rows:
+                logger.info(f"♻️ Теплый старт кэша: восстановлено {len(rows)} записей из {self._storage_type}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки кэша из {self._storage_type}, работаем в памяти: {e}")
+            self.backend = MemoryCacheBackend()
+            self._storage_type = self.backend.name
+
+    def _persist(self, action, *args):
+        """Пишет изменения в хранилище, не роняя кэш при ошибках диска"""
+        try:
+            getattr(self.backend, action)(*args)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кэша в {self._storage_type}: {e}")
     
+    def _fresh(self, key):
+        """Значение записи с проверкой TTL; просроченная запись удаляется (вызывается под cache_lock)"""
+        if key not in self.cache:
+            return None
+        create_time = self.cache_timestamps.get(key, 0)
+        current_time = time.time()
+
+        if current_time - create_time < self.cache_ttl:
+            self.policies[self.entry_types[key]].touch(key, self._next_tick())
+            logger.debug(f"✅ Кэш попадание: {key}")
+            return self.cache[key]
+
+        # Удаляем просроченную запись
+        self._remove(key)
+        self._persist('delete', [key])
+        logger.debug(f"🧹 Удален просроченный кэш: {key}")
+        return None
+
     def get(self, key):
         """Получаем значение из кэша с проверкой TTL"""
         with self.cache_lock:
+            self._ensure_loaded()
             if key in self.cache:
-                create_time = self.cache_timestamps.get(key, 0)
-                current_time = time.time()
-                
-                if current_time - create_time < self.cache_ttl:
-                    logger.debug(f"✅ Кэш попадание: {key}")
-                    return self.cache[key]
-                else:
-                    # Удаляем просроченную запись
-                    del self.cache[key]
-                    del self.cache_timestamps[key]
-                    logger.debug(f"🧹 Удален просроченный кэш: {key}")
-        return None
+                return self._fresh(key)
+            generation = self.generation
+
+        # Запись могла появиться в хранилище из другого процесса; диск читаем без cache_lock,
+        # чтобы промах не задерживал остальные обращения к кэшу
+        try:
+            row = self.backend.load(key, time.time() - self.cache_ttl)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша из {self._storage_type}: {e}")
+            row = None
+        if not row:
+            return None
+
+        with self.cache_lock:
+            # Пока читали, запись могли обновить в памяти или кэш могли очистить целиком
+            if key not in self.cache and generation == self.generation:
+                self._store(key, row[0], row[1], guess_category(key))
+                self._enforce_limits(key)
+            return self._fresh(key)
     
-    def set(self, key, value):
-        """Сохраняем значение в кэш"""
+    def set(self, key, value, content_type=None):
+        """Сохраняем значение в кэш; content_type определяет категорию для квот"""
+        category = content_category(content_type) if content_type else guess_category(key)
         with self.cache_lock:
-            self.cache[key] = value
-            self.cache_timestamps[key] = time.time()
+            self._ensure_loaded()
+            timestamp = time.time()
+            self._store(key, value, timestamp, category)
+            self._persist('save', key, value, timestamp)
+            self._enforce_limits(key)
             logger.debug(f"💾 Сохранен в кэш: {key}")
     
     def cleanup_expired(self):
-        """Очистка просроченных записей"""
+        """Очистка просроченных записей за O(просроченных).
+
+        Индекс истечения упорядочен по времени создания, поэтому проход идет
+        с начала и останавливается на первой непросроченной записи.
+        Запись, прочитанная из хранилища другого процесса, может стоять чуть позже
+        своего места — ее все равно удалит ленивая проверка TTL в get().
+        """
         current_time = time.time()
         expired_keys = []
         
         with self.cache_lock:
+            self._ensure_loaded()
             for key, timestamp in self.cache_timestamps.items():
                 if current_time - timestamp > self.cache_ttl:
                     expired_keys.append(key)
+                else:
+                    break
             
             for key in expired_keys:
-                del self.cache[key]
-                del self.cache_timestamps[key]
+                self._remove(key)
+            self._persist('delete', expired_keys)
         
         if expired_keys:
             logger.info(f"🧹 Очищено просроченных записей: {len(expired_keys)}")
@@ -87,71 +476,184 @@ class RenderCompatibleCache:
     def clear_all(self):
         """Полная очистка кэша"""
         with self.cache_lock:
+            self._ensure_loaded()
             count = len(self.cache)
             self.cache.clear()
             self.cache_timestamps.clear()
+            self.entry_sizes.clear()
+            self.entry_types.clear()
+            self.policies.clear()
+            self.total_bytes = 0
+            self.generation += 1
+            self._persist('clear')
             logger.info(f"🧹 Полная очистка кэша: удалено {count} записей")
             return count
     
-    def get_stats(self):
-        """Статистика кэша"""
+    def count_expiring(self, window=86400):
+        """Сколько живых записей истечет в ближайшие window секунд.
+
+        Индекс истечения упорядочен по времени создания, поэтому просматривается
+        только его начало - до первой записи, которой жить дольше window.
+        """
+        current_time = time.time()
+        expiring = 0
         with self.cache_lock:
-            total_size = len(self.cache)
-            current_time = time.time()
-            
-            # Считаем скоро истекающие записи (менее 24 часов)
-            expiring_soon = 0
+            self._ensure_loaded()
             for timestamp in self.cache_timestamps.values():
-                if current_time - timestamp > (self.cache_ttl - 86400):
-                    expiring_soon += 1
-            
-            # Примерный расчет использования памяти
-            memory_usage = sum(len(str(v)) for v in self.cache.values()) / 1024 / 1024
-            
-            return {
-                "total_entries": total_size,
-                "expiring_soon": expiring_soon,
-                "storage_type": self._storage_type,
-                "memory_usage_mb": round(memory_usage, 2)
-            }
+                age = current_time - timestamp
+                if age <= self.cache_ttl - window:
+                    break
+                if age <= self.cache_ttl:
+                    expiring += 1
+        return expiring
+
+    def get_stats(self):
+        """Статистика кэша: счетчики ведутся при записи и удалении, по индексу считаются только истекающие"""
+        expiring_soon = self.count_expiring()
+        memory_usage_bytes = self.total_bytes
+        
+        return {
+            "total_entries": len(self.cache),
+            "expiring_soon": expiring_soon,
+            "storage_type": self._storage_type,
+            "memory_usage_mb": round(memory_usage_bytes / 1024 / 1024, 2),
+            "memory_usage_bytes": memory_usage_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "eviction_policy": self.policy_name,
+            "evictions": dict(self.evictions),
+            "entries_by_type": {category: len(policy) for category, policy in list(self.policies.items())}
+        }
+
+class CacheJanitor:
+    """Один общий фоновый цикл очистки для всех экземпляров кэша"""
+
+    def __init__(self, runtime=None, interval=3600):
+        self.runtime = runtime
+        self.interval = interval
+        self.caches = weakref.WeakSet()
+        self.janitor_lock = Lock()
+        self.loop = None
+        self.sweeps = 0
+        self.total_cleaned = 0
+
+    def register(self, cache):
+        """Подключает кэш к общей очистке; цикл запускается при первой регистрации"""
+        with self.janitor_lock:
+            self.caches.add(cache)
+            if self.loop is None:
+                runtime = self.runtime or background_runtime
+                self.loop = runtime.run_loop('cache-cleanup', self._sweep,
+                                             initial_delay=self.interval, retry_delay=self.interval)
+                logger.info("🔄 Фоновая очистка кэша запущена")
+
+    def _sweep(self):
+        with self.janitor_lock:
+            caches = list(self.caches)
+        cleaned = 0
+        for cache in caches:
+            try:
+                cleaned += cache.cleanup_expired()
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки кэша: {e}")
+        self.sweeps += 1
+        self.total_cleaned += cleaned
+        if cleaned > 0:
+            logger.info(f"🔄 Фоновая очистка: удалено {cleaned} записей")
+        return self.interval
+
+    def get_stats(self):
+        return {
+            "caches": len(self.caches),
+            "sweeps": self.sweeps,
+            "total_cleaned": self.total_cleaned,
+            "interval_seconds": self.interval
+        }
+
+cache_janitor = CacheJanitor()
 
 # ========== СИСТЕМА РАЗНООБРАЗИЯ РЕЦЕПТОВ ==========
 
+def recipe_fingerprint(text):
+    """Набор значимых слов текста — считается один раз при записи в историю"""
+    return frozenset(re.findall(r'[а-яё]{4,}', text.lower()))
+
+class SimilarityWindow:
+    """Кольцевое окно отпечатков с инвертированным индексом слово -> записи.
+
+    Схожесть считается только по записям, разделяющим хотя бы одно слово
+    с кандидатом, поэтому окно в сотни постов дешевле прежнего скана 10 текстов.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.token_index = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, tokens):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = tokens
+        for token in tokens:
+            self.token_index.setdefault(token, set()).add(entry_id)
+        while len(self.entries) > self.size:
+            old_id, old_tokens = self.entries.popitem(last=False)
+            for token in old_tokens:
+                postings = self.token_index[token]
+                postings.discard(old_id)
+                if not postings:
+                    del self.token_index[token]
+
+    def best_match(self, tokens):
+        """Максимальный коэффициент Жаккара кандидата с записями окна"""
+        common = {}
+        for token in tokens:
+            for entry_id in self.token_index.get(token, ()):
+                common[entry_id] = common.get(entry_id, 0) + 1
+        best = 0.0
+        for entry_id, shared in common.items():
+            union = len(tokens) + len(self.entries[entry_id]) - shared
+            best = max(best, shared / union)
+        return best
+
+    def clear(self):
+        self.entries.clear()
+        self.token_index.clear()
+
 class RecipeDiversityManager:
-    def __init__(self):
+    def __init__(self, window_size=None, history_size=None, threshold=None, library=None):
         self.used_ingredients = set()
         self.used_cooking_methods = set()
         self.used_exercises = set()
-        self.recipe_history = []
-        self.max_history_size = 100
+        self.max_history_size = history_size or Config.DIVERSITY_HISTORY_SIZE
+        self.window_size = window_size or Config.DIVERSITY_WINDOW
+        self.similarity_threshold = Config.DIVERSITY_THRESHOLD if threshold is None else threshold
+        # История без исходных текстов: тип, время и отпечаток в кольцевом буфере
+        self.recipe_history = deque(maxlen=self.max_history_size)
+        # Отдельное окно сравнения для каждой категории контента
+        self.windows = {}
         self.diversity_lock = RLock()
         
-        # БИБЛИОТЕКА РОССИЙСКИХ ПРОДУКТОВ
-        self.protein_sources = [
-            "🍗 куриная грудка", "🦃 индейка", "🥩 говядина", "🐷 свинина", "🐄 телятина",
-            "🐟 треска", "🐠 минтай", "🐡 горбуша", "🐟 сельдь", "🐟 скумбрия", "🐟 камбала",
-            "🍗 куриные бедра", "🥓 свиная вырезка", "🐇 кролик", "🦃 индейка грудка",
-            "🍖 телячья печень", "🍗 куриная печень", "🥚 яйца", "🧀 творог", "🧀 сыр"
-        ]
-        
-        self.vegetable_rotation = [
-            "🥔 картофель", "🥕 морковь", "🍠 свекла", "🥬 капуста", "🥒 огурцы", "🍅 помидоры",
-            "🧅 лук репчатый", "🌱 лук зеленый", "🧄 чеснок", "🌶️ редис", "🥒 редис дайкон",
-            "🥒 кабачки", "🍆 баклажаны", "🫑 перец болгарский", "🎃 тыква", "🌶️ редис",
-            "🌿 зелень петрушки", "🌿 укроп", "🌱 зеленый лук", "🌿 щавель", "🥬 шпинат",
-            "🥦 брокколи", "🥬 цветная капуста", "🥬 брюссельская капуста", "🌿 сельдерей"
-        ]
-        
-        self.cooking_methods = [
-            "🔥 запекание в духовке", "💨 приготовление на пару", "🍲 томление",
-            "🍳 быстрая обжарка", "🍜 варка", "🥘 тушение", "🍵 припускание",
-            "🧅 пассерование", "💧 бланширование", "🍖 бразирование"
-        ]
-        
-        self.cuisine_styles = [
-            "🇷🇺 русская", "🍅 средиземноморская", "🍝 европейская", "🥩 кавказская", 
-            "🍚 азиатская", "🌯 восточная", "🌮 мексиканская"
-        ]
+        # БИБЛИОТЕКА РОССИЙСКИХ ПРОДУКТОВ - из файла контента, обновляется без перезапуска
+        self.library = library or content_library
+        self.apply_library(self.library.get('diversity'))
+        self.library.subscribe('diversity', self.apply_library, validate=self.validate_library)
+
+    def validate_library(self, products):
+        require_string_lists('diversity', products, ContentLibrary.SECTIONS['diversity'])
+
+    def apply_library(self, products):
+        """Подменяет списки продуктов; история использованных ингредиентов сохраняется"""
+        with self.diversity_lock:
+            self.protein_sources = list(products['protein_sources'])
+            self.vegetable_rotation = list(products['vegetable_rotation'])
+            self.cooking_methods = list(products['cooking_methods'])
+            self.cuisine_styles = list(products['cuisine_styles'])
+        return {"protein_sources": len(self.protein_sources), "vegetables": len(self.vegetable_rotation)}
 
     def get_unique_ingredients(self, count=3):
         """Возвращает уникальные российские ингредиенты"""
@@ -194,130 +696,332 @@ class RecipeDiversityManager:
         """Возвращает случайный кулинарный стиль"""
         return random.choice(self.cuisine_styles)
 
-    def record_recipe(self, recipe_text, recipe_type):
-        """Записывает рецепт в историю"""
+    def record_recipe(self, recipe_text, recipe_type, tokens=None):
+        """Записывает отпечаток рецепта в историю и окно его категории"""
+        tokens = recipe_fingerprint(recipe_text) if tokens is None else tokens
+        category = content_category(recipe_type)
         with self.diversity_lock:
             self.recipe_history.append({
-                'text': recipe_text,
                 'type': recipe_type,
+                'tokens': tokens,
                 'timestamp': datetime.now()
             })
-            
-            # Обрезаем историю если нужно
-            if len(self.recipe_history) > self.max_history_size:
-                self.recipe_history.pop(0)
+            if category not in self.windows:
+                self.windows[category] = SimilarityWindow(self.window_size)
+            self.windows[category].add(tokens)
+
+    def check_similarity(self, new_recipe_text, recipe_type=None):
+        """Возвращает наибольшую схожесть (0..1) с прошлыми рецептами той же категории.
 
-    def check_similarity(self, new_recipe_text, threshold=0.3):
-        """Проверяет схожесть с предыдущими рецептами"""
+        Без типа сравнение идет по окнам всех категорий.
+        """
+        tokens = recipe_fingerprint(new_recipe_text)
         with self.diversity_lock:
-            if not self.recipe_history:
-                return False
-                
-            new_words = set(re.findall(r'[а-яё]{4,}', new_recipe_text.lower()))
-            
-            for old_recipe in self.recipe_history[-10:]:
-                old_words = set(re.findall(r'[а-яё]{4,}', old_recipe['text'].lower()))
-                
-                common_words = len(new_words.intersection(old_words))
-                total_words = len(new_words.union(old_words))
-                
-                similarity = common_words / total_words if total_words > 0 else 0
-                
-                if similarity > threshold:
-                    return True
-                    
-            return False
+            if recipe_type is not None:
+                window = self.windows.get(content_category(recipe_type))
+                windows = [window] if window else []
+            else:
+                windows = list(self.windows.values())
+            return max((window.best_match(tokens) for window in windows), default=0.0)
+
+    def is_too_similar(self, similarity):
+        return similarity > self.similarity_threshold
+
+    def clear_history(self):
+        with self.diversity_lock:
+            self.recipe_history.clear()
+            for window in self.windows.values():
+                window.clear()
+            self.windows.clear()
+
+    def get_stats(self):
+        with self.diversity_lock:
+            return {
+                "history_size": len(self.recipe_history),
+                "window_size": self.window_size,
+                "threshold": self.similarity_threshold,
+                "windows": {category: len(window) for category, window in self.windows.items()}
+            }
+
+# ========== ИНДЕКС ПОХОЖИХ ПОСТОВ (MINHASH/LSH) ==========
+
+RUSSIAN_REFLEXIVE_SUFFIXES = ('ся', 'сь')
+RUSSIAN_SUFFIXES = tuple(sorted((
+    'иями', 'ями', 'ами', 'ыми', 'ими', 'ого', 'его', 'ому', 'ему', 'ать', 'ять', 'ить', 'еть',
+    'ает', 'яет', 'ует', 'ают', 'яют', 'уют', 'ией', 'иям', 'иях', 'ость',
+    'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ой', 'ей', 'ий', 'ый', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях',
+    'ую', 'юю', 'ов', 'ев', 'ию', 'ия', 'ья', 'ье', 'ьи',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь'
+), key=len, reverse=True))
+
+def light_stem(word):
+    """Легкий стемминг: отрезает самое длинное типичное окончание, оставляя основу от 4 букв"""
+    for suffix in RUSSIAN_REFLEXIVE_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    for suffix in RUSSIAN_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+def post_shingles(text):
+    """Множество основ значимых слов поста без HTML разметки"""
+    plain = re.sub(r'<[^>]+>', ' ', text).lower()
+    return {light_stem(word) for word in re.findall(r'[а-яё]{4,}', plain)}
+
+class NearDuplicateIndex:
+    """Персистентный индекс MinHash/LSH по всем опубликованным постам.
+
+    Сигнатура поста — минимумы NEAR_DUP_PERMUTATIONS хэш-функций по основам слов,
+    разбитые на полосы; кандидаты ищутся по совпадению хэша хотя бы одной полосы,
+    поэтому поиск не зависит от размера архива. Схожесть кандидатов оценивается
+    долей совпавших минимумов (оценка коэффициента Жаккара).
+
+    Вероятность найти пост со схожестью s равна 1 - (1 - s^r)^b для b полос по r строк.
+    По умолчанию 32 полосы по 3 строки: при s = 0.5 находится ~98.6% пар, при 0.6 -
+    ~99.9%, а посты со схожестью 0.2 попадают в кандидаты лишь в ~23% случаев.
+    """
+
+    HASH_PRIME = (1 << 61) - 1
+    HASH_SEED = 20240601
+
+    def __init__(self, path=None, permutations=None, bands=None, threshold=None):
+        self.path = path
+        self.permutations = permutations or Config.NEAR_DUP_PERMUTATIONS
+        self.bands = bands or Config.NEAR_DUP_BANDS
+        if self.permutations % self.bands:
+            raise ValueError("Число перестановок MinHash должно делиться на число полос")
+        self.rows = self.permutations // self.bands
+        self.threshold = Config.NEAR_DUP_THRESHOLD if threshold is None else threshold
+        # Коэффициенты фиксированы, иначе сигнатуры из базы перестанут совпадать после рестарта
+        rng = random.Random(self.HASH_SEED)
+        self.coefficients = [(rng.randrange(1, self.HASH_PRIME), rng.randrange(0, self.HASH_PRIME))
+                             for _ in range(self.permutations)]
+        self.connection = None
+        self.index_lock = Lock()
+        # Хранилище в памяти, когда путь к базе не задан
+        self.posts = {}
+        self.buckets = {}
+        self.next_id = 1
+        self.lookups = 0
+        self.candidates_checked = 0
+        self.duplicates_found = 0
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = open_sqlite(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS near_dup_posts ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, content_type TEXT, "
+                "published_at REAL NOT NULL, signature TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS near_dup_bands ("
+                "band INTEGER NOT NULL, bucket TEXT NOT NULL, post_id INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_near_dup_bands ON near_dup_bands (band, bucket)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS near_dup_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._migrate_layout(self.connection)
+        return self.connection
+
+    def _migrate_layout(self, connection):
+        """После смены числа перестановок или полос заново раскладывает сохраненные сигнатуры по полосам.
+
+        Коэффициенты берутся из одного генератора с фиксированным зерном, поэтому более
+        длинная сигнатура содержит более короткую как префикс; посты с сигнатурой короче
+        новой восстановить без текста нельзя, они удаляются из индекса.
+        """
+        layout = f"{self.permutations}x{self.bands}"
+        # IMMEDIATE: второй процесс дождется конца миграции и увидит новую раскладку
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM near_dup_meta WHERE key = 'layout'").fetchone()
+            if row and row[0] == layout:
+                connection.execute("COMMIT")
+                return
+            posts = connection.execute("SELECT id, signature FROM near_dup_posts").fetchall()
+            connection.execute("DELETE FROM near_dup_bands")
+            dropped = []
+            for post_id, raw in posts:
+                signature = json.loads(raw)
+                if len(signature) < self.permutations:
+                    dropped.append((post_id,))
+                    continue
+                signature = signature[:self.permutations]
+                connection.execute("UPDATE near_dup_posts SET signature = ? WHERE id = ?",
+                                   (json.dumps(signature), post_id))
+                connection.executemany(
+                    "INSERT INTO near_dup_bands (band, bucket, post_id) VALUES (?, ?, ?)",
+                    [(band, bucket, post_id) for band, bucket in self._band_buckets(signature)]
+                )
+            connection.executemany("DELETE FROM near_dup_posts WHERE id = ?", dropped)
+            connection.execute("INSERT OR REPLACE INTO near_dup_meta (key, value) VALUES ('layout', ?)", (layout,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        if posts:
+            logger.info(f"🔁 Индекс похожих постов перестроен под {layout}: "
+                        f"{len(posts) - len(dropped)} сохранено, {len(dropped)} удалено")
+
+    def signature(self, text):
+        shingles = post_shingles(text)
+        if not shingles:
+            return None
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for shingle in shingles]
+        prime = self.HASH_PRIME
+        return [min((a * value + b) % prime for value in hashes) for a, b in self.coefficients]
+
+    def _band_buckets(self, signature):
+        rows = self.rows
+        return [
+            (band, hashlib.md5(','.join(map(str, signature[band * rows:(band + 1) * rows])).encode()).hexdigest()[:16])
+            for band in range(self.bands)
+        ]
+
+    def _estimate(self, first, second):
+        return sum(1 for x, y in zip(first, second) if x == y) / self.permutations
+
+    def find(self, text, signature=None):
+        """Ищет самый похожий опубликованный пост. Возвращает dict или None, если схожесть ниже порога"""
+        signature = signature or self.signature(text)
+        if signature is None:
+            return None
+        buckets = self._band_buckets(signature)
+        with self.index_lock:
+            self.lookups += 1
+            if self.path:
+                connection = self._connect()
+                clause = ' OR '.join(['(band = ? AND bucket = ?)'] * len(buckets))
+                params = [value for bucket in buckets for value in bucket]
+                candidates = connection.execute(
+                    f"SELECT id, content_type, published_at, signature FROM near_dup_posts WHERE id IN "
+                    f"(SELECT post_id FROM near_dup_bands WHERE {clause})", params
+                ).fetchall()
+                candidates = [(row[0], row[1], row[2], json.loads(row[3])) for row in candidates]
+            else:
+                ids = set()
+                for bucket in buckets:
+                    ids.update(self.buckets.get(bucket, ()))
+                candidates = [(post_id, *self.posts[post_id]) for post_id in ids]
+
+            self.candidates_checked += len(candidates)
+            best = None
+            for post_id, content_type, published_at, other in candidates:
+                score = self._estimate(signature, other)
+                if score >= self.threshold and (best is None or score > best['similarity']):
+                    best = {"post_id": post_id, "content_type": content_type,
+                            "published_at": published_at, "similarity": round(score, 3)}
+            if best:
+                self.duplicates_found += 1
+            return best
+
+    def add(self, text, content_type=None, signature=None):
+        """Добавляет опубликованный пост в индекс (вызывается после успешной отправки)"""
+        signature = signature or self.signature(text)
+        if signature is None:
+            return None
+        buckets = self._band_buckets(signature)
+        now = time.time()
+        with self.index_lock:
+            if self.path:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    post_id = connection.execute(
+                        "INSERT INTO near_dup_posts (content_type, published_at, signature) VALUES (?, ?, ?)",
+                        (content_type, now, json.dumps(signature))
+                    ).lastrowid
+                    connection.executemany(
+                        "INSERT INTO near_dup_bands (band, bucket, post_id) VALUES (?, ?, ?)",
+                        [(band, bucket, post_id) for band, bucket in buckets]
+                    )
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+            else:
+                post_id = self.next_id
+                self.next_id += 1
+                self.posts[post_id] = (content_type, now, signature)
+                for bucket in buckets:
+                    self.buckets.setdefault(bucket, set()).add(post_id)
+            return post_id
+
+    def get_stats(self):
+        with self.index_lock:
+            if self.path:
+                indexed = self._connect().execute("SELECT COUNT(*) FROM near_dup_posts").fetchone()[0]
+            else:
+                indexed = len(self.posts)
+            return {
+                "storage": "sqlite" if self.path else "memory",
+                "indexed_posts": indexed,
+                "permutations": self.permutations,
+                "bands": self.bands,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "avg_candidates": round(self.candidates_checked / self.lookups, 2) if self.lookups else 0,
+                "duplicates_found": self.duplicates_found
+            }
+
+def create_near_duplicate_index():
+    """Индекс похожих постов в общем SQLite файле, либо только в памяти процесса"""
+    if Config.NEAR_DUP_BACKEND == 'sqlite':
+        return NearDuplicateIndex(Config.STORAGE_DB_PATH)
+    return NearDuplicateIndex()
 
 # ========== МЕНЕДЖЕР ДЕСЕРТОВ ПРАВИЛЬНОГО ПИТАНИЯ ==========
 
 class HealthyDessertManager:
     """Специализированный менеджер для десертов правильного питания"""
     
-    def __init__(self):
+    def __init__(self, library=None):
         logger.info("🍰 Инициализация менеджера десертов правильного питания")
         
-        # Натуральные подсластители с низким ГИ
-        self.healthy_sweeteners = [
-            "🍌 бананы спелые (натуральная фруктоза + клетчатка)",
-            "🍯 мед сырой непастеризованный (ферменты + антиоксиданты)",
-            "🌿 стевия листовая (0 калорий, гликемический индекс 0)",
-            "📉 эритритол (0 калорий, не влияет на уровень сахара)",
-            "🔵 сироп топинамбура (инулин - пребиотик для микробиома)",
-            "🫐 финики меджул без косточек (калий + магний)",
-            "🍎 яблочное пюре без сахара (пектин - растворимая клетчатка)",
-            "🍐 пюре из груш (сорбитол - естественный подсластитель)",
-            "🥭 манго сушеное (без добавления сахара)",
-            "🍇 изюм темный (железо + антиоксиданты)"
-        ]
-        
-        # Белковые основы для десертов
-        self.protein_bases = [
-            "🧀 греческий йогурт 5% (12г белка на 100г, пробиотики)",
-            "🥛 творог обезжиренный (18г белка, казеин медленного усвоения)",
-            "🥚 яичные белки (чистый протеин, 0 жира)",
-            "🌰 протеин гороховый изолят (гипоаллергенный, 27г белка)",
-            "🥥 протеин конопляный (омега-3 + клетчатка)",
-            "🍦 сывороточный протеин изолят (быстрое усвоение)",
-            "🫘 нут отварной (растительный белок + клетчатка)",
-            "⚫ черная фасоль (антиоксиданты + растительный белок)"
-        ]
-        
-        # Полезные жиры
-        self.healthy_fats = [
-            "🥑 авокадо (мононенасыщенные жиры, калий, витамин Е)",
-            "🌰 миндаль сырой (витамин Е, магний, клетчатка)",
-            "🥜 арахисовая паста 100% (без сахара, растительный белок)",
-            "🌰 кешью сырой (цинк, железо, магний)",
-            "🫒 масло кокосовое холодного отжима (MCT для энергии мозга)",
-            "⚫ семена чиа (омега-3, кальций, растворимая клетчатка)",
-            "🌻 семена подсолнечника (витамин Е, селен)",
-            "🥥 кокосовая стружка (среднецепочечные триглицериды)"
-        ]
-        
-        # Источники клетчатки
-        self.fiber_sources = [
-            "🌾 овсяные хлопья грубого помола (бета-глюканы для холестерина)",
-            "⚫ семена льна молотые (лигнаны - фитоэстрогены)",
-            "🌰 миндальная мука (низкий ГИ, витамин Е)",
-            "🥥 кокосовая мука (высокое содержание клетчатки)",
-            "🍎 яблочные волокна (пектин - пребиотик)",
-            "🫐 ягоды замороженные (малина, ежевика, черника - антоцианы)",
-            "🟤 какао-порошок сырой (флавоноиды + магний)",
-            "🍠 сладкий картофель (бета-каротин + клетчатка)"
-        ]
-        
-        # Типы десертов с объяснением пользы
-        self.dessert_types = [
-            ("🍮 пудинг из семян чиа с ягодами", "омега-3 + антиоксиданты + пребиотики"),
-            ("🍰 чизкейк без выпечки на ореховой основе", "полезные жиры + растительный белок"),
-            ("🍫 брауни из черной фасоли и какао", "растительный белок + флавоноиды"),
-            ("🍦 мороженое из замороженного банана", "натуральная сладость + калий"),
-            ("🥧 фруктовый коблер с овсяной крошкой", "сложные углеводы + клетчатка"),
-            ("🎂 мусс из авокадо и сырого какао", "мононенасыщенные жиры + магний"),
-            ("🧁 маффины с цуккини и морковью", "овощи в десерте + витамины"),
-            ("🍪 печенье из нута и арахисовой пасты", "растительный белок + полезные жиры"),
-            ("🥮 энергетические шарики из сухофруктов", "быстрая энергия + клетчатка"),
-            ("🍨 парфе из греческого йогурта и гранолы", "пробиотики + цельнозерновые")
-        ]
-        
-        # Специи и ароматизаторы для десертов
-        self.dessert_flavors = [
-            "☕ ваниль натуральная стручковая",
-            "🌿 корица цейлонская (регулирует уровень сахара)",
-            "🍂 мускатный орех свежемолотый",
-            "🍊 цедра апельсина или лимона",
-            "🌺 кардамон молотый",
-            "🌸 экстракт миндаля натуральный",
-            "🍃 мята свежая",
-            "🔥 имбирь свежий тертый",
-            "🌰 экстракт кокоса"
-        ]
-        
+        # Подсластители, белковые основы, жиры, клетчатка, типы десертов и ароматизаторы
+        # берутся из файла контента и обновляются без перезапуска
+        self.library = library or content_library
+        self.apply_library(self.library.get('desserts'))
+        self.library.subscribe('desserts', self.apply_library, validate=self.validate_library)
+
         # Для отслеживания использованных комбинаций
         self.used_combinations = set()
+
+    def validate_library(self, desserts):
+        keys = [key for key in ContentLibrary.SECTIONS['desserts'] if key != 'dessert_types']
+        require_string_lists('desserts', desserts, keys)
+        dessert_types = desserts.get('dessert_types')
+        if not isinstance(dessert_types, list) or not dessert_types or not all(
+                isinstance(item, (list, tuple)) and len(item) == 2 and all(isinstance(part, str) for part in item)
+                for item in dessert_types):
+            raise ValueError("desserts.dessert_types должен быть списком пар [тип, польза]")
+
+    def apply_library(self, desserts):
+        """Подменяет библиотеки десертов целиком; использованные комбинации сохраняются"""
+        # Сначала собираем все списки: ошибка в данных не должна оставить половину старых
+        libraries = {key: list(desserts[key]) for key in ContentLibrary.SECTIONS['desserts']}
+        libraries['dessert_types'] = [tuple(item) for item in libraries['dessert_types']]
+        self.healthy_sweeteners = libraries['healthy_sweeteners']
+        self.protein_bases = libraries['protein_bases']
+        self.healthy_fats = libraries['healthy_fats']
+        self.fiber_sources = libraries['fiber_sources']
+        self.dessert_types = libraries['dessert_types']
+        self.dessert_flavors = libraries['dessert_flavors']
+        return {"dessert_types": len(self.dessert_types)}
         
-    def get_dessert_template(self, day_of_week=None):
-        """Генерирует уникальный шаблон десерта с учетом дня недели"""
+    def get_dessert_template(self, day_of_week=None, record=True):
+        """Генерирует уникальный шаблон десерта с учетом дня недели.
+
+        record=False не занимает комбинацию в used_combinations - для резервных
+        постов, которые собираются заранее и могут так и не уйти в канал.
+        """
         import hashlib
         
         # Выбираем тип десерта в зависимости от дня недели
@@ -346,7 +1050,7 @@ class HealthyDessertManager:
         ).hexdigest()[:8]
         
         # Проверяем, не использовалась ли эта комбинация
-        if combo_hash in self.used_combinations:
+        if record and combo_hash in self.used_combinations:
             # Пробуем другую комбинацию
             sweetener = random.choice([s for s in self.healthy_sweeteners 
                                       if s != sweetener])
@@ -354,11 +1058,12 @@ class HealthyDessertManager:
                 f"{dessert_type}_{sweetener[:10]}_{protein_base[:10]}".encode()
             ).hexdigest()[:8]
         
-        self.used_combinations.add(combo_hash)
-        
-        # Очистка старых комбинаций (сохраняем только последние 50)
-        if len(self.used_combinations) > 50:
-            self.used_combinations = set(list(self.used_combinations)[-50:])
+        if record:
+            self.used_combinations.add(combo_hash)
+            
+            # Очистка старых комбинаций (сохраняем только последние 50)
+            if len(self.used_combinations) > 50:
+                self.used_combinations = set(list(self.used_combinations)[-50:])
         
         # Рассчитываем нутрициональные значения
         calories = random.randint(180, 280)
@@ -480,8 +1185,14 @@ class HealthyDessertManager:
 # ========== УСИЛЕННАЯ СИСТЕМА KEEP-ALIVE ==========
 
 class EnhancedKeepAlive:
-    def __init__(self):
+    def __init__(self, http_client=None, runtime=None, monitor=None):
+        self.http = http_client or http_clients.get('keep_alive')
+        self.runtime = runtime or background_runtime
+        self.monitor = monitor or service_monitor
+        self.mode = Config.KEEP_ALIVE_MODE
+        self.external_url = Config.KEEP_ALIVE_EXTERNAL_URL.rstrip('/')
         self.ping_count = 0
+        self.external_pings = 0
         self.last_ping_time = None
         self.failed_pings = 0
         self.max_failed_pings = 3
@@ -491,23 +1202,18 @@ class EnhancedKeepAlive:
         """Многоуровневый пинг для предотвращения сна"""
         with self.ping_lock:
             try:
-                port = int(os.environ.get('PORT', 8080))
                 current_time = datetime.now()
 
-                # Уровень 1: Пинг здоровья
-                health_response = requests.get(f"http://localhost:{port}/health", timeout=5)
-
-                # Уровень 2: Пинг дашборда
-                dashboard_response = requests.get(f"http://localhost:{port}/", timeout=10)
-
-                # Уровень 3: Активация планировщика
-                schedule.run_pending()
+                if self.mode == 'http':
+                    status = self._ping_localhost()
+                else:
+                    status = self._check_heartbeats()
 
                 self.ping_count += 1
                 self.last_ping_time = current_time
                 self.failed_pings = 0
 
-                logger.info(f"✅ Keep-alive #{self.ping_count} | Health: {health_response.status_code}")
+                logger.info(f"✅ Keep-alive #{self.ping_count} | {status}")
 
                 # Периодический отчет
                 if self.ping_count % 10 == 0:
@@ -521,33 +1227,47 @@ class EnhancedKeepAlive:
                     logger.error("🚨 КРИТИЧЕСКАЯ ОШИБКА: Слишком много failed pings!")
                     self._emergency_restart()
 
+    def _ping_localhost(self):
+        """Режим http: запрос к собственному легкому эндпоинту"""
+        port = int(os.environ.get('PORT', 8080))
+        response = self.http.get(f"http://localhost:{port}/ping", timeout=5)
+        return f"Ping: {response.status_code}"
+
+    def _check_heartbeats(self):
+        """Режим heartbeat: проверяем фоновые циклы в памяти процесса без HTTP запросов"""
+        now = time.time()
+        loops = self.runtime.get_loops()
+        stalled = [loop.name for loop in loops if loop.is_stalled(now, Config.KEEP_ALIVE_STALL_SECONDS)]
+        if stalled:
+            raise RuntimeError(f"фоновые циклы не отвечают: {', '.join(stalled)}")
+
+        # Наружу ходим только если к сервису давно никто не обращался, иначе платформа и так видит трафик
+        idle_seconds = self.monitor.get_idle_seconds()
+        if self.external_url and idle_seconds >= Config.KEEP_ALIVE_IDLE_SECONDS:
+            response = self.http.get(f"{self.external_url}/ping", timeout=10)
+            self.external_pings += 1
+            return f"Циклов: {len(loops)} | Внешний пинг: {response.status_code}"
+        return f"Циклов: {len(loops)} | Простой: {int(idle_seconds)} сек"
+
     def _log_uptime_report(self):
         """Периодический отчет о работе"""
-        jobs = schedule.get_jobs()
-        logger.info(f"📊 Keep-alive отчет: {self.ping_count} пингов | Заданий: {len(jobs)}")
+        jobs_count = len(services.content_scheduler.timer.jobs)
+        logger.info(f"📊 Keep-alive отчет: {self.ping_count} пингов | Внешних: {self.external_pings} | Заданий: {jobs_count}")
 
     def _emergency_restart(self):
         """Аварийный перезапуск приложения"""
         logger.critical("🔄 АВАРИЙНЫЙ ПЕРЕЗАПУСК СИСТЕМЫ...")
         os.execv(sys.executable, ['python'] + sys.argv)
 
-# Инициализация enhanced keep-alive
-enhanced_keep_alive = EnhancedKeepAlive()
-
 def start_enhanced_keep_alive():
     """Запуск усиленной системы keep-alive"""
-    def keep_alive_cycle():
-        while True:
-            try:
-                enhanced_keep_alive.multi_layer_ping()
-                time.sleep(180)
-            except Exception as e:
-                logger.error(f"💥 Ошибка в keep-alive цикле: {e}")
-                time.sleep(60)
+    def keep_alive_step():
+        enhanced_keep_alive.multi_layer_ping()
+        return 180
 
-    keep_alive_thread = Thread(target=keep_alive_cycle, daemon=True)
-    keep_alive_thread.start()
+    loop = background_runtime.run_loop('keep-alive', keep_alive_step)
     logger.info("🚀 Keep-alive система запущена")
+    return loop
 
 # ========== СИСТЕМА БЕЗОПАСНОСТИ ==========
 
@@ -627,145 +1347,1484 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_CHANNEL = os.getenv('TELEGRAM_CHANNEL', '@ppsupershef')
     TELEGRAM_GROUP = os.getenv('TELEGRAM_GROUP', '@ppsupershef_chat')
+    # Чаты для публикаций по расписанию через запятую, например '@ppsupershef,@ppsupershef_chat'
+    TELEGRAM_PUBLISH_CHATS = os.getenv('TELEGRAM_PUBLISH_CHATS', TELEGRAM_CHANNEL)
     YANDEX_GPT_API_KEY = os.getenv('YANDEX_GPT_API_KEY')
     YANDEX_FOLDER_ID = os.getenv('YANDEX_FOLDER_ID', 'b1gb6o9sk0ajjfdaoev8')
     API_SECRET = os.getenv('API_SECRET', 'your-secret-key-here')
+    GPT_MAX_CONCURRENCY = int(os.getenv('GPT_MAX_CONCURRENCY', '2'))
+    GPT_TIMEOUT = float(os.getenv('GPT_TIMEOUT', '30'))
+    TELEGRAM_TIMEOUT = float(os.getenv('TELEGRAM_TIMEOUT', '30'))
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    ASYNC_RUNTIME = os.getenv('ASYNC_RUNTIME', 'false').lower() in ('1', 'true', 'yes')
+    RUNTIME_MAX_WORKERS = int(os.getenv('RUNTIME_MAX_WORKERS', '8'))
+    KEEP_ALIVE_MODE = os.getenv('KEEP_ALIVE_MODE', 'heartbeat')
+    KEEP_ALIVE_EXTERNAL_URL = os.getenv('KEEP_ALIVE_EXTERNAL_URL', os.getenv('RENDER_EXTERNAL_URL', ''))
+    KEEP_ALIVE_IDLE_SECONDS = float(os.getenv('KEEP_ALIVE_IDLE_SECONDS', '600'))
+    KEEP_ALIVE_STALL_SECONDS = float(os.getenv('KEEP_ALIVE_STALL_SECONDS', '600'))
+    # file координирует только процессы одного хоста (воркеры gunicorn одного dyno);
+    # web и worker из Procfile на разных хостах так не договорятся - нужен общий бэкенд или один из них
+    LEADER_BACKEND = os.getenv('LEADER_BACKEND', 'file')
+    LEADER_LOCK_PATH = os.getenv('LEADER_LOCK_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'leader.lock'))
+    LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '30'))
+    PREGENERATE_LOOKAHEAD_HOURS = float(os.getenv('PREGENERATE_LOOKAHEAD_HOURS', '6'))
+    PREGENERATE_MAX_POSTS = int(os.getenv('PREGENERATE_MAX_POSTS', '3'))
+    PREGENERATE_INTERVAL_SECONDS = int(os.getenv('PREGENERATE_INTERVAL_SECONDS', '300'))
+    DIVERSITY_HISTORY_SIZE = int(os.getenv('DIVERSITY_HISTORY_SIZE', '500'))
+    DIVERSITY_WINDOW = int(os.getenv('DIVERSITY_WINDOW', '100'))
+    DIVERSITY_THRESHOLD = float(os.getenv('DIVERSITY_THRESHOLD', '0.3'))
+    NEAR_DUP_BACKEND = os.getenv('NEAR_DUP_BACKEND', 'sqlite')
+    NEAR_DUP_PERMUTATIONS = int(os.getenv('NEAR_DUP_PERMUTATIONS', '96'))
+    NEAR_DUP_BANDS = int(os.getenv('NEAR_DUP_BANDS', '32'))
+    NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', '0.5'))
+    CONTENT_LIBRARY_PATH = os.getenv('CONTENT_LIBRARY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content_library.json'))
+    CONTENT_LIBRARY_POLL_SECONDS = float(os.getenv('CONTENT_LIBRARY_POLL_SECONDS', '30'))
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '500'))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+    CACHE_EVICTION_POLICY = os.getenv('CACHE_EVICTION_POLICY', 'lru')
+    CACHE_TYPE_QUOTAS = os.getenv('CACHE_TYPE_QUOTAS', 'dessert:60')
+    STORAGE_DB_PATH = os.getenv('STORAGE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ppsupershef.db'))
+    DEDUP_BACKEND = os.getenv('DEDUP_BACKEND', 'sqlite')
+    DEDUP_TTL_HOURS = float(os.getenv('DEDUP_TTL_HOURS', '168'))
+    DEDUP_MEMORY_SIZE = int(os.getenv('DEDUP_MEMORY_SIZE', '1000'))
+    TELEGRAM_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_RATE_PER_MINUTE', '20'))
+    TELEGRAM_BURST = int(os.getenv('TELEGRAM_BURST', '3'))
+    TELEGRAM_SENDER_THREADS = int(os.getenv('TELEGRAM_SENDER_THREADS', '4'))
+    TELEGRAM_SEND_WAIT_SECONDS = float(os.getenv('TELEGRAM_SEND_WAIT_SECONDS', '300'))
+    DASHBOARD_STATS_TTL_SECONDS = float(os.getenv('DASHBOARD_STATS_TTL_SECONDS', '15'))
+    DASHBOARD_PUSH_INTERVAL_SECONDS = float(os.getenv('DASHBOARD_PUSH_INTERVAL_SECONDS', '5'))
+    # Поток /events закрывается сам раньше таймаута воркера gunicorn (30 сек), браузер переподключается
+    DASHBOARD_STREAM_SECONDS = float(os.getenv('DASHBOARD_STREAM_SECONDS', '25'))
+    MEMBER_COUNT_REFRESH_SECONDS = float(os.getenv('MEMBER_COUNT_REFRESH_SECONDS', '300'))
+    MEMBER_HISTORY_SIZE = int(os.getenv('MEMBER_HISTORY_SIZE', '2016'))
     SERVER_TZ = pytz.timezone('UTC')
     KEMEROVO_TZ = pytz.timezone('Asia/Novokuznetsk')
 
-# ========== УЛУЧШЕННАЯ YANDEX GPT ИНТЕГРАЦИЯ ==========
+# ========== МЕТРИКИ ==========
 
-class EnhancedYandexGPTGenerator:
-    def __init__(self):
-        self.api_key = Config.YANDEX_GPT_API_KEY
-        self.folder_id = Config.YANDEX_FOLDER_ID
-        self.base_url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        
-        self.cache_manager = RenderCompatibleCache(ttl_days=7)
-        self.diversity_manager = RecipeDiversityManager()
-        self.dessert_manager = HealthyDessertManager()  # Добавляем менеджер десертов
-        
-        self.cache_hits = 0
-        self.cache_misses = 0
-        self.regeneration_attempts = 0
-        self.generation_lock = RLock()
-        
-        self._start_cache_cleanup()
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
-    def _start_cache_cleanup(self):
-        """Запускаем фоновую очистку кэша"""
-        def cleanup_worker():
-            while True:
-                time.sleep(3600)
-                try:
-                    cleaned = self.cache_manager.cleanup_expired()
-                    if cleaned > 0:
-                        logger.info(f"🔄 Фоновая очистка: удалено {cleaned} записей")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка фоновой очистки: {e}")
-        
-        cleanup_thread = Thread(target=cleanup_worker, daemon=True)
-        cleanup_thread.start()
-        logger.info("🔄 Фоновая очистка кэша запущена")
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
 
-    def generate_content(self, content_type, theme):
-        """Универсальная генерация контента с разделением типов"""
-        cache_key = self._create_cache_key(content_type, theme)
-        
-        # Первая проверка кэша без блокировки
-        cached_result = self.cache_manager.get(cache_key)
-        if cached_result:
-            self.cache_hits += 1
-            logger.info(f"✅ Используем кэшированный контент: {theme}")
-            return cached_result
-        
-        # Генерация с блокировкой для предотвращения дублирования
-        with self.generation_lock:
-            # Повторная проверка кэша после получения блокировки
-            cached_result = self.cache_manager.get(cache_key)
-            if cached_result:
-                self.cache_hits += 1
-                logger.info(f"✅ Используем кэшированный контент (после блокировки): {theme}")
-                return cached_result
-            
-            self.cache_misses += 1
-            logger.info(f"🔄 Генерируем новый контент: {theme}")
-            
-            max_attempts = 3
-            for attempt in range(max_attempts):
-                try:
-                    if not self.api_key or self.api_key == 'your-yandex-gpt-api-key':
-                        result = self._get_template_content(content_type, theme)
-                    else:
-                        # Для десертов используем специальный промпт
-                        if 'dessert' in content_type:
-                            result = self._generate_healthy_dessert_via_gpt(content_type, theme)
-                        else:
-                            result = self._generate_via_enhanced_gpt(content_type, theme)
-                    
-                    if not self.diversity_manager.check_similarity(result):
-                        self.cache_manager.set(cache_key, result)
-                        self.diversity_manager.record_recipe(result, content_type)
-                        
-                        if (self.cache_hits + self.cache_misses) % 10 == 0:
-                            self._log_cache_stats()
-                            
-                        return result
-                    else:
-                        self.regeneration_attempts += 1
-                        logger.warning(f"🔄 Контент слишком похож, пробуем снова... (попытка {attempt + 1})")
-                        time.sleep(1)  # Задержка между попытками
-                        continue
+class Metric:
+    """Базовая метрика: значения хранятся по кортежу значений меток"""
 
-                except Exception as e:
-                    logger.error(f"❌ Ошибка генерации контента (попытка {attempt + 1}): {e}")
-                    if attempt < max_attempts - 1:
-                        time.sleep(2)
-            
-            logger.warning("⚠️ Используем шаблонный контент после всех попыток")
-            return self._get_template_content(content_type, theme)
+    type_name = 'untyped'
 
-    def _create_cache_key(self, content_type, theme):
-        """Создает уникальный ключ кэша"""
-        normalized_theme = theme.lower().strip()
-        return f"{content_type}_{normalized_theme}_{hashlib.md5(normalized_theme.encode()).hexdigest()[:8]}"
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.metric_lock = Lock()
 
-    def _log_cache_stats(self):
-        """Логирует статистику использования кэша"""
-        total = self.cache_hits + self.cache_misses
-        if total > 0:
-            hit_rate = (self.cache_hits / total) * 100
-            cache_stats = self.cache_manager.get_stats()
-            diversity_stats = f"Попыток регенерации: {self.regeneration_attempts}"
-            logger.info(f"📊 Статистика кэша: {self.cache_hits}/{total} попаданий ({hit_rate:.1f}%), {diversity_stats}")
+    def _key(self, labels):
+        unknown = set(labels) - set(self.label_names)
+        if unknown:
+            raise ValueError(f"Метрика {self.name} не знает меток {sorted(unknown)}")
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
 
-    def get_cache_info(self):
-        """Возвращает информацию о состоянии кэша"""
-        cache_stats = self.cache_manager.get_stats()
-        total_requests = self.cache_hits + self.cache_misses
-        
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        with self.metric_lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.metric_lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Значение задается явно или вычисляется функцией в момент выгрузки"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.metric_lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _render_samples(self):
+        if self.function:
+            try:
+                return [f"{self.name} {self.function()}"]
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        return super()._render_samples()
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.metric_lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_samples(self):
+        with self.metric_lock:
+            values = [(key, (list(state[0]), state[1], state[2])) for key, state in self.values.items()]
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Реестр метрик процесса, выгружаемый в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.registry_lock = Lock()
+
+    def _register(self, metric_class, name, help_text, label_names=(), **kwargs):
+        with self.registry_lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, help_text, label_names, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter, name, help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def render(self):
+        with self.registry_lock:
+            metrics_list = list(self.metrics.values())
+        lines = []
+        for metric in metrics_list:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+gpt_request_seconds = metrics.histogram(
+    'gpt_request_duration_seconds', 'Задержка запросов к Yandex GPT', ['content_type'])
+gpt_requests_total = metrics.counter(
+    'gpt_requests_total', 'Запросы к Yandex GPT по коду ответа', ['content_type', 'status'])
+gpt_regenerations_total = metrics.counter(
+    'gpt_regenerations_total', 'Повторные генерации из-за схожести с прошлыми рецептами', ['content_type'])
+gpt_cache_requests_total = metrics.counter(
+    'gpt_cache_requests_total', 'Обращения к кэшу генераций: hit, miss, coalesced', ['result'])
+diversity_similarity = metrics.histogram(
+    'diversity_similarity_score', 'Схожесть новых генераций с историей', ['category'],
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1))
+gpt_cache_evictions_total = metrics.counter(
+    'gpt_cache_evictions_total', 'Вытеснения из кэша генераций по причине', ['reason'])
+telegram_send_seconds = metrics.histogram(
+    'telegram_send_duration_seconds', 'Задержка вызова sendMessage')
+telegram_responses_total = metrics.counter(
+    'telegram_responses_total', 'Ответы Telegram API по коду', ['code'])
+telegram_queue_wait_seconds = metrics.histogram(
+    'telegram_queue_wait_seconds', 'Ожидание сообщения в очереди отправки', ['priority'])
+telegram_messages_total = metrics.counter(
+    'telegram_messages_total', 'Итог отправки сообщений: sent, missed', ['result'])
+telegram_publish_total = metrics.counter(
+    'telegram_publish_total', 'Публикации по всем чатам: full, partial, failed', ['outcome'])
+scheduler_lateness_seconds = metrics.histogram(
+    'scheduler_lateness_seconds', 'Опоздание запуска заданий расписания', ['slot'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300))
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP запросов', ['endpoint'])
+
+# ========== HTTP КЛИЕНТЫ С ПУЛОМ СОЕДИНЕНИЙ ==========
+
+class HttpClient:
+    """Keep-alive сессия с пулом соединений и повторами для одного внешнего сервиса"""
+
+    def __init__(self, name, timeout, pool_size, retries):
+        self.name = name
+        self.timeout = timeout
+        # Повторы запросов только для идемпотентных GET; POST повторяется лишь при ошибке соединения
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            backoff_factor=0.5,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.requests_made = 0
+        self.stats_lock = Lock()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        with self.stats_lock:
+            self.requests_made += 1
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get_stats(self):
+        """Счетчики запросов и переиспользования соединений"""
+        pools = self.adapter.poolmanager.pools
+        try:
+            connections_opened = sum(pools[key].num_connections for key in pools.keys())
+        except Exception:
+            connections_opened = 0
         return {
-            **cache_stats,
-            "cache_hits": self.cache_hits,
-            "cache_misses": self.cache_misses,
-            "regeneration_attempts": self.regeneration_attempts,
-            "hit_rate": round((self.cache_hits / total_requests) * 100, 1) if total_requests > 0 else 0,
-            "total_requests": total_requests,
-            "unique_ingredients_used": len(self.diversity_manager.used_ingredients),
-            "cooking_methods_used": len(self.diversity_manager.used_cooking_methods),
-            "dessert_combinations": len(self.dessert_manager.used_combinations) if hasattr(self.dessert_manager, 'used_combinations') else 0
+            "requests": self.requests_made,
+            "connections_opened": connections_opened,
+            "connections_reused": max(self.requests_made - connections_opened, 0),
+            "timeout": self.timeout
         }
 
-    def clear_cache(self):
-        """Очищает весь кэш"""
+class HttpClientPool:
+    """Общий реестр HTTP клиентов: один пул соединений на каждый внешний сервис"""
+
+    def __init__(self):
+        self.clients = {}
+        self.pool_lock = Lock()
+
+    def get(self, name):
+        with self.pool_lock:
+            if name not in self.clients:
+                timeouts = {
+                    'yandex_gpt': Config.GPT_TIMEOUT,
+                    'telegram': Config.TELEGRAM_TIMEOUT,
+                    'keep_alive': 10
+                }
+                self.clients[name] = HttpClient(
+                    name,
+                    timeout=timeouts.get(name, 30),
+                    pool_size=Config.HTTP_POOL_SIZE,
+                    retries=Config.HTTP_RETRIES
+                )
+            return self.clients[name]
+
+    def get_stats(self):
+        with self.pool_lock:
+            clients = dict(self.clients)
+        return {name: client.get_stats() for name, client in clients.items()}
+
+http_clients = HttpClientPool()
+
+# ========== ФОНОВЫЙ РАНТАЙМ ==========
+
+class BackgroundLoop:
+    """Периодическая фоновая задача: шаг возвращает паузу в секундах до следующего запуска"""
+
+    def __init__(self, name, step, retry_delay=60, initial_delay=0, step_budget=None):
+        self.name = name
+        self.step = step
+        self.retry_delay = retry_delay
+        # Сколько может длиться один шаг, прежде чем цикл сочтут зависшим (None - общий порог keep-alive)
+        self.step_budget = step_budget
+        self.in_step = False
+        self.step_started = None
+        self.cancelled = False
+        self.ticks = 0
+        self.errors = 0
+        self.last_tick = None
+        self.next_tick = time.time() + initial_delay
+        self.last_error = None
+        self.waker = None
+
+    def run_step(self):
+        """Выполняет один шаг и фиксирует heartbeat; ошибки не останавливают цикл"""
+        self.step_started = time.time()
+        self.in_step = True
         try:
-            cleared_count = self.cache_manager.clear_all()
-            self.cache_hits = 0
-            self.cache_misses = 0
-            self.regeneration_attempts = 0
+            delay = self.step()
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            logger.error(f"💥 Ошибка в фоновом цикле {self.name}: {e}")
+            delay = self.retry_delay
+        finally:
+            self.in_step = False
+        delay = delay if delay is not None else self.retry_delay
+        self.ticks += 1
+        self.last_tick = time.time()
+        self.next_tick = self.last_tick + delay
+        return delay
+
+    def is_stalled(self, now, grace):
+        """Цикл завис: шаг не начался через grace секунд после срока
+        или идет дольше своего бюджета (по умолчанию тоже grace). Долгий, но живой шаг зависанием не считается"""
+        if self.cancelled:
+            return False
+        if self.in_step:
+            return now - self.step_started > (self.step_budget or grace)
+        return now > self.next_tick + grace
+
+    def wake(self):
+        """Запускает следующий шаг немедленно, не дожидаясь паузы"""
+        if self.waker:
+            self.waker()
+
+    def cancel(self):
+        self.cancelled = True
+        self.wake()
+
+    def get_stats(self):
+        return {
+            "ticks": self.ticks,
+            "errors": self.errors,
+            "last_tick": datetime.fromtimestamp(self.last_tick).isoformat() if self.last_tick else None,
+            "last_error": self.last_error,
+            "next_tick": datetime.fromtimestamp(self.next_tick).isoformat(),
+            "in_step": self.in_step,
+            "step_started": datetime.fromtimestamp(self.step_started).isoformat() if self.step_started else None,
+            "running": not self.cancelled
+        }
+
+class ThreadRuntime:
+    """Каждый фоновый цикл в своем daemon-потоке (режим по умолчанию)"""
+
+    name = 'threads'
+
+    def __init__(self, max_workers):
+        self.stop_event = Event()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bg-worker')
+        self.loops = {}
+        self.threads = []
+        self.runtime_lock = Lock()
+
+    def run_loop(self, name, step, initial_delay=0, retry_delay=60, blocking=True, step_budget=None):
+        loop = BackgroundLoop(name, step, retry_delay, initial_delay, step_budget)
+        wake_event = Event()
+        loop.waker = wake_event.set
+
+        def run():
+            delay = initial_delay
+            while True:
+                if delay:
+                    wake_event.wait(delay)
+                    wake_event.clear()
+                if loop.cancelled or self.stop_event.is_set():
+                    break
+                delay = loop.run_step()
+
+        thread = Thread(target=run, daemon=True, name=name)
+        with self.runtime_lock:
+            self.loops[name] = loop
+            self.threads.append(thread)
+        thread.start()
+        return loop
+
+    def submit(self, func, *args, **kwargs):
+        """Выполняет блокирующий вызов в ограниченном пуле потоков, возвращает Future"""
+        return self.executor.submit(func, *args, **kwargs)
+
+    def stop(self, timeout=5):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        with self.runtime_lock:
+            loops = list(self.loops.values())
+            threads = list(self.threads)
+        for loop in loops:
+            loop.cancel()
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_loops(self):
+        with self.runtime_lock:
+            return list(self.loops.values())
+
+    def get_stats(self):
+        with self.runtime_lock:
+            loops = dict(self.loops)
+        return {
+            "runtime": self.name,
+            "threads": sum(1 for thread in self.threads if thread.is_alive()),
+            "loops": {name: loop.get_stats() for name, loop in loops.items()}
+        }
+
+class AsyncRuntime:
+    """Все фоновые циклы - корутины одного event loop; блокирующий I/O уходит в ограниченный пул"""
+
+    name = 'asyncio'
+
+    def __init__(self, max_workers):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bg-worker')
+        self.loop.set_default_executor(self.executor)
+        self.loops = {}
+        self.tasks = {}
+        self.runtime_lock = Lock()
+        self.stopped = False
+        self.thread = Thread(target=self._run, daemon=True, name='asyncio-runtime')
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _sleep(self, wake_event, delay):
+        if not delay:
+            return
+        try:
+            await asyncio.wait_for(wake_event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        wake_event.clear()
+
+    def run_loop(self, name, step, initial_delay=0, retry_delay=60, blocking=True, step_budget=None):
+        """blocking=False выполняет шаг прямо в event loop: только для быстрых неблокирующих шагов"""
+        loop = BackgroundLoop(name, step, retry_delay, initial_delay, step_budget)
+
+        async def runner():
+            wake_event = asyncio.Event()
+            loop.waker = lambda: self.loop.call_soon_threadsafe(wake_event.set)
+            delay = initial_delay
+            while True:
+                await self._sleep(wake_event, delay)
+                if loop.cancelled:
+                    break
+                if blocking:
+                    delay = await self.loop.run_in_executor(None, loop.run_step)
+                else:
+                    delay = loop.run_step()
+
+        def create_task():
+            self.tasks[name] = self.loop.create_task(runner(), name=name)
+
+        with self.runtime_lock:
+            self.loops[name] = loop
+        self.loop.call_soon_threadsafe(create_task)
+        return loop
+
+    def submit(self, func, *args, **kwargs):
+        """Планирует блокирующий вызов из любого потока, возвращает concurrent Future"""
+        async def call():
+            return await self.loop.run_in_executor(None, partial(func, *args, **kwargs))
+        return asyncio.run_coroutine_threadsafe(call(), self.loop)
+
+    def stop(self, timeout=5):
+        with self.runtime_lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            loops = list(self.loops.values())
+        for loop in loops:
+            loop.cancelled = True
+
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"⚠️ Не все фоновые задачи завершились: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_loops(self):
+        with self.runtime_lock:
+            return list(self.loops.values())
+
+    def get_stats(self):
+        with self.runtime_lock:
+            loops = dict(self.loops)
+        return {
+            "runtime": self.name,
+            "threads": 1 if self.thread.is_alive() else 0,
+            "loops": {name: loop.get_stats() for name, loop in loops.items()}
+        }
+
+def create_runtime():
+    """Выбирает фоновый рантайм по конфигурации"""
+    if Config.ASYNC_RUNTIME:
+        return AsyncRuntime(Config.RUNTIME_MAX_WORKERS)
+    return ThreadRuntime(Config.RUNTIME_MAX_WORKERS)
+
+background_runtime = create_runtime()
+
+# ========== ВЫБОР ЛИДЕРА ==========
+
+class LeaderBackend(ABC):
+    """Базовый бэкенд аренды лидерства; для Redis и т.п. достаточно реализовать эти методы"""
+
+    name = 'base'
+
+    @abstractmethod
+    def try_acquire(self, holder_id, lease_seconds):
+        """Захватывает или продлевает аренду; True, если holder_id - лидер"""
+
+    @abstractmethod
+    def release(self, holder_id):
+        """Отдает аренду, если ее держит holder_id"""
+
+class NoopLeaderBackend(LeaderBackend):
+    """Без выборов: каждый процесс считает себя лидером (один процесс на хосте)"""
+
+    name = 'none'
+
+    def try_acquire(self, holder_id, lease_seconds):
+        return True
+
+    def release(self, holder_id):
+        pass
+
+class FileLockLeaderBackend(LeaderBackend):
+    """Эксклюзивная блокировка файла: ОС снимает ее сама, если процесс-лидер умер.
+    Работает только между процессами, видящими один и тот же файл, т.е. на одном хосте"""
+
+    name = 'file'
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.handle = None
+
+    def try_acquire(self, holder_id, lease_seconds):
+        if self.handle:
+            return True
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(holder_id)
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def release(self, holder_id):
+        if self.handle:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+class SQLiteLeaderBackend(LeaderBackend):
+    """Аренда строкой в SQLite: лидер продлевает срок, после истечения его забирает другой процесс"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, lease_name='scheduler'):
+        self.lease_name = lease_name
+        self.conn = open_sqlite(path)
+        self.db_lock = Lock()
+        with self.db_lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS leader_lease ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def try_acquire(self, holder_id, lease_seconds):
+        now = time.time()
+        with self.db_lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT holder, expires_at FROM leader_lease WHERE name = ?", (self.lease_name,)
+                ).fetchone()
+                acquired = row is None or row[0] == holder_id or row[1] < now
+                if acquired:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO leader_lease (name, holder, expires_at) VALUES (?, ?, ?)",
+                        (self.lease_name, holder_id, now + lease_seconds)
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def release(self, holder_id):
+        with self.db_lock:
+            self.conn.execute(
+                "DELETE FROM leader_lease WHERE name = ? AND holder = ?", (self.lease_name, holder_id)
+            )
+
+def create_leader_backend():
+    """Создает бэкенд выбора лидера согласно конфигурации"""
+    backend = Config.LEADER_BACKEND.lower()
+    if backend == 'none':
+        return NoopLeaderBackend()
+    if backend == 'file' and fcntl is not None:
+        if os.getenv('DYNO'):
+            # Каждый dyno - отдельный хост: web и worker получат по своему файлу и оба станут лидерами
+            logger.warning(f"⚠️ Выбор лидера через файл не связывает dyno между собой ({os.getenv('DYNO')}): "
+                           f"оставьте запущенным только web или worker, либо задайте общий LEADER_BACKEND")
+        return FileLockLeaderBackend(Config.LEADER_LOCK_PATH)
+    if backend == 'file':
+        logger.warning("⚠️ fcntl недоступен, выбор лидера через SQLite")
+    return SQLiteLeaderBackend(Config.STORAGE_DB_PATH)
+
+class LeaderElection:
+    """Следит за арендой лидерства и запускает/останавливает сервисы лидера"""
+
+    def __init__(self, backend=None, runtime=None, lease_seconds=None):
+        self.backend = backend or create_leader_backend()
+        self.runtime = runtime or background_runtime
+        self.lease_seconds = lease_seconds or Config.LEADER_LEASE_SECONDS
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.elected_at = None
+        self.failovers = 0
+        self.on_elected = None
+        self.on_demoted = None
+        self.loop = None
+        # Сервисы лидера запускаются в пуле рантайма: продление аренды не ждет их старта
+        self.services_running = False
+        self.transition_lock = Lock()
+
+    def start(self, on_elected, on_demoted=None):
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        # Продлеваем аренду трижды за срок, чтобы пережить одну неудачную попытку
+        self.loop = self.runtime.run_loop('leader-election', self._check, retry_delay=self.lease_seconds / 3)
+        logger.info(f"🗳️ Выбор лидера запущен ({self.backend.name}, процесс {self.holder_id})")
+
+    def _check(self):
+        try:
+            acquired = self.backend.try_acquire(self.holder_id, self.lease_seconds)
+        except Exception as e:
+            logger.error(f"❌ Ошибка продления аренды лидера: {e}")
+            acquired = False
+
+        if acquired and not self.is_leader:
+            self.is_leader = True
+            self.elected_at = datetime.now()
+            self.failovers += 1
+            logger.info(f"👑 Процесс {self.holder_id} стал лидером, запускаем планировщик")
+            self.runtime.submit(self._sync_services)
+        elif not acquired and self.is_leader:
+            self.is_leader = False
+            logger.warning(f"⚠️ Процесс {self.holder_id} потерял лидерство, останавливаем планировщик")
+            self.runtime.submit(self._sync_services)
+        return self.lease_seconds / 3
+
+    def _sync_services(self):
+        """Приводит сервисы к текущему статусу лидера; повторные смены статуса во время старта
+        догоняются в том же вызове, поэтому порядок запуска и остановки не путается"""
+        with self.transition_lock:
+            while self.services_running != self.is_leader:
+                if self.is_leader:
+                    self.services_running = True
+                    callback = self.on_elected
+                else:
+                    self.services_running = False
+                    callback = self.on_demoted
+                if not callback:
+                    continue
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка смены статуса лидера: {e}")
+
+    def stop(self):
+        if self.loop:
+            self.loop.cancel()
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                self.backend.release(self.holder_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось освободить аренду лидера: {e}")
+
+    def get_stats(self):
+        return {
+            "backend": self.backend.name,
+            "holder_id": self.holder_id,
+            "is_leader": self.is_leader,
+            "elected_at": self.elected_at.isoformat() if self.elected_at else None,
+            "elections_won": self.failovers,
+            "lease_seconds": self.lease_seconds
+        }
+
+# ========== БИБЛИОТЕКА КОНТЕНТА ==========
+# Списки продуктов, десертов, фото, триггеры и расписание живут в версионируемом
+# JSON файле; правка файла подхватывается без перезапуска процесса
+
+def _method_ref(callback):
+    """Слабая ссылка на связанный метод, чтобы подписка не держала объект живым"""
+    if callback is None:
+        return lambda: None
+    if hasattr(callback, '__self__'):
+        return weakref.WeakMethod(callback)
+    return lambda: callback
+
+def require_string_lists(section, data, keys):
+    """Проверяет, что в разделе есть непустые списки строк под всеми ключами; иначе ValueError"""
+    for key in keys:
+        values = data.get(key) if isinstance(data, dict) else None
+        if not isinstance(values, list) or not values or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{section}.{key} должен быть непустым списком строк")
+
+class ContentLibrary:
+    """Контентные библиотеки из JSON файла с горячей перезагрузкой"""
+
+    # Раздел -> обязательные ключи; без них файл не применяется целиком
+    SECTIONS = {
+        'diversity': ('protein_sources', 'vegetable_rotation', 'cooking_methods', 'cuisine_styles'),
+        'desserts': ('healthy_sweeteners', 'protein_bases', 'healthy_fats', 'fiber_sources',
+                     'dessert_types', 'dessert_flavors'),
+        'visual': ('food_photos', 'emotional_triggers'),
+        'schedule': ()
+    }
+
+    def __init__(self, path=None, runtime=None, poll_interval=None):
+        self.path = path or Config.CONTENT_LIBRARY_PATH
+        self.runtime = runtime
+        self.poll_interval = Config.CONTENT_LIBRARY_POLL_SECONDS if poll_interval is None else poll_interval
+        self.data = None
+        self.version = None
+        self.checksum = None
+        self.mtime = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.last_error = None
+        self.subscribers = []
+        self.library_lock = RLock()
+        self.loop = None
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        mtime = os.path.getmtime(self.path)
+        data = json.loads(raw.decode('utf-8'))
+        missing = []
+        for section, keys in self.SECTIONS.items():
+            if section not in data:
+                missing.append(section)
+            else:
+                missing.extend(f"{section}.{key}" for key in keys if key not in data[section])
+        if missing:
+            raise ValueError(f"в файле нет разделов {missing}")
+        # JSON не хранит int-ключи и кортежи - возвращаем их форму из кода
+        data['schedule'] = {int(day): events for day, events in data['schedule'].items()}
+        data['desserts']['dessert_types'] = [tuple(item) for item in data['desserts']['dessert_types']]
+        return data, hashlib.sha256(raw).hexdigest(), mtime
+
+    def get(self, section):
+        """Раздел библиотеки; файл читается при первом обращении"""
+        with self.library_lock:
+            if self.data is None:
+                self.data, self.checksum, self.mtime = self._read()
+                self.version = self.data.get('version')
+                self.loaded_at = datetime.now()
+                logger.info(f"📚 Библиотека контента v{self.version} загружена из {self.path}")
+            return self.data[section]
+
+    def subscribe(self, section, apply, validate=None):
+        """apply(раздел) применяет новую версию раздела; validate(раздел) может отклонить ее через ValueError"""
+        with self.library_lock:
+            self.subscribers.append((section, _method_ref(apply), _method_ref(validate)))
+
+    def reload(self, force=False):
+        """Перечитывает файл и раздает новую версию подписчикам, если содержимое изменилось.
+        Невалидный файл не применяется: остается предыдущая версия"""
+        with self.library_lock:
+            try:
+                data, checksum, mtime = self._read()
+                self.mtime = mtime
+                if checksum == self.checksum and not force:
+                    return {"status": "unchanged", "version": self.version}
+
+                self.subscribers = [sub for sub in self.subscribers if sub[1]() is not None]
+                # Подписчикам достаются только разделы, которые действительно изменились
+                changed = [section for section in self.SECTIONS
+                           if force or self.data is None or data[section] != self.data[section]]
+                subscribers = [(section, apply(), validate()) for section, apply, validate in self.subscribers
+                               if section in changed]
+                subscribers = [item for item in subscribers if item[1] is not None]
+                # Сначала проверяют все, применяют только если никто не возразил
+                for section, apply, validate in subscribers:
+                    if validate:
+                        validate(data[section])
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self.last_error = str(e)
+                logger.error(f"❌ Библиотека контента не перезагружена: {e}")
+                return {"status": "error", "message": str(e), "version": self.version}
+
+            changes = {}
+            applied = []
+            for section, apply, validate in subscribers:
+                try:
+                    result = apply(data[section])
+                except Exception as e:
+                    logger.error(f"❌ Ошибка применения библиотеки контента ({section}): {e}")
+                    self._rollback(applied)
+                    self.last_error = f"{section}: {e}"
+                    return {"status": "error", "message": self.last_error, "version": self.version}
+                applied.append((section, apply))
+                if result is not None:
+                    changes[section] = result
+
+            self.data, self.checksum = data, checksum
+            self.version = data.get('version')
+            self.loaded_at = datetime.now()
+            self.reloads += 1
+            self.last_error = None
+
+        logger.info(f"📚 Библиотека контента перезагружена: v{self.version}")
+        return {"status": "reloaded", "version": self.version, "sections": changed, "changes": changes}
+
+    def _rollback(self, applied):
+        """Возвращает подписчикам, уже получившим новую версию, прежние разделы"""
+        for section, apply in reversed(applied):
+            try:
+                apply(self.data[section])
+            except Exception as e:
+                logger.error(f"❌ Не удалось вернуть прежнюю версию библиотеки ({section}): {e}")
+
+    def watch(self):
+        """Запускает опрос mtime файла; при нулевом интервале перезагрузка только вручную"""
+        if self.loop is not None or self.poll_interval <= 0:
+            return
+        runtime = self.runtime or background_runtime
+        self.loop = runtime.run_loop('content-library', self._poll,
+                                     initial_delay=self.poll_interval, retry_delay=self.poll_interval)
+
+    def _poll(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != self.mtime:
+            # Запоминаем сразу: битый файл не должен повторять ошибку на каждом опросе
+            self.mtime = mtime
+            self.reload()
+        return self.poll_interval
+
+    def get_stats(self):
+        return {
+            "path": self.path,
+            "version": self.version,
+            "checksum": self.checksum[:12] if self.checksum else None,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "subscribers": [section for section, _, _ in self.subscribers],
+            "poll_interval_seconds": self.poll_interval
+        }
+
+content_library = ContentLibrary()
+
+# ========== ШАБЛОНЫ И ПЛАН КОНТЕНТА ==========
+# Таблицы собираются один раз при импорте и не меняются: шаблоны нужны именно
+# тогда, когда GPT недоступен, и не должны пересобираться на каждый вызов
+
+NUTRITION_TEMPLATES = MappingProxyType({
+    'monday_science': """🧠 <b>НЕЙРОПИТАНИЕ ДЛЯ СТАРТА НЕДЕЛИ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+📈 Понедельник - пик выработки кортизола и норадреналина
+🧠 Требуется усиленная нейроподдержка для запуска когнитивных процессов
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 🥚 Завтрак с яйцами (холин для ацетилхолина)
+• 🐟 Омега-3 для восстановления нейронных связей
+• 💧 Усиленная гидратация для детоксикации
+• 🥬 Листовая зелень для фолатов
+
+⚡ <b>РЕЗУЛЬТАТ:</b> Улучшение концентрации на 40%, снижение стресса на 25%""",
+
+    'tuesday_science': """💪 <b>БЕЛКОВЫЙ МЕТАБОЛИЗМ И ВОССТАНОВЛЕНИЕ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+🔄 Вторник - активация mTOR пути после понедельничных нагрузок
+💪 Оптимальное время для синтеза мышечного белка
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 🍗 Разнообразие белковых источников
+• ⏰ Равномерное распределение протеина
+• 🥛 Лейцин из молочных продуктов
+• 🌱 Растительные белки для микробиома
+
+💥 <b>РЕЗУЛЬТАТ:</b> Ускорение восстановления на 35%, улучшение состава тела""",
+
+    'wednesday_science': """🍃 <b>ДЕТОКС И ОЧИЩЕНИЕ В СЕРЕДИНЕ НЕДЕЛИ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+🔄 Среда - пик токсической нагрузки
+🫁 Активация систем детоксикации печени
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 🥦 Крестоцветные для глутатиона
+• 💧 Усиленный водный режим
+• 🍎 Пектины для связывания токсинов
+• 🥬 Клетчатка для микробиома
+
+🌿 <b>РЕЗУЛЬТАТ:</b> Снижение воспаления на 30%, улучшение пищеварения""",
+
+    'thursday_science': """⚡ <b>ЭНЕРГЕТИЧЕСКИЙ МЕТАБОЛИЗМ ДЛЯ ФИНАЛА</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+🔋 Четверг - истощение гликогеновых запасов
+⚡ Оптимизация митохондриальной функции
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 🍠 Сложные углеводы с низким ГИ
+• 🥑 Полезные жиры для мембран
+• 🔋 Кофакторы энергетического обмена
+• ⏰ Синхронизация с циркадными ритмами
+
+🚀 <b>РЕЗУЛЬТАТ:</b> Стабильная энергия на 6-8 часов, улучшение выносливости""",
+
+    'friday_science': """⭐ <b>БАЛАНС ПИТАНИЯ И ПСИХОЛОГИЯ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+🎯 Пятница - баланс между дофаминовой системой вознаграждения
+😊 Поддержание дисциплины питания
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 🎯 Принцип 80/20 для гибкости
+• 😊 Осознанное потребление
+• 🍫 Здоровые альтернативы
+• 👨‍👩‍👧‍👦 Социальный аспект питания
+
+🌈 <b>РЕЗУЛЬТАТ:</b> Снижение стресса питания на 45%, устойчивые привычки""",
+
+    'saturday_science': """👨‍👩‍👧‍👦 <b>СЕМЕЙНАЯ НУТРИЦИОЛОГИЯ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+❤️ Суббота - повышение окситоцина при совместных трапезах
+👶 Формирование пищевых привычек у детей
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 👪 Совместное приготовление пищи
+• 🎨 Вовлечение детей в процесс
+• 📚 Образовательный компонент
+• 💫 Создание традиций
+
+❤️ <b>РЕЗУЛЬТАТ:</b> Укрепление семейных связей, формирование здоровых привычек""",
+
+    'sunday_science': """📊 <b>ПЛАНИРОВАНИЕ ПИТАНИЯ НА НЕДЕЛЮ</b>
+
+🔬 <b>НАУЧНАЯ ОСНОВА:</b>
+🧠 Воскресенье - снижение decision fatigue при планировании
+⚡ Оптимизация когнитивных ресурсов на неделю
+
+💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
+• 📝 Составление меню на неделю
+• 🛒 Планирование закупок
+• 🍱 Подготовка ингредиентов
+• ⏱️ Оптимизация времени готовки
+
+🎯 <b>РЕЗУЛЬТАТ:</b> Экономия 5+ часов в неделю, снижение стресса на 60%"""
+})
+
+TRAINING_TEMPLATE_BODY = """⏱️ <b>ПРОГРАММА ТРЕНИРОВКИ:</b>
+• 🕐 Продолжительность: 30-45 минут
+• 🎯 Уровень: начальный/средний
+• 🏠 Оборудование: минимальное
+
+🏃‍♂️ <b>РАЗМИНКА (5-10 минут):</b>
+• 🚶‍♂️ Ходьба на месте
+• 🔄 Вращения суставами
+• 🤸‍♂️ Динамическая растяжка
+
+💪 <b>ОСНОВНАЯ ЧАСТЬ:</b>
+• 🏋️‍♂️ Упражнение 1: 3 подхода по 10-15 повторений
+• 🏋️‍♀️ Упражнение 2: 3 подхода по 10-15 повторений  
+• 🏋️ Упражнение 3: 3 подхода по 10-15 повторений
+
+🧘‍♂️ <b>ЗАМИНКА:</b>
+• 🤸‍♀️ Статическая растяжка 5-7 минут
+• 🌬️ Глубокое дыхание
+
+💡 <b>НАУЧНОЕ ОБОСНОВАНИЕ:</b>
+🏃‍♂️ Регулярные тренировки улучшают метаболизм
+❤️ Укрепляют сердечно-сосудистую систему
+💫 Повышают качество жизни"""
+
+# Базовые ингредиенты с эмодзи для шаблонных рецептов
+RECIPE_PROTEIN_OPTIONS = ("🍗 куриная грудка", "🥩 говядина", "🐟 треска", "🦐 креветки", "🥚 яйца")
+RECIPE_VEGGIE_OPTIONS = ("🥕 морковь", "🥦 брокколи", "🍅 помидоры", "🫑 перец", "🥬 шпинат")
+RECIPE_CARB_OPTIONS = ("🍚 гречка", "🌾 овсянка", "🥔 картофель", "🍠 батат")
+
+# Базовый шаблон десерта, если менеджер десертов не передал свой
+DEFAULT_DESSERT_TEMPLATE = MappingProxyType({
+    'type': "🍰 Чизкейк без выпечки",
+    'prep_time': "20 минут + 4 часа охлаждение",
+    'serves': "4 порции",
+    'storage': "5 дней в холодильнике",
+    'calories': 210,
+    'protein_g': 15,
+    'fiber_g': 8,
+    'gi': 28
+})
+
+FALLBACK_RECIPE_CONTENT = """
+📊 <b>ПИЩЕВАЯ ЦЕННОСТЬ НА ПОРЦИЮ:</b>
+• 🔥 Калории: 300-400 ккал
+• 🍗 Белки: 20-30 г
+• 🥑 Жиры: 15-25 g
+• 🌾 Углеводы: 20-30 г
+• 🌿 Клетчатка: 5-8 г
+
+🛒 <b>ИНГРЕДИЕНТЫ НА 4 ПОРЦИИ:</b>
+• 🥕 Свежие овощи и зелень
+• 🍗 Качественные белки  
+• 🌾 Полезные углеводы
+• 🫒 Полезные жиры
+• 🌶️ Специи и травы
+
+👨‍🍳 <b>ПРОЦЕСС ПРИГОТОВЛЕНИЯ:</b>
+<tg-spoiler>1. 🥣 Подготовить все ингредиенты
+2. 🍳 Следовать классическому рецепту
+3. 🔥 Готовить на среднем огне
+4. 🍽️ Подавать горячим для семьи</tg-spoiler>
+
+💡 <b>НАУЧНАЯ ПОЛЬЗА:</b>
+Сбалансированное сочетание нутриентов обеспечивает оптимальное питание для всей семьи."""
+
+# Слот расписания: метод generate_* -> что и как генерировать
+ContentSpec = namedtuple('ContentSpec', ['content_type', 'theme', 'benefits', 'day_of_week'])
+
+CONTENT_PLAN = MappingProxyType({
+    # НАУЧНЫЕ СОВЕТЫ НУТРИЦИОЛОГА ДЛЯ КАЖДОГО ДНЯ
+    'generate_monday_science': ContentSpec(
+        'monday_science', 'Нейропитание для старта недели',
+        '🧠 Улучшение когнитивных функций\n💡 Повышение концентрации внимания\n⚡ Снижение стрессовой нагрузки\n🌟 Оптимизация нейромедиаторного баланса',
+        'monday'),
+    'generate_tuesday_science': ContentSpec(
+        'tuesday_science', 'Белковый метаболизм и восстановление',
+        '💪 Ускорение синтеза мышечного белка\n🔄 Оптимизация аминокислотного профиля\n🌟 Улучшение восстановления после нагрузок\n🍗 Разнообразие белковых источников',
+        'tuesday'),
+    'generate_wednesday_science': ContentSpec(
+        'wednesday_science', 'Детокс и очищение в середине недели',
+        '🍃 Снижение воспалительных процессов\n💧 Улучшение детоксикационной функции\n🌟 Оптимизация работы ЖКТ\n🔄 Восстановление микробиома кишечника',
+        'wednesday'),
+    'generate_thursday_science': ContentSpec(
+        'thursday_science', 'Энергетический метаболизм для финала недели',
+        '⚡ Стабильное высвобождение энергии\n🔋 Улучшение митохондриальной функции\n🌟 Оптимизация углеводного обмена\n💪 Повышение выносливости',
+        'thursday'),
+    'generate_friday_science': ContentSpec(
+        'friday_science', 'Баланс питания и психология',
+        '⭐ Снижение стресса питания\n😊 Формирование здоровых отношений с едой\n🌟 Баланс между дисциплиной и гибкостью\n💫 Устойчивые пищевые привычки',
+        'friday'),
+    'generate_saturday_science': ContentSpec(
+        'saturday_science', 'Семейная нутрициология',
+        '👨‍👩‍👧‍👦 Укрепление семейных связей\n🍽️ Формирование здоровых привычек у детей\n💫 Создание пищевых традиций\n🌟 Совместное приготовление пищи',
+        'saturday'),
+    'generate_sunday_science': ContentSpec(
+        'sunday_science', 'Планирование питания на неделю',
+        '📊 Снижение decision fatigue на 35%\n💪 Повышение adherence к здоровому рациону на 68%\n🌟 Экономия времени и ресурсов\n🗓️ Оптимизация пищевого поведения',
+        'sunday'),
+    # ДОБАВЛЕННЫЕ МЕТОДЫ ДЛЯ ИСПРАВЛЕНИЯ ОШИБОК
+    'generate_mental_energy_lunch': ContentSpec(
+        'lunch', 'Обед для ментальной энергии',
+        '🧠 Поддержка когнитивных функций\n💡 Улучшение концентрации внимания\n⚡ Стабильное высвобождение энергии\n🌟 Оптимизация нейромедиаторного баланса',
+        'monday'),
+    'generate_neuro_recovery_dinner': ContentSpec(
+        'dinner', 'Ужин для восстановления нейронов',
+        '🧠 Восстановление нейронных связей\n💤 Улучшение качества сна\n🌙 Оптимизация процессов детоксикации\n🌟 Подготовка мозга к следующему дню',
+        'monday'),
+    'generate_neuro_advice': ContentSpec(
+        'advice', 'Совет: Нейропитание',
+        '🧠 Улучшение когнитивных функций\n💡 Повышение нейропластичности\n⚡ Оптимизация энергетического метаболизма\n🛡️ Нейропротекторное действие',
+        'monday'),
+    'generate_water_advice': ContentSpec(
+        'water_science', 'Совет: Оптимальная гидратация',
+        '💧 Роль воды в метаболизме\n🧠 Влияние на когнитивные функции\n🏃‍♂️ Гидратация при физических нагрузках\n🌡️ Регуляция температуры тела',
+        'tuesday'),
+    'generate_veggie_advice': ContentSpec(
+        'veggie_advice', 'Совет: Детокс питание',
+        '🥬 Источник витаминов и минералов\n🌿 Очищает организм\n💚 Профилактика заболеваний\n🌟 Улучшает здоровье',
+        'wednesday'),
+    'generate_carbs_advice': ContentSpec(
+        'carbs_advice', 'Совет: Сложные углеводы',
+        '⚡ Основной источник энергии\n🍞 Важны для активности\n💪 Поддерживают метаболизм\n🌟 Обеспечивают жизнедеятельность',
+        'thursday'),
+    'generate_balance_advice': ContentSpec(
+        'balance_advice', 'Совет: Принцип 80/20',
+        '⚖️ Оптимальное сочетание нутриентов\n💪 Поддержка всех систем\n🌟 Долгосрочное здоровье\n🛡️ Профилактика заболеваний',
+        'friday'),
+    'generate_family_advice': ContentSpec(
+        'family_advice', 'Совет: Питание для семьи',
+        '👨‍👩‍👧‍👦 Укрепление семейных связей\n😊 Формирование здоровых привычек\n💫 Создает теплую атмосферу\n🌟 Наследие для детей',
+        'saturday'),
+    'generate_planning_advice': ContentSpec(
+        'planning_advice', 'Совет: Meal prep стратегии',
+        '📋 Экономит время и деньги\n💪 Обеспечивает сбалансированность\n🌟 Помогает достичь целей\n🛡️ Гарантирует успех',
+        'sunday'),
+    # МЕТОД ДЛЯ АКТИВНЫХ ПЕРЕКУСОВ (ЕДИНСТВЕННЫЙ ОСТАВШИЙСЯ)
+    'generate_active_snacks': ContentSpec(
+        'active_snacks', 'Полезные перекусы для активного отдыха',
+        '⚡ Быстрое восстановление энергии\n💪 Поддержка мышечной массы\n🧠 Улучшение концентрации\n🏃‍♂️ Повышение выносливости',
+        'sunday'),
+    # СУЩЕСТВУЮЩИЕ МЕТОДЫ ДЛЯ РЕЦЕПТОВ
+    'generate_cognitive_breakfast': ContentSpec(
+        'breakfast', 'Завтрак для когнитивных функций',
+        '🧠 Улучшение памяти и концентрации\n💡 Повышение нейропластичности\n⚡ Стабильная энергия на 4-5 часов\n🛡️ Защита нейронов от окислительного стресса',
+        'monday'),
+    'generate_protein_rotation_breakfast': ContentSpec(
+        'breakfast', 'Завтрак с ротацией белков',
+        '💪 Разнообразие аминокислотного профиля\n🔄 Предотвращение пищевой непереносимости\n🌟 Оптимизация синтеза мышечного белка\n🍗 Альтернативные источники протеина',
+        'tuesday'),
+    'generate_novel_protein_lunch': ContentSpec(
+        'lunch', 'Обед с новым источником белка',
+        '💪 Расширение спектра аминокислот\n🆕 Предотвращение пищевой монотонности\n🌟 Стимуляция микробиома кишечника\n🍽️ Обогащение рациона новыми нутриентами',
+        'tuesday'),
+    'generate_seafood_dinner': ContentSpec(
+        'dinner', 'Ужин с морскими белками',
+        '🐟 Богатый источник Омега-3\n💪 Легкоусвояемый белок\n🦐 Микроэлементы (йод, селен, цинк)\n🌟 Поддержка сердечно-сосудистой системы',
+        'tuesday'),
+    'generate_veggie_breakfast': ContentSpec(
+        'breakfast', 'Овощной завтрак',
+        '🥬 Богат клетчаткой и витаминами\n🌿 Очищает организм\n💚 Легкий и полезный\n⚡ Дает заряд энергии',
+        'wednesday'),
+    'generate_veggie_lunch': ContentSpec(
+        'lunch', 'Овощной обед',
+        '🥬 Богат витаминами и минералами\n🌿 Очищает организм\n💚 Легкий и полезный\n⚡ Дает энергию',
+        'wednesday'),
+    'generate_veggie_dinner': ContentSpec(
+        'dinner', 'Овощной ужин',
+        '🥬 Легкий для пищеварения\n🌿 Богат клетчаткой\n💚 Способствует детоксу\n🌟 Очищает организм',
+        'wednesday'),
+    'generate_carbs_breakfast': ContentSpec(
+        'breakfast', 'Углеводный завтрак',
+        '⚡ Источник энергии\n🍞 Сложные углеводы\n💪 Поддерживает активность\n🌟 Надолго насыщает',
+        'thursday'),
+    'generate_carbs_lunch': ContentSpec(
+        'lunch', 'Углеводный обед',
+        '⚡ Восполняет энергию\n🍚 Сложные углеводы\n💪 Поддерживает активность\n🌟 Надолго насыщает',
+        'thursday'),
+    'generate_carbs_dinner': ContentSpec(
+        'dinner', 'Углеводный ужин',
+        '⚡ Восстанавливает энергию\n🍚 Сложные углеводы\n💪 Подготавливает к следующему дню\n🌟 Обеспечивает сон',
+        'thursday'),
+    'generate_balance_breakfast': ContentSpec(
+        'breakfast', 'Сбалансированный завтрак',
+        '⚡ Энергия и питательность\n💪 Белки для сытости\n🥬 Витамины для здоровья\n🌟 Идеальный баланс',
+        'friday'),
+    'generate_balance_lunch': ContentSpec(
+        'lunch', 'Сбалансированный обед',
+        '🍽️ Идеальное сочетание нутриентов\n💪 Поддержка энергии\n🌟 Оптимальное насыщение\n🛡️ Польза для здоровья',
+        'friday'),
+    'generate_balance_dinner': ContentSpec(
+        'dinner', 'Сбалансированный ужин',
+        '🌙 Легкий и питательный\n💪 Восстановление организма\n🌟 Подготовка ко сну\n🛡️ Оптимальное питание',
+        'friday'),
+    'generate_family_breakfast': ContentSpec(
+        'breakfast', 'Семейный завтрак',
+        '👨‍👩‍👧‍👦 Объединяет семью за столом\n😊 Вкусно и полезно для всех\n💫 Начинает день с радости\n🌟 Создает традиции',
+        'saturday'),
+    'generate_family_lunch': ContentSpec(
+        'lunch', 'Семейный обед',
+        '👨‍👩‍👧‍👦 Объединяет за обеденным столом\n😊 Вкусно и полезно для всех\n💫 Создает семейные традиции\n🌟 Укрепляет связи',
+        'saturday'),
+    'generate_family_dinner': ContentSpec(
+        'dinner', 'Семейный ужин',
+        '👨‍👩‍👧‍👦 Завершает день вместе\n😊 Вкусно и полезно\n💫 Создает теплую атмосферу\n🌟 Объединяет семью',
+        'saturday'),
+    'generate_sunday_breakfast': ContentSpec(
+        'breakfast', 'Воскресный бранч',
+        '🎉 Праздничное настроение\n👨‍👩‍👧‍👦 Идеально для семейного дня\n🍽️ Особенный вкус\n💫 Завершает неделю',
+        'sunday'),
+    'generate_sunday_lunch': ContentSpec(
+        'lunch', 'Воскресный обед',
+        '🎉 Праздничная атмосфера\n👨‍👩‍👧‍👦 Семейное время\n🍽️ Особенный вкус\n💫 Завершает выходные',
+        'sunday'),
+    'generate_week_prep_dinner': ContentSpec(
+        'dinner', 'Ужин для подготовки к неделе',
+        '📋 Закладывает основу на неделю\n💪 Питательный и сбалансированный\n🌟 Настраивает на продуктивность\n🛡️ Гарантирует успех',
+        'sunday'),
+    # ОБНОВЛЕННЫЕ МЕТОДЫ ДЛЯ ДЕСЕРТОВ
+    'generate_friday_dessert': ContentSpec(
+        'friday_dessert', 'Пятничный десерт по принципу 80/20',
+        '⭐ 80% пользы, 20% удовольствия\n😊 Удовлетворяет craving без чувства вины\n⚖️ Баланс дисциплины и гибкости\n🧠 Поддержка дофаминовой системы',
+        'friday'),
+    'generate_saturday_dessert': ContentSpec(
+        'saturday_dessert', 'Семейный десерт для субботнего вечера',
+        '👨‍👩‍👧‍👦 Объединяет семью за сладким\n😊 Безопасен для детей\n💫 Создает теплые воспоминания\n🌟 Формирует здоровые привычки',
+        'saturday'),
+    'generate_sunday_dessert': ContentSpec(
+        'sunday_dessert', 'Воскресный десерт для завершения недели',
+        '🍰 Сладкое завершение недели\n😊 Вкусные воспоминания без чувства вины\n🧠 Подготовка к продуктивной неделе\n⚡ Стабильная энергия',
+        'sunday'),
+})
+
+# ========== УЛУЧШЕННАЯ YANDEX GPT ИНТЕГРАЦИЯ ==========
+
+class InFlightGeneration:
+    """Генерация в процессе: результат получают все ожидающие этого ключа"""
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+
+class EnhancedYandexGPTGenerator:
+    def __init__(self, cache_manager=None, diversity_manager=None, dessert_manager=None, http_client=None, runtime=None,
+                 near_duplicates=None):
+        self.http = http_client or http_clients.get('yandex_gpt')
+        self.runtime = runtime or background_runtime
+        self.api_key = Config.YANDEX_GPT_API_KEY
+        self.folder_id = Config.YANDEX_FOLDER_ID
+        self.base_url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+        
+        self.cache_manager = cache_manager or RenderCompatibleCache(ttl_days=7)
+        self.diversity_manager = diversity_manager or RecipeDiversityManager()
+        self.dessert_manager = dessert_manager or HealthyDessertManager()  # Добавляем менеджер десертов
+        self.near_duplicates = near_duplicates or create_near_duplicate_index()
+        
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.regeneration_attempts = 0
+        self.coalesced_requests = 0
+        self.stats_lock = Lock()
+        # Принятые генерации ждут отправки: в архив LSH попадает только то, что увидели подписчики
+        self.unpublished = OrderedDict()
+        metrics.gauge('gpt_cache_entries', 'Записей в кэше генераций').set_function(
+            lambda: self.cache_manager.get_stats()['total_entries'])
+        metrics.gauge('gpt_cache_bytes', 'Примерный объем кэша генераций в байтах').set_function(
+            lambda: self.cache_manager.get_stats()['memory_usage_bytes'])
+        
+        # Single-flight: одинаковые темы ждут одну генерацию, разные идут параллельно
+        self.inflight = {}
+        self.inflight_lock = Lock()
+        # Ограничение одновременных запросов к Yandex GPT (квота API)
+        self.gpt_semaphore = BoundedSemaphore(Config.GPT_MAX_CONCURRENCY)
+        
+        self._start_cache_cleanup()
+
+    UNPUBLISHED_LIMIT = 256
+
+    def _remember_unpublished(self, text, content_type, signature):
+        with self.stats_lock:
+            self.unpublished.pop(text, None)
+            self.unpublished[text] = (content_type, signature)
+            while len(self.unpublished) > self.UNPUBLISHED_LIMIT:
+                self.unpublished.popitem(last=False)
+
+    def record_published(self, text):
+        """Заносит отправленную генерацию в архив похожих постов; повторная отправка не дублирует запись"""
+        with self.stats_lock:
+            pending = self.unpublished.pop(text, None)
+        if pending is None:
+            return None
+        content_type, signature = pending
+        return self.near_duplicates.add(text, content_type, signature=signature)
+
+    def _start_cache_cleanup(self):
+        """Подключаем кэш к общей фоновой очистке"""
+        cache_janitor.register(self.cache_manager)
+
+    def generate_content(self, content_type, theme):
+        """Универсальная генерация контента с разделением типов"""
+        cache_key = self._create_cache_key(content_type, theme)
+        
+        cached_result = self.cache_manager.get(cache_key)
+        if cached_result:
+            self._record_cache_request('hit')
+            logger.info(f"✅ Используем кэшированный контент: {theme}")
+            return cached_result
+        
+        # Объединяем одинаковые запросы в одну генерацию
+        with self.inflight_lock:
+            call = self.inflight.get(cache_key)
+            is_leader = call is None
+            if is_leader:
+                call = InFlightGeneration()
+                self.inflight[cache_key] = call
+        
+        if not is_leader:
+            self._record_cache_request('coalesced')
+            logger.info(f"⏳ Ожидаем уже идущую генерацию: {theme}")
+            call.done.wait()
+            if call.result is not None:
+                return call.result
+            return self._get_template_content(content_type, theme)
+        
+        try:
+            call.result = self._generate_uncached(content_type, theme, cache_key)
+            return call.result
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(cache_key, None)
+            call.done.set()
+
+    def _generate_uncached(self, content_type, theme, cache_key):
+        """Генерация с повторами при схожести; выполняется одним потоком на ключ"""
+        # Повторная проверка: ключ мог сгенерировать предыдущий лидер
+        cached_result = self.cache_manager.get(cache_key)
+        if cached_result:
+            self._record_cache_request('hit')
+            logger.info(f"✅ Используем кэшированный контент (после ожидания): {theme}")
+            return cached_result
+        
+        self._record_cache_request('miss')
+        logger.info(f"🔄 Генерируем новый контент: {theme}")
+        
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            try:
+                if not self.api_key or self.api_key == 'your-yandex-gpt-api-key':
+                    result = self._get_template_content(content_type, theme)
+                else:
+                    # Для десертов используем специальный промпт
+                    if 'dessert' in content_type:
+                        result = self._generate_healthy_dessert_via_gpt(content_type, theme)
+                    else:
+                        result = self._generate_via_enhanced_gpt(content_type, theme)
+                
+                similarity = self.diversity_manager.check_similarity(result, content_type)
+                diversity_similarity.observe(similarity, category=content_category(content_type))
+                signature = self.near_duplicates.signature(result)
+                duplicate = None
+                if not self.diversity_manager.is_too_similar(similarity):
+                    # Недавние посты проверены окном выше, архив за все время — через LSH индекс
+                    duplicate = self.near_duplicates.find(result, signature=signature)
+                    if duplicate:
+                        similarity = duplicate['similarity']
+                        logger.warning(f"🔁 Похоже на пост #{duplicate['post_id']} от "
+                                       f"{datetime.fromtimestamp(duplicate['published_at']).strftime('%d.%m.%Y')}")
+                if not self.diversity_manager.is_too_similar(similarity) and not duplicate:
+                    self.cache_manager.set(cache_key, result, content_type=content_type)
+                    self.diversity_manager.record_recipe(result, content_type)
+                    self._remember_unpublished(result, content_type, signature)
+                    
+                    if (self.cache_hits + self.cache_misses) % 10 == 0:
+                        self._log_cache_stats()
+                        
+                    return result
+                else:
+                    with self.stats_lock:
+                        self.regeneration_attempts += 1
+                    gpt_regenerations_total.inc(content_type=content_type)
+                    logger.warning(f"🔄 Контент слишком похож ({similarity:.2f}), пробуем снова... (попытка {attempt + 1})")
+                    time.sleep(1)  # Задержка между попытками
+                    continue
+
+            except Exception as e:
+                logger.error(f"❌ Ошибка генерации контента (попытка {attempt + 1}): {e}")
+                if attempt < max_attempts - 1:
+                    time.sleep(2)
+        
+        logger.warning("⚠️ Используем шаблонный контент после всех попыток")
+        return self._get_template_content(content_type, theme)
+
+    def _record_cache_request(self, result):
+        """Счетчики кэша обновляются из многих потоков генерации"""
+        with self.stats_lock:
+            if result == 'hit':
+                self.cache_hits += 1
+            elif result == 'miss':
+                self.cache_misses += 1
+            else:
+                self.coalesced_requests += 1
+        gpt_cache_requests_total.inc(result=result)
+
+    def _post_completion(self, content_type, headers, data):
+        """Запрос к Yandex GPT с ограничением параллелизма и замером задержки"""
+        with self.gpt_semaphore:
+            started = time.perf_counter()
+            try:
+                response = self.http.post(self.base_url, headers=headers, json=data)
+            except Exception:
+                gpt_requests_total.inc(content_type=content_type, status='error')
+                raise
+            finally:
+                gpt_request_seconds.observe(time.perf_counter() - started, content_type=content_type)
+        gpt_requests_total.inc(content_type=content_type, status=response.status_code)
+        return response
+
+    def _create_cache_key(self, content_type, theme):
+        """Создает уникальный ключ кэша"""
+        normalized_theme = theme.lower().strip()
+        return f"{content_type}_{normalized_theme}_{hashlib.md5(normalized_theme.encode()).hexdigest()[:8]}"
+
+    def _log_cache_stats(self):
+        """Логирует статистику использования кэша"""
+        total = self.cache_hits + self.cache_misses
+        if total > 0:
+            hit_rate = (self.cache_hits / total) * 100
+            cache_stats = self.cache_manager.get_stats()
+            diversity_stats = f"Попыток регенерации: {self.regeneration_attempts}"
+            logger.info(f"📊 Статистика кэша: {self.cache_hits}/{total} попаданий ({hit_rate:.1f}%), {diversity_stats}")
+
+    def get_cache_info(self):
+        """Возвращает информацию о состоянии кэша"""
+        cache_stats = self.cache_manager.get_stats()
+        total_requests = self.cache_hits + self.cache_misses
+        
+        return {
+            **cache_stats,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "regeneration_attempts": self.regeneration_attempts,
+            "coalesced_requests": self.coalesced_requests,
+            "hit_rate": round((self.cache_hits / total_requests) * 100, 1) if total_requests > 0 else 0,
+            "total_requests": total_requests,
+            "unique_ingredients_used": len(self.diversity_manager.used_ingredients),
+            "cooking_methods_used": len(self.diversity_manager.used_cooking_methods),
+            "diversity": self.diversity_manager.get_stats(),
+            "near_duplicates": self.near_duplicates.get_stats(),
+            "dessert_combinations": len(self.dessert_manager.used_combinations) if hasattr(self.dessert_manager, 'used_combinations') else 0
+        }
+
+    def clear_cache(self):
+        """Очищает весь кэш"""
+        try:
+            cleared_count = self.cache_manager.clear_all()
+            with self.stats_lock:
+                self.cache_hits = 0
+                self.cache_misses = 0
+                self.regeneration_attempts = 0
+                self.coalesced_requests = 0
             self.diversity_manager.used_ingredients.clear()
             self.diversity_manager.used_cooking_methods.clear()
-            self.diversity_manager.recipe_history.clear()
+            self.diversity_manager.clear_history()
             # Очищаем комбинации десертов
             if hasattr(self.dessert_manager, 'used_combinations'):
                 self.dessert_manager.used_combinations.clear()
@@ -811,7 +2870,7 @@ class EnhancedYandexGPTGenerator:
                 ]
             }
 
-            response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
+            response = self._post_completion(content_type, headers, data)
 
             if response.status_code == 200:
                 result = response.json()
@@ -869,7 +2928,7 @@ class EnhancedYandexGPTGenerator:
                 ]
             }
 
-            response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
+            response = self._post_completion(content_type, headers, data)
 
             if response.status_code == 200:
                 result = response.json()
@@ -1005,29 +3064,16 @@ class EnhancedYandexGPTGenerator:
             benefits = self.dessert_manager.get_dessert_benefits(dessert_template)
             science = self.dessert_manager.get_dessert_science(dessert_template)
             
-            # Очищаем текст от потенциально опасных HTML конструкций
-            def clean_html(text):
-                # Заменяем HTML теги на Markdown
-                text = re.sub(r'</?b>', '*', text)
-                text = re.sub(r'</?i>', '_', text)
-                text = re.sub(r'<[^>]+>', '', text)
-                # Экранируем специальные символы
-                text = html.escape(text)
-                return text
-            
-            benefits_clean = clean_html(benefits)
-            science_clean = clean_html(science)
-            content_clean = clean_html(content_text)
-            
-            enhanced_content = f"""{content_clean}
+            # HTML очищается один раз при сборке поста (TelegramHTMLSanitizer)
+            enhanced_content = f"""{content_text}
 
-🌟 *ОСОБАЯ ПОЛЬЗА ЭТОГО ДЕСЕРТА:*
-{benefits_clean}
+🌟 <b>ОСОБАЯ ПОЛЬЗА ЭТОГО ДЕСЕРТА:</b>
+{benefits}
 
-🔬 *ДЕТАЛЬНОЕ НАУЧНОЕ ОБОСНОВАНИЕ:*
-{science_clean}
+🔬 <b>ДЕТАЛЬНОЕ НАУЧНОЕ ОБОСНОВАНИЕ:</b>
+{science}
 
-📋 *ТЕХНИЧЕСКАЯ ИНФОРМАЦИЯ:*
+📋 <b>ТЕХНИЧЕСКАЯ ИНФОРМАЦИЯ:</b>
 • ⏱️ Время приготовления: {dessert_template['prep_time']}
 • 👥 Порций: {dessert_template['serves']}
 • ❄️ Хранение: {dessert_template['storage']}
@@ -1036,7 +3082,7 @@ class EnhancedYandexGPTGenerator:
 • 💪 Белки: {dessert_template['protein_g']}г
 • 🌿 Клетчатка: {dessert_template['fiber_g']}г
 
-🔄 *ВАРИАНТЫ ЗАМЕНЫ:*
+🔄 <b>ВАРИАНТЫ ЗАМЕНЫ:</b>
 • Для безлактозной диеты: заменить греческий йогурт на кокосовый
 • Для веганов: использовать растительный протеин вместо сывороточного
 • При аллергии на орехи: заменить на семена подсолнечника
@@ -1052,17 +3098,7 @@ class EnhancedYandexGPTGenerator:
         """Шаблон для десертов правильного питания"""
         
         if dessert_template is None:
-            # Создаем базовый шаблон
-            dessert_template = {
-                'type': "🍰 Чизкейк без выпечки",
-                'prep_time': "20 минут + 4 часа охлаждение",
-                'serves': "4 порции",
-                'storage': "5 дней в холодильнике",
-                'calories': 210,
-                'protein_g': 15,
-                'fiber_g': 8,
-                'gi': 28
-            }
+            dessert_template = DEFAULT_DESSERT_TEMPLATE
         
         return f"""🍰 *{theme.upper()}*
 
@@ -1298,40 +3334,14 @@ _8. 🍓 Перед подачей украсить свежими ягодам
         return base_prompt
 
     def _format_content(self, content_text, content_type, theme):
-        """Форматирование контента с учетом типа и безопасной обработкой HTML"""
+        """Форматирование контента с учетом типа.
+
+        Экранирование, баланс тегов и ограничение длины делает TelegramHTMLSanitizer
+        один раз для всего поста - в generate_attractive_post или при отправке.
+        """
         try:
-            # Очищаем контент от проблемных HTML конструкций
-            def safe_html(text):
-                # Убираем незакрытые теги
-                text = re.sub(r'<([^>]+)>', lambda m: f'<{m.group(1)}>' if '/' not in m.group(1) else m.group(0), text)
-                # Заменяем множественные теги
-                text = re.sub(r'<b>\s*<b>', '<b>', text)
-                text = re.sub(r'</b>\s*</b>', '</b>', text)
-                # Экранируем специальные символы
-                text = html.escape(text)
-                # Восстанавливаем разрешенные теги
-                text = text.replace('&lt;b&gt;', '<b>').replace('&lt;/b&gt;', '</b>')
-                text = text.replace('&lt;tg-spoiler&gt;', '<tg-spoiler>').replace('&lt;/tg-spoiler&gt;', '</tg-spoiler>')
-                return text
-            
-            content_text = safe_html(content_text)
-            
-            # Проверяем длину сообщения
-            if len(content_text) > 3800:  # Оставляем запас для заголовка и хештегов
-                logger.warning(f"⚠️ Контент слишком длинный ({len(content_text)} символов), обрезаем")
-                content_text = content_text[:3800] + "..."
-            
             # Проверяем наличие эмодзи
-            emoji_pattern = re.compile(
-                u'['
-                u'\U0001F600-\U0001F64F'  # emoticons
-                u'\U0001F300-\U0001F5FF'  # symbols & pictographs
-                u'\U0001F680-\U0001F6FF'  # transport & map symbols
-                u']+', 
-                flags=re.UNICODE
-            )
-            
-            if not emoji_pattern.search(content_text):
+            if not EMOJI_RE.search(content_text):
                 logger.warning("⚠️ В сгенерированном контенте отсутствуют эмодзи, добавляем базовые")
                 content_text = f"🎯 {content_text}"
 
@@ -1376,147 +3386,20 @@ _8. 🍓 Перед подачей украсить свежими ягодам
 
     def _get_nutrition_template(self, content_type, theme):
         """Шаблон для советов нутрициолога С ЭМОДЗИ"""
-        templates = {
-            'monday_science': """🧠 <b>НЕЙРОПИТАНИЕ ДЛЯ СТАРТА НЕДЕЛИ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-📈 Понедельник - пик выработки кортизола и норадреналина
-🧠 Требуется усиленная нейроподдержка для запуска когнитивных процессов
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 🥚 Завтрак с яйцами (холин для ацетилхолина)
-• 🐟 Омега-3 для восстановления нейронных связей
-• 💧 Усиленная гидратация для детоксикации
-• 🥬 Листовая зелень для фолатов
-
-⚡ <b>РЕЗУЛЬТАТ:</b> Улучшение концентрации на 40%, снижение стресса на 25%""",
-
-            'tuesday_science': """💪 <b>БЕЛКОВЫЙ МЕТАБОЛИЗМ И ВОССТАНОВЛЕНИЕ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-🔄 Вторник - активация mTOR пути после понедельничных нагрузок
-💪 Оптимальное время для синтеза мышечного белка
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 🍗 Разнообразие белковых источников
-• ⏰ Равномерное распределение протеина
-• 🥛 Лейцин из молочных продуктов
-• 🌱 Растительные белки для микробиома
-
-💥 <b>РЕЗУЛЬТАТ:</b> Ускорение восстановления на 35%, улучшение состава тела""",
-            
-            'wednesday_science': """🍃 <b>ДЕТОКС И ОЧИЩЕНИЕ В СЕРЕДИНЕ НЕДЕЛИ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-🔄 Среда - пик токсической нагрузки
-🫁 Активация систем детоксикации печени
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 🥦 Крестоцветные для глутатиона
-• 💧 Усиленный водный режим
-• 🍎 Пектины для связывания токсинов
-• 🥬 Клетчатка для микробиома
-
-🌿 <b>РЕЗУЛЬТАТ:</b> Снижение воспаления на 30%, улучшение пищеварения""",
-            
-            'thursday_science': """⚡ <b>ЭНЕРГЕТИЧЕСКИЙ МЕТАБОЛИЗМ ДЛЯ ФИНАЛА</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-🔋 Четверг - истощение гликогеновых запасов
-⚡ Оптимизация митохондриальной функции
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 🍠 Сложные углеводы с низким ГИ
-• 🥑 Полезные жиры для мембран
-• 🔋 Кофакторы энергетического обмена
-• ⏰ Синхронизация с циркадными ритмами
-
-🚀 <b>РЕЗУЛЬТАТ:</b> Стабильная энергия на 6-8 часов, улучшение выносливости""",
-            
-            'friday_science': """⭐ <b>БАЛАНС ПИТАНИЯ И ПСИХОЛОГИЯ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-🎯 Пятница - баланс между дофаминовой системой вознаграждения
-😊 Поддержание дисциплины питания
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 🎯 Принцип 80/20 для гибкости
-• 😊 Осознанное потребление
-• 🍫 Здоровые альтернативы
-• 👨‍👩‍👧‍👦 Социальный аспект питания
-
-🌈 <b>РЕЗУЛЬТАТ:</b> Снижение стресса питания на 45%, устойчивые привычки""",
-            
-            'saturday_science': """👨‍👩‍👧‍👦 <b>СЕМЕЙНАЯ НУТРИЦИОЛОГИЯ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-❤️ Суббота - повышение окситоцина при совместных трапезах
-👶 Формирование пищевых привычек у детей
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 👪 Совместное приготовление пищи
-• 🎨 Вовлечение детей в процесс
-• 📚 Образовательный компонент
-• 💫 Создание традиций
-
-❤️ <b>РЕЗУЛЬТАТ:</b> Укрепление семейных связей, формирование здоровых привычек""",
-            
-            'sunday_science': """📊 <b>ПЛАНИРОВАНИЕ ПИТАНИЯ НА НЕДЕЛЮ</b>
-
-🔬 <b>НАУЧНАЯ ОСНОВА:</b>
-🧠 Воскресенье - снижение decision fatigue при планировании
-⚡ Оптимизация когнитивных ресурсов на неделю
-
-💡 <b>ПРАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ:</b>
-• 📝 Составление меню на неделю
-• 🛒 Планирование закупок
-• 🍱 Подготовка ингредиентов
-• ⏱️ Оптимизация времени готовки
-
-🎯 <b>РЕЗУЛЬТАТ:</b> Экономия 5+ часов в неделю, снижение стресса на 60%"""
-        }
-        
-        return templates.get(content_type, f"🔬 <b>{theme}</b>\n\n🎯 Научный совет по питанию и здоровому образу жизни.\n💡 Практические рекомендации для всей семьи.\n🌟 Доказательная нутрициология.")
+        template = NUTRITION_TEMPLATES.get(content_type)
+        if template:
+            return template
+        return f"🔬 <b>{theme}</b>\n\n🎯 Научный совет по питанию и здоровому образу жизни.\n💡 Практические рекомендации для всей семьи.\n🌟 Доказательная нутрициология."
 
     def _get_training_template(self, content_type, theme):
         """Шаблон для тренировок С ЭМОДЗИ"""
-        return f"""💪 <b>{theme.upper()}</b>
-
-⏱️ <b>ПРОГРАММА ТРЕНИРОВКИ:</b>
-• 🕐 Продолжительность: 30-45 минут
-• 🎯 Уровень: начальный/средний
-• 🏠 Оборудование: минимальное
-
-🏃‍♂️ <b>РАЗМИНКА (5-10 минут):</b>
-• 🚶‍♂️ Ходьба на месте
-• 🔄 Вращения суставами
-• 🤸‍♂️ Динамическая растяжка
-
-💪 <b>ОСНОВНАЯ ЧАСТЬ:</b>
-• 🏋️‍♂️ Упражнение 1: 3 подхода по 10-15 повторений
-• 🏋️‍♀️ Упражнение 2: 3 подхода по 10-15 повторений  
-• 🏋️ Упражнение 3: 3 подхода по 10-15 повторений
-
-🧘‍♂️ <b>ЗАМИНКА:</b>
-• 🤸‍♀️ Статическая растяжка 5-7 минут
-• 🌬️ Глубокое дыхание
-
-💡 <b>НАУЧНОЕ ОБОСНОВАНИЕ:</b>
-🏃‍♂️ Регулярные тренировки улучшают метаболизм
-❤️ Укрепляют сердечно-сосудистую систему
-💫 Повышают качество жизни"""
+        return f"💪 <b>{theme.upper()}</b>\n\n{TRAINING_TEMPLATE_BODY}"
 
     def _get_recipe_template(self, content_type, theme):
         """Шаблон для рецептов С ЭМОДЗИ"""
-        
-        # Базовые ингредиенты с эмодзи
-        protein_options = ["🍗 куриная грудка", "🥩 говядина", "🐟 треска", "🦐 креветки", "🥚 яйца"]
-        veggie_options = ["🥕 морковь", "🥦 брокколи", "🍅 помидоры", "🫑 перец", "🥬 шпинат"]
-        carb_options = ["🍚 гречка", "🌾 овсянка", "🥔 картофель", "🍠 батат"]
-        
-        selected_protein = random.choice(protein_options)
-        selected_veggies = random.sample(veggie_options, 2)
-        selected_carb = random.choice(carb_options)
+        selected_protein = random.choice(RECIPE_PROTEIN_OPTIONS)
+        selected_veggies = random.sample(RECIPE_VEGGIE_OPTIONS, 2)
+        selected_carb = random.choice(RECIPE_CARB_OPTIONS)
         
         return f"""🍽️ <b>{theme.upper()}</b>
 
@@ -1562,19 +3445,27 @@ class ServiceMonitor:
         self.request_count = 0
         self.sent_messages = 0
         self.missed_messages = 0
+        self.last_request_time = time.time()
         self.monitor_lock = Lock()
 
     def increment_request(self):
         with self.monitor_lock:
             self.request_count += 1
+            self.last_request_time = time.time()
+
+    def get_idle_seconds(self):
+        """Сколько секунд не было входящих HTTP запросов"""
+        return time.time() - self.last_request_time
 
     def record_sent_message(self):
         with self.monitor_lock:
             self.sent_messages += 1
+        telegram_messages_total.inc(result='sent')
 
     def record_missed_message(self, event_name):
         with self.monitor_lock:
             self.missed_messages += 1
+        telegram_messages_total.inc(result='missed')
         logger.warning(f"⚠️ Пропущено сообщение: {event_name}")
 
     def get_status(self):
@@ -1592,22 +3483,6 @@ service_monitor = ServiceMonitor()
 # ========== СИСТЕМА ВРЕМЕНИ ==========
 
 class TimeManager:
-    @staticmethod
-    def kemerovo_to_server(kemerovo_time_str):
-        """КОНВЕРТАЦИЯ ВРЕМЕНИ КЕМЕРОВО → СЕРВЕР"""
-        try:
-            kemerovo_now = datetime.now(Config.KEMEROVO_TZ)
-            kemerovo_dt = datetime.strptime(kemerovo_time_str, '%H:%M').time()
-            full_kemerovo_dt = datetime.combine(kemerovo_now.date(), kemerovo_dt)
-            full_kemerovo_dt = Config.KEMEROVO_TZ.localize(full_kemerovo_dt)
-
-            server_dt = full_kemerovo_dt.astimezone(Config.SERVER_TZ)
-            return server_dt.strftime('%H:%M')
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка конвертации времени {kemerovo_time_str}: {e}")
-            return kemerovo_time_str
-
     @staticmethod
     def get_current_times():
         server_now = datetime.now(Config.SERVER_TZ)
@@ -1626,71 +3501,244 @@ class TimeManager:
     def get_kemerovo_weekday():
         return datetime.now(Config.KEMEROVO_TZ).weekday()
 
-# ========== МЕНЕДЖЕР ВИЗУАЛЬНОГО КОНТЕНТА ==========
-
-class VisualContentManager:
-    FOOD_PHOTOS = {
-        'breakfast': [
-            'https://images.unsplash.com/photo-1551782450-17144efb9c50?w=600',
-            'https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=600',
-        ],
-        'lunch': [
-            'https://images.unsplash.com/photo-1547592166-23ac45744acd?w=600',
-            'https://images.unsplash.com/photo-1606755962773-d324e74532a7?w=600',
-        ],
-        'dinner': [
-            'https://images.unsplash.com/photo-1563379926898-05f4575a45d8?w=600',
-            'https://images.unsplash.com/photo-1598214886806-c87b84b707f5?w=600',
-        ],
-        'dessert': [
-            'https://images.unsplash.com/photo-1563729784474-d77dbb933a9e?w=600',
-            'https://images.unsplash.com/photo-1571115764595-644a1f56a55c?w=600',
-        ],
-        'science': [
-            'https://images.unsplash.com/photo-1532094349884-543bc11b234d?w=600',
-            'https://images.unsplash.com/photo-1559757148-5c350d0d3c56?w=600',
-        ],
-        'workout': [
-            'https://images.unsplash.com/photo-1536922246289-88c42f957773?w=600',
-            'https://images.unsplash.com/photo-1571019613454-1cb2f99b2d8b?w=600',
-        ],
-        'snacks': [
-            'https://images.unsplash.com/photo-1505576399279-565b52d4ac71?w=600',
-            'https://images.unsplash.com/photo-1488459716781-31db52582fe9?w=600',
+TimelineSlot = namedtuple('TimelineSlot', ['at', 'day', 'kemerovo_time', 'event'])
+
+class WeeklyTimeline:
+    """Абсолютные моменты запуска слотов, отсортированные для поиска через bisect.
+
+    Лента строится на три недели Кемерово (прошлая, текущая, следующая), поэтому
+    следующее и предыдущее событие находятся без ручного перехода через границу
+    недели и полночь. Когда текущий момент уходит из средней недели, лента
+    перестраивается.
+    """
+
+    def __init__(self, schedule, local_tz=None, server_tz=None):
+        self.local_tz = local_tz or Config.KEMEROVO_TZ
+        self.server_tz = server_tz or Config.SERVER_TZ
+        # Время слотов разбирается один раз: (день, "HH:MM", час, минута, событие)
+        self.slots = []
+        for day, day_schedule in schedule.items():
+            for time_str, event in day_schedule.items():
+                hour, minute = map(int, time_str.split(':'))
+                self.slots.append((day, time_str, hour, minute, event))
+        self.week_start = None
+        self.week_end = None
+        self.instants = []
+        self.entries = []
+        self.builds = 0
+        self.timeline_lock = Lock()
+
+    def _instant(self, date, hour, minute):
+        local = self.local_tz.localize(datetime(date.year, date.month, date.day, hour, minute))
+        return local.astimezone(self.server_tz)
+
+    def _monday(self, now):
+        local_now = now.astimezone(self.local_tz)
+        return local_now.date() - timedelta(days=local_now.weekday())
+
+    def _build(self, now):
+        monday = self._monday(now)
+        entries = [
+            TimelineSlot(self._instant(monday + timedelta(days=7 * week + day), hour, minute), day, time_str, event)
+            for week in (-1, 0, 1)
+            for day, time_str, hour, minute, event in self.slots
         ]
-    }
+        entries.sort(key=lambda slot: slot.at)
+        self.entries = entries
+        self.instants = [slot.at for slot in entries]
+        self.week_start = self._instant(monday, 0, 0)
+        self.week_end = self._instant(monday + timedelta(days=7), 0, 0)
+        self.builds += 1
+
+    def _locate(self, now):
+        if self.week_start is None or not self.week_start <= now < self.week_end:
+            self._build(now)
+        return bisect.bisect_right(self.instants, now)
+
+    def next_event(self, now=None):
+        """Ближайший слот строго позже now или None при пустом расписании"""
+        now = now or datetime.now(self.server_tz)
+        with self.timeline_lock:
+            index = self._locate(now)
+            return self.entries[index] if index < len(self.entries) else None
+
+    def previous_event(self, now=None):
+        """Последний слот не позже now"""
+        now = now or datetime.now(self.server_tz)
+        with self.timeline_lock:
+            index = self._locate(now)
+            return self.entries[index - 1] if index else None
+
+    def upcoming(self, until, count, now=None):
+        """Слоты в интервале (now, until], не больше count; окно - до конца следующей недели"""
+        now = now or datetime.now(self.server_tz)
+        with self.timeline_lock:
+            start = self._locate(now)
+            end = bisect.bisect_right(self.instants, until, lo=start)
+            return self.entries[start:min(end, start + count)]
+
+    def server_slot(self, day, kemerovo_time, now=None):
+        """День недели и время сервера для слота Кемерово с учетом перехода через полночь"""
+        hour, minute = map(int, kemerovo_time.split(':'))
+        monday = self._monday(now or datetime.now(self.server_tz))
+        instant = self._instant(monday + timedelta(days=day), hour, minute)
+        return instant.weekday(), instant.strftime('%H:%M')
 
-    # РАСШИРЕННЫЕ ЭМОЦИОНАЛЬНЫЕ ТРИГГЕРЫ
-    EMOTIONAL_TRIGGERS_RECIPES = {
-        'monday': "Проснись и сияй! 🌅 Твой мозг жаждет правильного топлива...",
-        'tuesday': "Время стать сильнее! 💪 Сегодня мы строим твое идеальное тело...", 
-        'wednesday': "Чувствуешь легкость! 🍃 Пришло время очищения и обновления...",
-        'thursday': "Зарядись энергией! ⚡ Сегодня мы наполняем тебя силой до конца недели...",
-        'friday': "Награда за труды! 🎉 Баланс удовольствия и пользы ждет тебя...",
-        'saturday': "Семейная магия! 👨‍👩‍👧‍👦 Создаем воспоминания на кухне вместе...",
-        'sunday': "Инвестиция в успех! 📈 Готовься к идеальной неделе уже сегодня..."
-    }
+    def get_stats(self):
+        next_slot = self.next_event()
+        previous_slot = self.previous_event()
+        return {
+            "slots": len(self.slots),
+            "week_start": self.week_start.isoformat() if self.week_start else None,
+            "builds": self.builds,
+            "next": {"at": next_slot.at.isoformat(), "name": next_slot.event['name']} if next_slot else None,
+            "previous": {"at": previous_slot.at.isoformat(), "name": previous_slot.event['name']} if previous_slot else None
+        }
 
-    EMOTIONAL_TRIGGERS_WORKOUTS = {
-        'monday': "Заряд бодрости на всю неделю! 💥 Начинаем с правильного настроя...",
-        'tuesday': "Сила растет с каждым движением! 🏋️‍♂️ Совершенствуй свою форму...",
-        'wednesday': "Преодолей середину пути! 🌉 Твое тело благодарно за заботу...",
-        'thursday': "Энергия для прорыва! 🚀 Готовься к финальному рывку...",
-        'friday': "Награда за упорство! 🏆 Ты стал сильнее, чем в понедельник...",
-        'saturday': "Семейная сила! 👨‍👦 Совместные достижения сближают...",
-        'sunday': "Фундамент будущих побед! 📊 Готовь тело к новым свершениям..."
-    }
+# ========== TELEGRAM HTML РАЗМЕТКА ==========
 
-    EMOTIONAL_TRIGGERS_NUTRITION = {
-        'monday': "Мудрость питания на старте недели! 🧠 Заложи основу успеха...",
-        'tuesday': "Наука о теле раскрывает секреты! 🔬 Углубляем знания...",
-        'wednesday': "Гармония метаболизма! ⚖️ Балансируем системы организма...",
-        'thursday': "Энергия правильных решений! 💡 Меняем привычки сегодня...",
-        'friday': "Итоги недели мудрости! 📚 Закрепляем полезные знания...",
-        'saturday': "Семейная нутрициология! 👨‍👩‍👧‍👦 Объединяем заботу о здоровье...",
-        'sunday': "Планирование здоровья! 🗓️ Готовимся к идеальной неделе..."
-    }
+EMOJI_RE = re.compile(
+    u'['
+    u'\U0001F600-\U0001F64F'  # emoticons
+    u'\U0001F300-\U0001F5FF'  # symbols & pictographs
+    u'\U0001F680-\U0001F6FF'  # transport & map symbols
+    u']+',
+    flags=re.UNICODE
+)
+
+class SanitizedPost(str):
+    """Текст, уже прошедший TelegramHTMLSanitizer: путь отправки не проверяет его повторно"""
+
+class TelegramHTMLSanitizer:
+    """Однопроходная очистка HTML под подмножество тегов Telegram.
+
+    Один линейный проход по тексту экранирует <, > и &, выбрасывает
+    неподдерживаемые теги, убирает повторно открытые теги, закрывает
+    непарные, не пускает разметку внутрь code/pre и обрезает пост по
+    границе токена с сохранением баланса тегов.
+    """
+
+    ALLOWED_TAGS = frozenset({'b', 'i', 'code', 'pre', 'a', 'tg-spoiler'})
+    TAG_ALIASES = {'strong': 'b', 'em': 'i'}
+    ESCAPES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+    TOKEN_RE = re.compile(
+        r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)>'
+        r'|&(?:lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);'
+        r'|[<>&]'
+    )
+    HREF_RE = re.compile(r'''href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.IGNORECASE)
+    MAX_LENGTH = 4096
+    # Запас под служебную подпись, которую планировщик добавляет к готовому посту
+    STAMP_RESERVE = 64
+    ELLIPSIS = '...'
+
+    def sanitize(self, text, max_length=MAX_LENGTH):
+        out = []
+        stack = []
+        skipped = {}
+        length = 0
+        closing_length = 0
+        # Запас под многоточие при обрезке
+        budget = max_length - len(self.ELLIPSIS)
+
+        def emit(piece):
+            nonlocal length
+            out.append(piece)
+            length += len(piece)
+
+        def add_text(chunk):
+            room = budget - length - closing_length
+            if len(chunk) <= room:
+                emit(chunk)
+                return True
+            emit(chunk[:max(room, 0)])
+            return False
+
+        truncated = False
+        pos = 0
+        for match in self.TOKEN_RE.finditer(text):
+            if not add_text(text[pos:match.start()]):
+                truncated = True
+                break
+            pos = match.end()
+            token = match.group(0)
+            name = match.group(2)
+            top = stack[-1] if stack else None
+
+            if name is None:
+                # Готовые сущности оставляем как есть, поэтому повторная очистка ничего не меняет
+                piece, opened = (token if len(token) > 1 else self.ESCAPES[token]), None
+            else:
+                name = self.TAG_ALIASES.get(name.lower(), name.lower())
+                closing = bool(match.group(1))
+                if top in ('code', 'pre') and not (closing and name == top) \
+                        and not (not closing and name == 'code' and top == 'pre'):
+                    # Внутри code/pre разметка не допускается - показываем ее как текст
+                    piece, opened = html.escape(token, quote=False), None
+                elif name not in self.ALLOWED_TAGS:
+                    continue
+                elif closing:
+                    if skipped.get(name):
+                        skipped[name] -= 1
+                        continue
+                    if name not in stack:
+                        continue
+                    # Закрываем и все теги, оставшиеся открытыми внутри
+                    while stack:
+                        tag = stack.pop()
+                        closing_length -= len(tag) + 3
+                        emit(f'</{tag}>')
+                        if tag == name:
+                            break
+                    continue
+                elif name in stack:
+                    skipped[name] = skipped.get(name, 0) + 1
+                    continue
+                elif name == 'a':
+                    href = self.HREF_RE.search(match.group(3))
+                    href = href and next(value for value in href.groups() if value is not None)
+                    if not href:
+                        skipped['a'] = skipped.get('a', 0) + 1
+                        continue
+                    piece, opened = f'<a href="{html.escape(html.unescape(href))}">', name
+                else:
+                    piece, opened = f'<{name}>', name
 
+            extra = len(opened) + 3 if opened else 0
+            if length + len(piece) + extra + closing_length > budget:
+                truncated = True
+                break
+            emit(piece)
+            if opened:
+                stack.append(opened)
+                closing_length += extra
+        else:
+            truncated = not add_text(text[pos:])
+
+        if truncated:
+            emit(self.ELLIPSIS)
+        while stack:
+            emit(f'</{stack.pop()}>')
+        return SanitizedPost(''.join(out))
+
+    def ensure(self, text):
+        """Очищает текст, если он еще не был очищен при генерации"""
+        return text if isinstance(text, SanitizedPost) else self.sanitize(text)
+
+    def append(self, post, suffix):
+        """Дописывает к очищенному посту текст без разметки, не теряя отметку SanitizedPost"""
+        if not isinstance(post, SanitizedPost):
+            return post + suffix
+        escaped = html.escape(suffix, quote=False)
+        if len(post) + len(escaped) > self.MAX_LENGTH:
+            return self.sanitize(post + escaped)
+        return SanitizedPost(post + escaped)
+
+telegram_html = TelegramHTMLSanitizer()
+
+# ========== МЕНЕДЖЕР ВИЗУАЛЬНОГО КОНТЕНТА ==========
+
+class VisualContentManager:
     # НАУЧНЫЕ ПОДХОДЫ С БИОЛОГИЧЕСКИМ ОБОСНОВАНИЕМ
     SCIENCE_APPROACHES = {
         'monday': """🎯 БИОЛОГИЧЕСКОЕ ОБОСНОВАНИЕ ДЛЯ ПОНЕДЕЛЬНИКА:
@@ -1776,9 +3824,37 @@ class VisualContentManager:
 
 🔄 Поделиться с друзьми"""
 
+    def __init__(self, library=None):
+        # Фото и эмоциональные триггеры - из файла контента, обновляются без перезапуска
+        self.library = library or content_library
+        self.apply_library(self.library.get('visual'))
+        self.library.subscribe('visual', self.apply_library, validate=self.validate_library)
+
+    def validate_library(self, visual):
+        photos = visual.get('food_photos')
+        if not isinstance(photos, dict) or 'breakfast' not in photos:
+            raise ValueError("visual.food_photos должен содержать категорию breakfast")
+        require_string_lists('visual.food_photos', photos, photos.keys())
+        triggers = visual.get('emotional_triggers')
+        for kind in ('recipes', 'workouts', 'nutrition'):
+            values = triggers.get(kind) if isinstance(triggers, dict) else None
+            if not isinstance(values, dict) or not all(isinstance(text, str) for text in values.values()):
+                raise ValueError(f"visual.emotional_triggers.{kind} должен быть словарем день -> текст")
+
+    def apply_library(self, visual):
+        """Подменяет фото и триггеры; словари меняются целиком, чтобы читатели не видели половину"""
+        triggers = visual['emotional_triggers']
+        food_photos = dict(visual['food_photos'])
+        recipes, workouts, nutrition = dict(triggers['recipes']), dict(triggers['workouts']), dict(triggers['nutrition'])
+        self.food_photos = food_photos
+        self.emotional_triggers_recipes = recipes
+        self.emotional_triggers_workouts = workouts
+        self.emotional_triggers_nutrition = nutrition
+        return {"photo_categories": len(self.food_photos)}
+
     def get_photo_for_recipe(self, recipe_type):
         photo_category = self._map_recipe_to_photo(recipe_type)
-        photos = self.FOOD_PHOTOS.get(photo_category, self.FOOD_PHOTOS['breakfast'])
+        photos = self.food_photos.get(photo_category, self.food_photos['breakfast'])
         return random.choice(photos)
 
     def _map_recipe_to_photo(self, recipe_type):
@@ -1809,11 +3885,11 @@ class VisualContentManager:
         day_key = day_of_week.lower()
         
         if 'training' in content_type or 'workout' in content_type:
-            return self.EMOTIONAL_TRIGGERS_WORKOUTS.get(day_key, "")
+            return self.emotional_triggers_workouts.get(day_key, "")
         elif 'advice' in content_type or 'science' in content_type:
-            return self.EMOTIONAL_TRIGGERS_NUTRITION.get(day_key, "")
+            return self.emotional_triggers_nutrition.get(day_key, "")
         else:
-            return self.EMOTIONAL_TRIGGERS_RECIPES.get(day_key, "")
+            return self.emotional_triggers_recipes.get(day_key, "")
 
     def generate_attractive_post(self, title, content, content_type, benefits, emotional_trigger="", include_science_approach=False, day_of_week=None):
         photo_url = self.get_photo_for_recipe(content_type)
@@ -1842,338 +3918,272 @@ class VisualContentManager:
         # Добавляем унифицированную концовку с кнопкой Поделиться
         post += self.UNIVERSAL_FOOTER
 
-        return post
+        # Единственный проход очистки: дальше пост уходит в Telegram без повторной проверки
+        return telegram_html.sanitize(post, max_length=TelegramHTMLSanitizer.MAX_LENGTH - TelegramHTMLSanitizer.STAMP_RESERVE)
 
 # ========== УЛУЧШЕННЫЙ ГЕНЕРАТОР КОНТЕНТА ==========
 
 class EnhancedContentGenerator:
-    def __init__(self):
-        self.visual_manager = VisualContentManager()
-        self.gpt_generator = EnhancedYandexGPTGenerator()
-        self.generator_lock = RLock()
+    def __init__(self, gpt_generator=None, visual_manager=None):
+        self.visual_manager = visual_manager or VisualContentManager()
+        self.gpt_generator = gpt_generator or EnhancedYandexGPTGenerator()
         
-        # Инициализируем менеджер десертов
-        self.dessert_manager = HealthyDessertManager()
+        # Используем менеджер десертов генератора, чтобы не плодить копии
+        self.dessert_manager = self.gpt_generator.dessert_manager
+        self.fallback_parts = {}
+        # Готовый пост -> исходная генерация GPT, чтобы после отправки занести ее в архив
+        self.post_sources = OrderedDict()
+        self.sources_lock = Lock()
+        self.prebuild_fallbacks()
+        # В таблице резервных постов лежат триггеры из библиотеки; десерты и фото выбираются при каждом вызове
+        self.visual_manager.library.subscribe('visual', self.rebuild_fallbacks)
 
     # НАУЧНЫЕ СОВЕТЫ НУТРИЦИОЛОГА ДЛЯ КАЖДОГО ДНЯ
     def generate_monday_science(self):
-        return self._generate_with_enhanced_gpt('monday_science', 'Нейропитание для старта недели',
-                                              '🧠 Улучшение когнитивных функций\n💡 Повышение концентрации внимания\n⚡ Снижение стрессовой нагрузки\n🌟 Оптимизация нейромедиаторного баланса',
-                                              'monday')
+        return self.generate_planned('generate_monday_science')
 
     def generate_tuesday_science(self):
-        return self._generate_with_enhanced_gpt('tuesday_science', 'Белковый метаболизм и восстановление',
-                                              '💪 Ускорение синтеза мышечного белка\n🔄 Оптимизация аминокислотного профиля\n🌟 Улучшение восстановления после нагрузок\n🍗 Разнообразие белковых источников',
-                                              'tuesday')
+        return self.generate_planned('generate_tuesday_science')
 
     def generate_wednesday_science(self):
-        return self._generate_with_enhanced_gpt('wednesday_science', 'Детокс и очищение в середине недели',
-                                              '🍃 Снижение воспалительных процессов\n💧 Улучшение детоксикационной функции\n🌟 Оптимизация работы ЖКТ\n🔄 Восстановление микробиома кишечника',
-                                              'wednesday')
+        return self.generate_planned('generate_wednesday_science')
 
     def generate_thursday_science(self):
-        return self._generate_with_enhanced_gpt('thursday_science', 'Энергетический метаболизм для финала недели',
-                                              '⚡ Стабильное высвобождение энергии\n🔋 Улучшение митохондриальной функции\n🌟 Оптимизация углеводного обмена\n💪 Повышение выносливости',
-                                              'thursday')
+        return self.generate_planned('generate_thursday_science')
 
     def generate_friday_science(self):
-        return self._generate_with_enhanced_gpt('friday_science', 'Баланс питания и психология',
-                                              '⭐ Снижение стресса питания\n😊 Формирование здоровых отношений с едой\n🌟 Баланс между дисциплиной и гибкостью\n💫 Устойчивые пищевые привычки',
-                                              'friday')
+        return self.generate_planned('generate_friday_science')
 
     def generate_saturday_science(self):
-        return self._generate_with_enhanced_gpt('saturday_science', 'Семейная нутрициология',
-                                              '👨‍👩‍👧‍👦 Укрепление семейных связей\n🍽️ Формирование здоровых привычек у детей\n💫 Создание пищевых традиций\n🌟 Совместное приготовление пищи',
-                                              'saturday')
+        return self.generate_planned('generate_saturday_science')
 
     def generate_sunday_science(self):
-        return self._generate_with_enhanced_gpt('sunday_science', 'Планирование питания на неделю',
-                                              '📊 Снижение decision fatigue на 35%\n💪 Повышение adherence к здоровому рациону на 68%\n🌟 Экономия времени и ресурсов\n🗓️ Оптимизация пищевого поведения',
-                                              'sunday')
+        return self.generate_planned('generate_sunday_science')
 
     # ДОБАВЛЕННЫЕ МЕТОДЫ ДЛЯ ИСПРАВЛЕНИЯ ОШИБОК
     def generate_mental_energy_lunch(self):
-        """Обед для ментальной энергии (для понедельника)"""
-        return self._generate_with_enhanced_gpt('lunch', 'Обед для ментальной энергии',
-                                              '🧠 Поддержка когнитивных функций\n💡 Улучшение концентрации внимания\n⚡ Стабильное высвобождение энергии\n🌟 Оптимизация нейромедиаторного баланса',
-                                              'monday')
+        return self.generate_planned('generate_mental_energy_lunch')
 
     def generate_neuro_recovery_dinner(self):
-        """Ужин для восстановления нейронов (для понедельника)"""
-        return self._generate_with_enhanced_gpt('dinner', 'Ужин для восстановления нейронов',
-                                              '🧠 Восстановление нейронных связей\n💤 Улучшение качества сна\n🌙 Оптимизация процессов детоксикации\n🌟 Подготовка мозга к следующему дню',
-                                              'monday')
+        return self.generate_planned('generate_neuro_recovery_dinner')
 
     def generate_neuro_advice(self):
-        """Совет по нейропитанию (для понедельника)"""
-        return self._generate_with_enhanced_gpt('advice', 'Совет: Нейропитание',
-                                              '🧠 Улучшение когнитивных функций\n💡 Повышение нейропластичности\n⚡ Оптимизация энергетического метаболизма\n🛡️ Нейропротекторное действие',
-                                              'monday')
+        return self.generate_planned('generate_neuro_advice')
 
     def generate_water_advice(self):
-        """Совет по гидратации (для вторника)"""
-        return self._generate_with_enhanced_gpt('water_science', 'Совет: Оптимальная гидратация',
-                                              '💧 Роль воды в метаболизме\n🧠 Влияние на когнитивные функции\n🏃‍♂️ Гидратация при физических нагрузках\n🌡️ Регуляция температуры тела',
-                                              'tuesday')
+        return self.generate_planned('generate_water_advice')
 
     def generate_veggie_advice(self):
-        """Совет по овощному питанию (для среды)"""
-        return self._generate_with_enhanced_gpt('veggie_advice', 'Совет: Детокс питание',
-                                              '🥬 Источник витаминов и минералов\n🌿 Очищает организм\n💚 Профилактика заболеваний\n🌟 Улучшает здоровье',
-                                              'wednesday')
+        return self.generate_planned('generate_veggie_advice')
 
     def generate_carbs_advice(self):
-        """Совет по углеводам (для четверга)"""
-        return self._generate_with_enhanced_gpt('carbs_advice', 'Совет: Сложные углеводы',
-                                              '⚡ Основной источник энергии\n🍞 Важны для активности\n💪 Поддерживают метаболизм\n🌟 Обеспечивают жизнедеятельность',
-                                              'thursday')
+        return self.generate_planned('generate_carbs_advice')
 
     def generate_balance_advice(self):
-        """Совет по балансу питания (для пятницы)"""
-        return self._generate_with_enhanced_gpt('balance_advice', 'Совет: Принцип 80/20',
-                                              '⚖️ Оптимальное сочетание нутриентов\n💪 Поддержка всех систем\n🌟 Долгосрочное здоровье\n🛡️ Профилактика заболеваний',
-                                              'friday')
+        return self.generate_planned('generate_balance_advice')
 
     def generate_family_advice(self):
-        """Совет по семейному питанию (для субботы)"""
-        return self._generate_with_enhanced_gpt('family_advice', 'Совет: Питание для семьи',
-                                              '👨‍👩‍👧‍👦 Укрепление семейных связей\n😊 Формирование здоровых привычек\n💫 Создает теплую атмосферу\n🌟 Наследие для детей',
-                                              'saturday')
+        return self.generate_planned('generate_family_advice')
 
     def generate_planning_advice(self):
-        """Совет по планированию питания (для воскресенья)"""
-        return self._generate_with_enhanced_gpt('planning_advice', 'Совет: Meal prep стратегии',
-                                              '📋 Экономит время и деньги\n💪 Обеспечивает сбалансированность\n🌟 Помогает достичь целей\n🛡️ Гарантирует успех',
-                                              'sunday')
+        return self.generate_planned('generate_planning_advice')
 
     # МЕТОД ДЛЯ АКТИВНЫХ ПЕРЕКУСОВ (ЕДИНСТВЕННЫЙ ОСТАВШИЙСЯ)
     def generate_active_snacks(self):
-        return self._generate_with_enhanced_gpt('active_snacks', 'Полезные перекусы для активного отдыха',
-                                              '⚡ Быстрое восстановление энергии\n💪 Поддержка мышечной массы\n🧠 Улучшение концентрации\n🏃‍♂️ Повышение выносливости',
-                                              'sunday')
+        return self.generate_planned('generate_active_snacks')
 
     # СУЩЕСТВУЮЩИЕ МЕТОДЫ ДЛЯ РЕЦЕПТОВ
     def generate_cognitive_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Завтрак для когнитивных функций',
-                                              '🧠 Улучшение памяти и концентрации\n💡 Повышение нейропластичности\n⚡ Стабильная энергия на 4-5 часов\n🛡️ Защита нейронов от окислительного стресса',
-                                              'monday')
+        return self.generate_planned('generate_cognitive_breakfast')
 
     def generate_protein_rotation_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Завтрак с ротацией белков',
-                                              '💪 Разнообразие аминокислотного профиля\n🔄 Предотвращение пищевой непереносимости\n🌟 Оптимизация синтеза мышечного белка\n🍗 Альтернативные источники протеина',
-                                              'tuesday')
+        return self.generate_planned('generate_protein_rotation_breakfast')
 
     def generate_novel_protein_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Обед с новым источником белка',
-                                              '💪 Расширение спектра аминокислот\n🆕 Предотвращение пищевой монотонности\n🌟 Стимуляция микробиома кишечника\n🍽️ Обогащение рациона новыми нутриентами',
-                                              'tuesday')
+        return self.generate_planned('generate_novel_protein_lunch')
 
     def generate_seafood_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Ужин с морскими белками',
-                                              '🐟 Богатый источник Омега-3\n💪 Легкоусвояемый белок\n🦐 Микроэлементы (йод, селен, цинк)\n🌟 Поддержка сердечно-сосудистой системы',
-                                              'tuesday')
+        return self.generate_planned('generate_seafood_dinner')
 
     def generate_veggie_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Овощной завтрак',
-                                              '🥬 Богат клетчаткой и витаминами\n🌿 Очищает организм\n💚 Легкий и полезный\n⚡ Дает заряд энергии',
-                                              'wednesday')
+        return self.generate_planned('generate_veggie_breakfast')
 
     def generate_veggie_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Овощной обед',
-                                              '🥬 Богат витаминами и минералами\n🌿 Очищает организм\n💚 Легкий и полезный\n⚡ Дает энергию',
-                                              'wednesday')
+        return self.generate_planned('generate_veggie_lunch')
 
     def generate_veggie_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Овощной ужин',
-                                              '🥬 Легкий для пищеварения\n🌿 Богат клетчаткой\n💚 Способствует детоксу\n🌟 Очищает организм',
-                                              'wednesday')
+        return self.generate_planned('generate_veggie_dinner')
 
     def generate_carbs_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Углеводный завтрак',
-                                              '⚡ Источник энергии\n🍞 Сложные углеводы\n💪 Поддерживает активность\n🌟 Надолго насыщает',
-                                              'thursday')
+        return self.generate_planned('generate_carbs_breakfast')
 
     def generate_carbs_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Углеводный обед',
-                                              '⚡ Восполняет энергию\n🍚 Сложные углеводы\n💪 Поддерживает активность\n🌟 Надолго насыщает',
-                                              'thursday')
+        return self.generate_planned('generate_carbs_lunch')
 
     def generate_carbs_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Углеводный ужин',
-                                              '⚡ Восстанавливает энергию\n🍚 Сложные углеводы\n💪 Подготавливает к следующему дню\n🌟 Обеспечивает сон',
-                                              'thursday')
+        return self.generate_planned('generate_carbs_dinner')
 
     def generate_balance_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Сбалансированный завтрак',
-                                              '⚡ Энергия и питательность\n💪 Белки для сытости\n🥬 Витамины для здоровья\n🌟 Идеальный баланс',
-                                              'friday')
+        return self.generate_planned('generate_balance_breakfast')
 
     def generate_balance_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Сбалансированный обед',
-                                              '🍽️ Идеальное сочетание нутриентов\n💪 Поддержка энергии\n🌟 Оптимальное насыщение\n🛡️ Польза для здоровья',
-                                              'friday')
+        return self.generate_planned('generate_balance_lunch')
 
     def generate_balance_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Сбалансированный ужин',
-                                              '🌙 Легкий и питательный\n💪 Восстановление организма\n🌟 Подготовка ко сну\n🛡️ Оптимальное питание',
-                                              'friday')
+        return self.generate_planned('generate_balance_dinner')
 
     def generate_family_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Семейный завтрак',
-                                              '👨‍👩‍👧‍👦 Объединяет семью за столом\n😊 Вкусно и полезно для всех\n💫 Начинает день с радости\n🌟 Создает традиции',
-                                              'saturday')
+        return self.generate_planned('generate_family_breakfast')
 
     def generate_family_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Семейный обед',
-                                              '👨‍👩‍👧‍👦 Объединяет за обеденным столом\n😊 Вкусно и полезно для всех\n💫 Создает семейные традиции\n🌟 Укрепляет связи',
-                                              'saturday')
+        return self.generate_planned('generate_family_lunch')
 
     def generate_family_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Семейный ужин',
-                                              '👨‍👩‍👧‍👦 Завершает день вместе\n😊 Вкусно и полезно\n💫 Создает теплую атмосферу\n🌟 Объединяет семью',
-                                              'saturday')
+        return self.generate_planned('generate_family_dinner')
 
     def generate_sunday_breakfast(self):
-        return self._generate_with_enhanced_gpt('breakfast', 'Воскресный бранч',
-                                              '🎉 Праздничное настроение\n👨‍👩‍👧‍👦 Идеально для семейного дня\n🍽️ Особенный вкус\n💫 Завершает неделю',
-                                              'sunday')
-
-    def generate_sunday_lunch(self):
-        return self._generate_with_enhanced_gpt('lunch', 'Воскресный обед',
-                                              '🎉 Праздничная атмосфера\n👨‍👩‍👧‍👦 Семейное время\n🍽️ Особенный вкус\n💫 Завершает выходные',
-                                              'sunday')
-
-    def generate_week_prep_dinner(self):
-        return self._generate_with_enhanced_gpt('dinner', 'Ужин для подготовки к неделе',
-                                              '📋 Закладывает основу на неделю\n💪 Питательный и сбалансированный\n🌟 Настраивает на продуктивность\n🛡️ Гарантирует успех',
-                                              'sunday')
-
-    # ОБНОВЛЕННЫЕ МЕТОДЫ ДЛЯ ДЕСЕРТОВ
-    def generate_friday_dessert(self):
-        """Десерт для пятницы с принципом 80/20"""
-        return self._generate_healthy_dessert('friday_dessert', 'Пятничный десерт по принципу 80/20',
-                                            '⭐ 80% пользы, 20% удовольствия\n😊 Удовлетворяет craving без чувства вины\n⚖️ Баланс дисциплины и гибкости\n🧠 Поддержка дофаминовой системы',
-                                            'friday')
-
-    def generate_saturday_dessert(self):
-        """Семейный десерт для субботы"""
-        return self._generate_healthy_dessert('saturday_dessert', 'Семейный десерт для субботнего вечера',
-                                            '👨‍👩‍👧‍👦 Объединяет семью за сладким\n😊 Безопасен для детей\n💫 Создает теплые воспоминания\n🌟 Формирует здоровые привычки',
-                                            'saturday')
-
-    def generate_sunday_dessert(self):
-        """Десерт для завершения выходных"""
-        return self._generate_healthy_dessert('sunday_dessert', 'Воскресный десерт для завершения недели',
-                                            '🍰 Сладкое завершение недели\n😊 Вкусные воспоминания без чувства вины\n🧠 Подготовка к продуктивной неделе\n⚡ Стабильная энергия',
-                                            'sunday')
-
-    def _generate_healthy_dessert(self, content_type, theme, benefits, day_of_week=None):
-        """Специализированная генерация десертов правильного питания"""
-        with self.generator_lock:
-            try:
-                # Логируем генерацию десерта
-                logger.info(f"🍰 Генерация десерта правильного питания: {theme} для дня {day_of_week}")
-                
-                # Генерируем контент через специализированный метод GPT
-                content = self.gpt_generator.generate_content(content_type, theme)
-                
-                # Получаем соответствующий эмоциональный триггер
-                emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
-                
-                # Форматируем пост
-                post = self.visual_manager.generate_attractive_post(
-                    theme.upper(),
-                    content,
-                    content_type,
-                    benefits,
-                    emotional_trigger=emotional_trigger,
-                    include_science_approach=True,
-                    day_of_week=day_of_week
-                )
-                return post
-            except Exception as e:
-                logger.error(f"❌ Ошибка генерации десерта: {e}")
-                return self._get_fallback_dessert(content_type, theme, benefits, day_of_week)
+        return self.generate_planned('generate_sunday_breakfast')
 
-    def _generate_with_enhanced_gpt(self, content_type, theme, benefits, day_of_week=None):
-        """Генерация контента через улучшенный Yandex GPT с правильными триггерами"""
-        with self.generator_lock:
-            try:
-                # Логируем детали генерации
-                current_times = TimeManager.get_current_times()
-                logger.info(f"🔄 Генерация контента: {theme} | Тип: {content_type} | День: {day_of_week} | Дата: {current_times['kemerovo_date']}")
-                
-                # Генерируем контент
-                content = self.gpt_generator.generate_content(content_type, theme)
-                
-                # Получаем соответствующий эмоциональный триггер
-                emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
-                
-                # Форматируем пост
-                post = self.visual_manager.generate_attractive_post(
-                    theme.upper(),
-                    content,
-                    content_type,
-                    benefits,
-                    emotional_trigger=emotional_trigger,
-                    include_science_approach=True,
-                    day_of_week=day_of_week
-                )
-                return post
-            except Exception as e:
-                logger.error(f"❌ Ошибка генерации контента через GPT: {e}")
-                return self._get_fallback_content(content_type, theme, benefits, day_of_week)
+    def generate_sunday_lunch(self):
+        return self.generate_planned('generate_sunday_lunch')
 
-    def _get_fallback_content(self, content_type, theme, benefits, day_of_week=None):
-        """Резервный контент если GPT не работает"""
-        emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
-        
-        fallback_content = f"""
-📊 <b>ПИЩЕВАЯ ЦЕННОСТЬ НА ПОРЦИЮ:</b>
-• 🔥 Калории: 300-400 ккал
-• 🍗 Белки: 20-30 г
-• 🥑 Жиры: 15-25 g
-• 🌾 Углеводы: 20-30 г
-• 🌿 Клетчатка: 5-8 г
+    def generate_week_prep_dinner(self):
+        return self.generate_planned('generate_week_prep_dinner')
 
-🛒 <b>ИНГРЕДИЕНТЫ НА 4 ПОРЦИИ:</b>
-• 🥕 Свежие овощи и зелень
-• 🍗 Качественные белки  
-• 🌾 Полезные углеводы
-• 🫒 Полезные жиры
-• 🌶️ Специи и травы
+    # ОБНОВЛЕННЫЕ МЕТОДЫ ДЛЯ ДЕСЕРТОВ
+    def generate_friday_dessert(self):
+        return self.generate_planned('generate_friday_dessert')
 
-👨‍🍳 <b>ПРОЦЕСС ПРИГОТОВЛЕНИЯ:</b>
-<tg-spoiler>1. 🥣 Подготовить все ингредиенты
-2. 🍳 Следовать классическому рецепту
-3. 🔥 Готовить на среднем огне
-4. 🍽️ Подавать горячим для семьи</tg-spoiler>
+    def generate_saturday_dessert(self):
+        return self.generate_planned('generate_saturday_dessert')
 
-💡 <b>НАУЧНАЯ ПОЛЬЗА:</b>
-Сбалансированное сочетание нутриентов обеспечивает оптимальное питание для всей семьи."""
+    def generate_sunday_dessert(self):
+        return self.generate_planned('generate_sunday_dessert')
+
+    def generate_planned(self, method_name):
+        """Генерирует пост слота по описанию из CONTENT_PLAN"""
+        spec = CONTENT_PLAN[method_name]
+        if 'dessert' in spec.content_type:
+            return self._generate_healthy_dessert(*spec)
+        return self._generate_with_enhanced_gpt(*spec)
+
+    def prebuild_fallbacks(self):
+        """Собирает неизменные части резервных постов для всех слотов заранее, чтобы сбой GPT не стоил времени.
+        Таблица строится целиком и подменяется одним присваиванием: читатели не видят ее пустой"""
+        fallback_parts = {}
+        for content_type, theme, benefits, day_of_week in CONTENT_PLAN.values():
+            fallback_parts[(content_type, theme, day_of_week)] = self._build_fallback_parts(content_type, theme, day_of_week)
+        self.fallback_parts = fallback_parts
+        logger.info(f"🧰 Подготовлено резервных постов: {len(fallback_parts)}")
+
+    def _build_fallback_parts(self, content_type, theme, day_of_week=None):
+        return {
+            'title': theme.upper(),
+            'trigger': self.visual_manager.get_emotional_trigger(content_type, day_of_week),
+            # У десертов текст зависит от случайного шаблона и собирается при вызове
+            'content': None if 'dessert' in content_type else FALLBACK_RECIPE_CONTENT
+        }
 
+    def _remember_source(self, post, content):
+        with self.sources_lock:
+            self.post_sources[post] = content
+            while len(self.post_sources) > EnhancedYandexGPTGenerator.UNPUBLISHED_LIMIT:
+                self.post_sources.popitem(last=False)
+
+    def record_published(self, post):
+        """Вызывается после успешной отправки поста: его генерация становится частью архива похожих"""
+        with self.sources_lock:
+            content = self.post_sources.pop(post, None)
+        if content is not None:
+            self.gpt_generator.record_published(content)
+
+    def rebuild_fallbacks(self, _section=None):
+        """Пересобирает резервные посты после обновления библиотеки контента"""
+        self.prebuild_fallbacks()
+
+    def get_fallback_post(self, content_type, theme, benefits, day_of_week=None):
+        """Резервный пост слота: неизменные части из готовой таблицы, а фото и шаблон десерта
+        выбираются при каждом вызове, чтобы повторные сбои GPT не давали один и тот же пост"""
+        parts = self.fallback_parts.get((content_type, theme, day_of_week)) \
+            or self._build_fallback_parts(content_type, theme, day_of_week)
+        content = parts['content'] or self._get_fallback_dessert_content(day_of_week)
         return self.visual_manager.generate_attractive_post(
-            theme.upper(),
-            fallback_content,
+            parts['title'],
+            content,
             content_type,
             benefits,
-            emotional_trigger=emotional_trigger,
+            emotional_trigger=parts['trigger'],
             include_science_approach=True,
             day_of_week=day_of_week
         )
 
-    def _get_fallback_dessert(self, content_type, theme, benefits, day_of_week=None):
-        """Резервный десерт с правильным питанием"""
+    def _generate_healthy_dessert(self, content_type, theme, benefits, day_of_week=None):
+        """Специализированная генерация десертов правильного питания"""
+        try:
+            # Логируем генерацию десерта
+            logger.info(f"🍰 Генерация десерта правильного питания: {theme} для дня {day_of_week}")
+            
+            # Генерируем контент через специализированный метод GPT
+            content = self.gpt_generator.generate_content(content_type, theme)
+            
+            # Получаем соответствующий эмоциональный триггер
+            emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
+            
+            # Форматируем пост
+            post = self.visual_manager.generate_attractive_post(
+                theme.upper(),
+                content,
+                content_type,
+                benefits,
+                emotional_trigger=emotional_trigger,
+                include_science_approach=True,
+                day_of_week=day_of_week
+            )
+            self._remember_source(post, content)
+            return post
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации десерта: {e}")
+            return self.get_fallback_post(content_type, theme, benefits, day_of_week)
+
+    def _generate_with_enhanced_gpt(self, content_type, theme, benefits, day_of_week=None):
+        """Генерация контента через улучшенный Yandex GPT с правильными триггерами"""
+        try:
+            # Логируем детали генерации
+            current_times = TimeManager.get_current_times()
+            logger.info(f"🔄 Генерация контента: {theme} | Тип: {content_type} | День: {day_of_week} | Дата: {current_times['kemerovo_date']}")
+            
+            # Генерируем контент
+            content = self.gpt_generator.generate_content(content_type, theme)
+            
+            # Получаем соответствующий эмоциональный триггер
+            emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
+            
+            # Форматируем пост
+            post = self.visual_manager.generate_attractive_post(
+                theme.upper(),
+                content,
+                content_type,
+                benefits,
+                emotional_trigger=emotional_trigger,
+                include_science_approach=True,
+                day_of_week=day_of_week
+            )
+            self._remember_source(post, content)
+            return post
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации контента через GPT: {e}")
+            return self.get_fallback_post(content_type, theme, benefits, day_of_week)
+
+    def _get_fallback_dessert_content(self, day_of_week=None):
+        """Текст резервного десерта с правильным питанием"""
         
         # Получаем шаблон десерта от менеджера
-        dessert_template = self.dessert_manager.get_dessert_template(day_of_week)
+        dessert_template = self.dessert_manager.get_dessert_template(day_of_week, record=False)
         dessert_benefits = self.dessert_manager.get_dessert_benefits(dessert_template)
         dessert_science = self.dessert_manager.get_dessert_science(dessert_template)
         
-        emotional_trigger = self.visual_manager.get_emotional_trigger(content_type, day_of_week)
-        
         # Форматируем контент десерта
-        dessert_content = f"""📊 <b>ПИЩЕВАЯ ЦЕННОСТЬ НА ПОРЦИЮ:</b>
+        return f"""📊 <b>ПИЩЕВАЯ ЦЕННОСТЬ НА ПОРЦИЮ:</b>
 • 🔥 {dessert_template['calories']} ккал (сбалансированная энергия)
 • 💪 {dessert_template['protein_g']}г белка (сытость на 3-4 часа)
 • 🥑 Полезные жиры (омега-3 и мононенасыщенные)
@@ -2208,41 +4218,401 @@ class EnhancedContentGenerator:
 • ⏱️ Время приготовления: {dessert_template['prep_time']}
 • 👥 Порций: {dessert_template['serves']}
 • ❄️ Хранение: {dessert_template['storage']}"""
-        
-        return self.visual_manager.generate_attractive_post(
-            theme.upper(),
-            dessert_content,
-            content_type,
-            benefits,
-            emotional_trigger=emotional_trigger,
-            include_science_approach=True,
-            day_of_week=day_of_week
-        )
+
+# ========== ЖУРНАЛ ОТПРАВЛЕННЫХ СООБЩЕНИЙ ==========
+
+class SentMessageStore:
+    """Дедупликация отправок: ключи (чат, хэш контента / слот) с TTL.
+
+    Записи живут в SQLite и видны всем процессам; в памяти держится только
+    ограниченный LRU недавних отправок, чтобы повторные проверки не ходили в базу.
+    """
+
+    COMPACT_INTERVAL_SECONDS = 3600
+
+    def __init__(self, path=None, ttl_seconds=None, memory_size=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds or Config.DEDUP_TTL_HOURS * 3600
+        self.memory_size = memory_size or Config.DEDUP_MEMORY_SIZE
+        self.recent = OrderedDict()
+        self.connection = None
+        self.store_lock = Lock()
+        self.last_compaction = time.time()
+        self.duplicates_blocked = 0
+        self.compactions = 0
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = open_sqlite(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sent_messages ("
+                "chat_id TEXT NOT NULL, dedup_key TEXT NOT NULL, sent_at REAL NOT NULL, "
+                "PRIMARY KEY (chat_id, dedup_key))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_sent_at ON sent_messages (sent_at)")
+        return self.connection
+
+    @staticmethod
+    def make_keys(content_hash, slot_key=None):
+        keys = [f"hash:{content_hash}"]
+        if slot_key:
+            keys.append(f"slot:{slot_key}")
+        return keys
+
+    def is_duplicate(self, chat_id, content_hash, slot_key=None):
+        """Проверяет, отправлялся ли уже этот контент или этот слот в чат"""
+        min_timestamp = time.time() - self.ttl_seconds
+        keys = self.make_keys(content_hash, slot_key)
+        with self.store_lock:
+            for key in keys:
+                sent_at = self.recent.get((chat_id, key))
+                if sent_at is not None and sent_at >= min_timestamp:
+                    self.recent.move_to_end((chat_id, key))
+                    self.duplicates_blocked += 1
+                    return True
+            if self.path:
+                placeholders = ','.join('?' * len(keys))
+                row = self._connect().execute(
+                    f"SELECT dedup_key, sent_at FROM sent_messages "
+                    f"WHERE chat_id = ? AND dedup_key IN ({placeholders}) AND sent_at >= ? LIMIT 1",
+                    (chat_id, *keys, min_timestamp)
+                ).fetchone()
+                if row:
+                    self._remember(chat_id, row[0], row[1])
+                    self.duplicates_blocked += 1
+                    return True
+        return False
+
+    def record(self, chat_id, content_hash, slot_key=None):
+        """Фиксирует успешную отправку"""
+        now = time.time()
+        keys = self.make_keys(content_hash, slot_key)
+        with self.store_lock:
+            for key in keys:
+                self._remember(chat_id, key, now)
+            if self.path:
+                self._connect().executemany(
+                    "INSERT OR REPLACE INTO sent_messages (chat_id, dedup_key, sent_at) VALUES (?, ?, ?)",
+                    [(chat_id, key, now) for key in keys]
+                )
+            if now - self.last_compaction > self.COMPACT_INTERVAL_SECONDS:
+                self._compact(now)
+
+    def _remember(self, chat_id, key, sent_at):
+        self.recent[(chat_id, key)] = sent_at
+        self.recent.move_to_end((chat_id, key))
+        while len(self.recent) > self.memory_size:
+            self.recent.popitem(last=False)
+
+    def _compact(self, now):
+        """Удаляет просроченные ключи из памяти и базы"""
+        min_timestamp = now - self.ttl_seconds
+        expired = [key for key, sent_at in self.recent.items() if sent_at < min_timestamp]
+        for key in expired:
+            del self.recent[key]
+        removed = 0
+        if self.path:
+            removed = self._connect().execute(
+                "DELETE FROM sent_messages WHERE sent_at < ?", (min_timestamp,)
+            ).rowcount
+        self.last_compaction = now
+        self.compactions += 1
+        if expired or removed:
+            logger.info(f"🧹 Журнал отправок: удалено {removed} записей из базы, {len(expired)} из памяти")
+
+    def compact(self):
+        with self.store_lock:
+            self._compact(time.time())
+
+    def get_stats(self):
+        with self.store_lock:
+            stored = None
+            if self.path:
+                stored = self._connect().execute("SELECT COUNT(*) FROM sent_messages").fetchone()[0]
+            return {
+                "storage": "sqlite" if self.path else "memory",
+                "memory_entries": len(self.recent),
+                "stored_entries": stored,
+                "duplicates_blocked": self.duplicates_blocked,
+                "compactions": self.compactions,
+                "ttl_hours": self.ttl_seconds / 3600
+            }
+
+def create_sent_message_store():
+    """Журнал отправок в общем SQLite файле, либо только в памяти процесса"""
+    if Config.DEDUP_BACKEND == 'sqlite':
+        return SentMessageStore(Config.STORAGE_DB_PATH)
+    return SentMessageStore()
+
+# ========== ОЧЕРЕДЬ ОТПРАВКИ В TELEGRAM ==========
+
+class TokenBucket:
+    """Ограничитель частоты отправок в один чат; retry_after от Telegram блокирует чат целиком"""
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Сколько секунд ждать до следующей разрешенной отправки"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+class SendRequest:
+    """Сообщение в очереди: результат отправки получает ожидающий поток через future"""
+
+    def __init__(self, chat_id, text, parse_mode, slot_key, priority, max_attempts):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.slot_key = slot_key
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0
+        self.future = Future()
+
+class TelegramSendQueue:
+    """Приоритетная очередь sendMessage: один отправитель, token bucket на каждый чат"""
+
+    PRIORITY_HIGH = 0    # публикации по расписанию
+    PRIORITY_NORMAL = 1  # ручные посты
+    PRIORITY_LOW = 2     # тестовые отправки
+
+    IDLE_DELAY_SECONDS = 60
+    MAX_BACKOFF_SECONDS = 60
+
+    def __init__(self, deliver, runtime=None, executor=None):
+        self.deliver = deliver
+        self.runtime = runtime or background_runtime
+        # Свой пул: общий пул рантайма занят задачами планировщика и самим циклом отправителя
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=Config.TELEGRAM_SENDER_THREADS, thread_name_prefix='telegram-send')
+        self.heap = []
+        self.sequence = 0
+        self.buckets = {}
+        self.in_flight = set()
+        self.queue_lock = Lock()
+        self.loop = None
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, chat_id, text, parse_mode='HTML', slot_key=None, priority=PRIORITY_NORMAL, max_attempts=3):
+        item = SendRequest(chat_id, text, parse_mode, slot_key, priority, max_attempts)
+        with self.queue_lock:
+            self._push(item)
+            if self.loop is None:
+                self.loop = self.runtime.run_loop('telegram-sender', self._drain, retry_delay=1)
+        self.loop.wake()
+        return item.future
+
+    def _push(self, item):
+        self.sequence += 1
+        heapq.heappush(self.heap, (item.priority, self.sequence, item))
+        self.max_depth = max(self.max_depth, len(self.heap))
+
+    def _bucket(self, chat_id):
+        if chat_id not in self.buckets:
+            self.buckets[chat_id] = TokenBucket(Config.TELEGRAM_RATE_PER_MINUTE, Config.TELEGRAM_BURST)
+        return self.buckets[chat_id]
+
+    def _next_ready(self, now):
+        """По самому приоритетному готовому запросу на каждый чат, который может принять сообщение;
+        если готовых нет - пауза до ближайшего"""
+        batch = {}
+        wait = None
+        for entry in sorted(self.heap):
+            item = entry[2]
+            if item.future.cancelled():
+                self.heap.remove(entry)
+                continue
+            if item.chat_id in batch or item.chat_id in self.in_flight:
+                continue
+            delay = max(item.not_before - now, self._bucket(item.chat_id).delay(now))
+            if delay <= 0:
+                self.heap.remove(entry)
+                self._bucket(item.chat_id).consume(now)
+                batch[item.chat_id] = item
+                continue
+            wait = delay if wait is None else min(wait, delay)
+        heapq.heapify(self.heap)
+        return list(batch.values()), wait
+
+    def _attempt(self, item):
+        item.attempts += 1
+        waited = time.monotonic() - item.enqueued_at
+        try:
+            status, retry_after = self.deliver(item)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при отправке: {str(e)}")
+            status, retry_after = 'retry', None
+        return status, retry_after, waited
+
+    def _drain(self):
+        """Шаг цикла отправителя: раздает пулу отправки все, что разрешают лимиты, и возвращает паузу.
+        Пока сообщение в чат летит, следующие в этот чат ждут в очереди; остальные чаты не ждут никого"""
+        while True:
+            with self.queue_lock:
+                batch, wait = self._next_ready(time.monotonic())
+                batch = [item for item in batch if item.attempts or item.future.set_running_or_notify_cancel()]
+                self.in_flight.update(item.chat_id for item in batch)
+            if not batch:
+                return wait if wait is not None else self.IDLE_DELAY_SECONDS
+            for item in batch:
+                try:
+                    self.executor.submit(self._deliver_one, item)
+                except RuntimeError:
+                    # Пул отправки остановлен (процесс завершается): ждущие получат отказ, а не зависнут
+                    with self.queue_lock:
+                        self.in_flight.discard(item.chat_id)
+                    self._settle(item, 'failed', None, 0.0)
+
+    def _deliver_one(self, item):
+        """Попытка в потоке пула отправки; итог фиксируется сразу, не дожидаясь других чатов"""
+        status, retry_after, waited = 'retry', None, 0.0
+        try:
+            status, retry_after, waited = self._attempt(item)
+        finally:
+            with self.queue_lock:
+                self.in_flight.discard(item.chat_id)
+            self._settle(item, status, retry_after, waited)
+            if self.loop:
+                self.loop.wake()
+
+    def _settle(self, item, status, retry_after, waited):
+        """Итог попытки: повтор с паузой или результат в future"""
+        with self.queue_lock:
+            now = time.monotonic()
+            if status == 'retry' and item.attempts < item.max_attempts:
+                self.retries += 1
+                if retry_after:
+                    # Telegram назвал точную паузу: блокируем весь чат, а не только это сообщение
+                    self.rate_limited += 1
+                    self._bucket(item.chat_id).block(retry_after, now)
+                    logger.warning(f"⏳ Telegram ограничил частоту для {item.chat_id}: пауза {retry_after} сек")
+                else:
+                    item.not_before = now + min(2 ** item.attempts, self.MAX_BACKOFF_SECONDS)
+                self._push(item)
+                return
+            success = status == 'sent'
+            if success:
+                telegram_queue_wait_seconds.observe(waited, priority=item.priority)
+                self.sent += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            else:
+                self.failed += 1
+        item.future.set_result(success)
+
+    def get_stats(self):
+        with self.queue_lock:
+            now = time.monotonic()
+            return {
+                "depth": len(self.heap),
+                "max_depth": self.max_depth,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "avg_wait_seconds": round(self.total_wait / self.sent, 3) if self.sent else 0.0,
+                "max_wait_seconds": round(self.max_wait, 3),
+                "chats": {
+                    chat_id: {"tokens": round(bucket.tokens, 2), "blocked_for_seconds": round(max(bucket.blocked_until - now, 0), 1)}
+                    for chat_id, bucket in self.buckets.items()
+                }
+            }
 
 # ========== ТЕЛЕГРАМ МЕНЕДЖЕР ==========
 
 class TelegramManager:
-    def __init__(self):
+    def __init__(self, http_client=None, sent_store=None, runtime=None):
+        self.http = http_client or http_clients.get('telegram')
         self.token = Config.TELEGRAM_BOT_TOKEN
         self.channel = Config.TELEGRAM_CHANNEL
+        self.publish_chats = [chat.strip() for chat in Config.TELEGRAM_PUBLISH_CHATS.split(',') if chat.strip()] \
+            or [self.channel]
         self.base_url = f"https://api.telegram.org/bot{self.token}"
-        self.sent_hashes = set()
-        self.last_sent_times = {}
+        self.sent_store = sent_store or create_sent_message_store()
+        self.runtime = runtime or background_runtime
+        self.send_queue = TelegramSendQueue(self._deliver, self.runtime)
+        metrics.gauge('telegram_queue_depth', 'Сообщений в очереди отправки').set_function(
+            lambda: len(self.send_queue.heap))
         self._member_count = 0
         self._last_member_count_time = 0
-        self.telegram_lock = RLock()
+        self._last_member_attempt_time = 0
+        self.member_history = deque(maxlen=Config.MEMBER_HISTORY_SIZE)
+        self.member_refresh_lock = Lock()
+        self.member_lock = Lock()
+        self.member_loop = None
 
     def get_member_count(self):
-        """Получает реальное количество подписчиков через Telegram API с кэшированием"""
-        current_time = time.time()
-        
-        if current_time - self._last_member_count_time < 300 and self._member_count > 0:
+        """Последнее известное количество подписчиков: отвечает сразу, обновляет его фоновый цикл лидера"""
+        return self._member_count
+
+    def start_member_refresher(self):
+        """Периодический опрос getChatMembersCount; запускается только в процессе-лидере"""
+        with self.member_lock:
+            if self.member_loop is None:
+                self.member_loop = self.runtime.run_loop(
+                    'member-count', self._member_refresh_step, retry_delay=Config.MEMBER_COUNT_REFRESH_SECONDS
+                )
+
+    def stop_member_refresher(self):
+        with self.member_lock:
+            if self.member_loop:
+                self.member_loop.cancel()
+                self.member_loop = None
+
+    def _member_refresh_step(self):
+        self.refresh_member_count()
+        return Config.MEMBER_COUNT_REFRESH_SECONDS
+
+    def refresh_member_count(self):
+        """Запрашивает количество подписчиков у Telegram API.
+
+        Одновременные вызовы объединяются: пока идет запрос, остальные ждут
+        и получают его результат вместо повторного обращения к API - даже если запрос не удался.
+        """
+        started = time.time()
+        with self.member_refresh_lock:
+            if self._last_member_attempt_time >= started:
+                return self._member_count
+            count = self._fetch_member_count()
+            self._last_member_attempt_time = time.time()
+            if count is not None:
+                self._member_count = count
+                self._last_member_count_time = time.time()
+                self.member_history.append((datetime.now().isoformat(), count))
             return self._member_count
-            
+
+    def _fetch_member_count(self):
+        """Один запрос getChatMembersCount; None, если получить число не удалось"""
         try:
             if not self.token or self.token == 'your-telegram-bot-token':
                 logger.warning("⚠️ Токен бота не настроен, возвращаем 0")
-                return 0
+                return None
                 
             url = f"{self.base_url}/getChatMembersCount"
             payload = {
@@ -2250,224 +4620,431 @@ class TelegramManager:
             }
             
             logger.info(f"🔍 Запрос количества подписчиков для канала: {self.channel}")
-            response = requests.post(url, json=payload, timeout=10)
+            response = self.http.post(url, json=payload, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
                     count = result.get('result', 0)
-                    self._member_count = count
-                    self._last_member_count_time = current_time
                     logger.info(f"✅ Актуальное количество подписчиков: {count}")
                     return count
                 else:
                     logger.error(f"❌ Ошибка Telegram API: {result.get('description')}")
-                    return self._member_count if self._member_count > 0 else 0
+                    return None
             else:
                 logger.error(f"❌ HTTP ошибка получения количества подписчиков: {response.status_code}")
-                return self._member_count if self._member_count > 0 else 0
+                return None
                 
         except Exception as e:
             logger.error(f"❌ Ошибка получения количества подписчиков: {e}")
-            return self._member_count if self._member_count > 0 else 0
-
-    def send_with_fallback(self, text, event_name, max_retries=3):
-        for attempt in range(max_retries):
-            try:
-                success = self.send_message(text)
-                if success:
-                    service_monitor.record_sent_message()
-                    return True
-                else:
-                    logger.warning(f"⚠️ Попытка {attempt + 1} не удалась для {event_name}")
-                    time.sleep(10)
-            except Exception as e:
-                logger.error(f"❌ Ошибка при попытке {attempt + 1}: {e}")
-                time.sleep(10)
+            return None
+
+    def get_member_history(self):
+        """Ряд (время, количество подписчиков) по успешным обновлениям"""
+        with self.member_refresh_lock:
+            return list(self.member_history)
+
+    def send_with_fallback(self, text, event_name, max_retries=3, slot_key=None, priority=TelegramSendQueue.PRIORITY_NORMAL):
+        """Отправка с повторами: паузы между попытками задает очередь (retry_after или back-off)"""
+        success = self.send_message(text, slot_key=slot_key, priority=priority, max_attempts=max_retries)
+        if success:
+            service_monitor.record_sent_message()
+            return True
 
         logger.error(f"❌ Все {max_retries} попыток отправки провалились: {event_name}")
         service_monitor.record_missed_message(event_name)
         return False
 
-    def send_message(self, text, parse_mode='HTML'):
-        with self.telegram_lock:
-            try:
-                current_time = datetime.now()
-                time_key = current_time.strftime('%Y-%m-%d %H:%M')
-
-                if time_key in self.last_sent_times:
-                    time_diff = (current_time - self.last_sent_times[time_key]).total_seconds()
-                    if time_diff < 600:
-                        logger.warning(f"⚠️ Попытка дублирования в течение 10 минут: {time_key}")
-                        return False
-
-                if not self.token or self.token == 'your-telegram-bot-token':
-                    logger.error("❌ Токен бота не настроен!")
-                    return False
-
-                content_hash = hashlib.md5(text.encode()).hexdigest()
-                if content_hash in self.sent_hashes:
-                    logger.warning("⚠️ Попытка отправить дубликат контента")
-                    return False
-                
-                # ВАЛИДАЦИЯ КОНТЕНТА ПЕРЕД ОТПРАВКОЙ
-                def validate_telegram_content(content):
-                    # Проверка длины
-                    if len(content) > 4096:
-                        logger.error(f"❌ Сообщение слишком длинное: {len(content)} символов")
-                        return False, None
-                    
-                    # Проверка на незакрытые теги
-                    tag_pairs = [('*', '*'), ('<b>', '</b>'), ('<i>', '</i>'), ('<code>', '</code>'), ('<pre>', '</pre>')]
-                    
-                    # Для Markdown
-                    if parse_mode == 'Markdown':
-                        # Проверяем корректность Markdown
-                        if content.count('*') % 2 != 0:
-                            logger.warning("⚠️ Непарные * в Markdown, исправляем")
-                            content = content + '*' if content.count('*') % 2 == 1 else content
-                    
-                    # Для HTML
-                    elif parse_mode == 'HTML':
-                        # Убираем невалидные HTML теги
-                        allowed_tags = {'b', 'i', 'code', 'pre', 'a', 'tg-spoiler'}
-                        content = re.sub(r'<(?!\/?(?:' + '|'.join(allowed_tags) + ')\b)[^>]+>', '', content)
-                        
-                        # Проверяем парность тегов
-                        for tag in allowed_tags:
-                            open_count = content.count(f'<{tag}>')
-                            close_count = content.count(f'</{tag}>')
-                            if open_count != close_count:
-                                logger.warning(f"⚠️ Непарные теги <{tag}>, исправляем")
-                                if open_count > close_count:
-                                    content += f'</{tag}>' * (open_count - close_count)
-                                else:
-                                    content = f'<{tag}>' * (close_count - open_count) + content
-                    
-                    return True, content
-                
-                is_valid, validated_text = validate_telegram_content(text)
-                if not is_valid:
-                    logger.error("❌ Контент не прошел валидацию")
-                    return False
-
-                url = f"{self.base_url}/sendMessage"
-                payload = {
-                    'chat_id': self.channel,
-                    'text': validated_text,
-                    'parse_mode': parse_mode,
-                    'disable_web_page_preview': False
-                }
+    def publish(self, text, event_name, max_retries=3, slot_key=None, priority=TelegramSendQueue.PRIORITY_HIGH):
+        """Рассылает готовый пост во все чаты публикации сразу и сводит результаты в {чат: успех}.
+
+        Все сообщения встают в очередь одновременно: у каждого чата свой лимит частоты
+        и свой журнал дублей, поэтому медленный или ограниченный чат не задерживает
+        остальные. Пост считается опубликованным, если его принял хотя бы один чат.
+        """
+        slot_key = slot_key or datetime.now().strftime('minute:%Y-%m-%d %H:%M')
+        text = telegram_html.ensure(text)
+        futures = {
+            chat_id: self.send_queue.submit(chat_id, text, 'HTML', slot_key, priority, max_retries)
+            for chat_id in self.publish_chats
+        }
+        deadline = time.monotonic() + Config.TELEGRAM_SEND_WAIT_SECONDS
+        results = {chat_id: self._wait(future, deadline) for chat_id, future in futures.items()}
+
+        failed = [chat_id for chat_id, success in results.items() if not success]
+        if not failed:
+            telegram_publish_total.inc(outcome='full')
+            service_monitor.record_sent_message()
+        elif len(failed) < len(results):
+            telegram_publish_total.inc(outcome='partial')
+            service_monitor.record_sent_message()
+            logger.warning(f"⚠️ {event_name}: опубликовано не во все чаты, ошибки в {failed}")
+        else:
+            telegram_publish_total.inc(outcome='failed')
+            logger.error(f"❌ Публикация не удалась ни в одном чате: {event_name}")
+            service_monitor.record_missed_message(event_name)
+        return results
 
-                logger.info(f"🔗 Отправка сообщения в Telegram ({len(validated_text)} символов)...")
-                response = requests.post(url, json=payload, timeout=30)
+    def send_message(self, text, parse_mode='HTML', slot_key=None, chat_id=None,
+                     priority=TelegramSendQueue.PRIORITY_NORMAL, max_attempts=3):
+        """Ставит сообщение в очередь отправки и ждет результата.
 
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get('ok'):
-                        self.sent_hashes.add(content_hash)
-                        self.last_sent_times[time_key] = current_time
-                        logger.info("✅ Сообщение успешно отправлено в канал")
-                        return True
-                    else:
-                        logger.error(f"❌ Ошибка Telegram API: {result.get('description')}")
-                        # Пробуем отправить как plain text
-                        logger.info("🔄 Пробуем отправить как plain text...")
-                        payload['parse_mode'] = None
-                        payload['text'] = re.sub(r'<[^>]+>', '', validated_text)[:4096]
-                        response2 = requests.post(url, json=payload, timeout=30)
-                        if response2.status_code == 200:
-                            result2 = response2.json()
-                            if result2.get('ok'):
-                                logger.info("✅ Сообщение отправлено как plain text")
-                                return True
+        slot_key - слот расписания; без него слотом считается текущая минута.
+        """
+        slot_key = slot_key or datetime.now().strftime('minute:%Y-%m-%d %H:%M')
+        if parse_mode == 'HTML':
+            text = telegram_html.ensure(text)
+        future = self.send_queue.submit(
+            chat_id or self.channel, text, parse_mode, slot_key, priority, max_attempts
+        )
+        return self._wait(future, time.monotonic() + Config.TELEGRAM_SEND_WAIT_SECONDS)
+
+    def _wait(self, future, deadline):
+        """Результат отправки из очереди; по истечении общего срока запрос снимается"""
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            logger.error(f"❌ Сообщение не отправлено за {Config.TELEGRAM_SEND_WAIT_SECONDS} сек ожидания в очереди")
+            return False
+
+    def _deliver(self, item):
+        """Один вызов sendMessage. Возвращает (статус, retry_after): sent, failed или retry"""
+        text = item.text
+        parse_mode = item.parse_mode
+        chat_id = item.chat_id
+        try:
+            if not self.token or self.token == 'your-telegram-bot-token':
+                logger.error("❌ Токен бота не настроен!")
+                return 'failed', None
+
+            content_hash = hashlib.md5(text.encode()).hexdigest()
+            if self.sent_store.is_duplicate(chat_id, content_hash, item.slot_key):
+                logger.warning(f"⚠️ Попытка отправить дубликат контента или повторно занять слот: {item.slot_key}")
+                return 'failed', None
+            
+            # HTML уже очищен при генерации или в send_message
+            if len(text) > TelegramHTMLSanitizer.MAX_LENGTH:
+                logger.error(f"❌ Сообщение слишком длинное: {len(text)} символов")
+                return 'failed', None
+
+            url = f"{self.base_url}/sendMessage"
+            payload = {
+                'chat_id': chat_id,
+                'text': text,
+                'parse_mode': parse_mode,
+                'disable_web_page_preview': False
+            }
+
+            logger.info(f"🔗 Отправка сообщения в Telegram ({len(text)} символов)...")
+            started = time.perf_counter()
+            response = self.http.post(url, json=payload)
+            telegram_send_seconds.observe(time.perf_counter() - started)
+            telegram_responses_total.inc(code=response.status_code)
+
+            if response.status_code == 429:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 30)
+                return 'retry', retry_after
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('ok'):
+                    self.sent_store.record(chat_id, content_hash, item.slot_key)
+                    logger.info(f"✅ Сообщение успешно отправлено в {chat_id}")
+                    return 'sent', None
                 else:
-                    logger.error(f"❌ HTTP ошибка: {response.status_code}")
-                    if response.text:
-                        logger.error(f"❌ Ответ Telegram: {response.text}")
+                    logger.error(f"❌ Ошибка Telegram API: {result.get('description')}")
+            else:
+                logger.error(f"❌ HTTP ошибка: {response.status_code}")
+                if response.text:
+                    logger.error(f"❌ Ответ Telegram: {response.text}")
+                if response.status_code >= 500:
+                    return 'retry', None
+
+            return 'failed', None
+
+        except requests.RequestException as e:
+            telegram_responses_total.inc(code='connection_error')
+            logger.error(f"❌ Ошибка соединения при отправке: {str(e)}")
+            return 'retry', None
+
+# ========== ТАЙМЕРНЫЙ ПЛАНИРОВЩИК ==========
+
+class TimerJob:
+    """Еженедельное задание: день недели и время по часовому поясу сервера"""
+
+    def __init__(self, key, name, weekday, at_time, func, tz):
+        self.key = key
+        self.name = name
+        self.weekday = weekday
+        self.at_time = at_time
+        self.func = func
+        self.tz = tz
+        self.next_run = None
+        self.runs = 0
+        self.last_run = None
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def schedule_next(self, after):
+        """Ближайший запуск строго позже after"""
+        hour, minute = map(int, self.at_time.split(':'))
+        local_after = after.astimezone(self.tz)
+        days_ahead = (self.weekday - local_after.weekday()) % 7
+        run_date = local_after.date() + timedelta(days=days_ahead)
+        candidate = self.tz.localize(datetime(run_date.year, run_date.month, run_date.day, hour, minute))
+        if candidate <= after:
+            candidate += timedelta(days=7)
+        self.next_run = candidate
+        return candidate
+
+    def record_run(self, now):
+        lateness = max((now - self.next_run).total_seconds(), 0.0)
+        self.runs += 1
+        self.last_run = now
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+        scheduler_lateness_seconds.observe(lateness, slot=self.key)
 
-                return False
+    def get_stats(self):
+        return {
+            "name": self.name,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+            "runs": self.runs,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_lateness_seconds": round(self.last_lateness, 3),
+            "max_lateness_seconds": round(self.max_lateness, 3),
+            "avg_lateness_seconds": round(self.total_lateness / self.runs, 3) if self.runs else 0.0
+        }
 
+class TimerScheduler:
+    """Куча ближайших запусков: поток-владелец спит ровно до следующего задания.
+
+    Кучу трогает только поток-владелец (тот, что первым вызвал run_due);
+    другие потоки добавляют и удаляют задания через очередь команд.
+    """
+
+    MAX_SLEEP_SECONDS = 3600
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.jobs = {}
+        self.heap = []
+        self.sequence = 0
+        self.commands = []
+        self.commands_lock = Lock()
+        self.owner_thread = None
+        self.waker = None
+
+    def add_job(self, key, name, weekday, at_time, func):
+        self._enqueue(('add', TimerJob(key, name, weekday, at_time, func, self.tz)))
+
+    def remove_job(self, key):
+        self._enqueue(('remove', key))
+
+    def clear(self):
+        self._enqueue(('clear', None))
+
+    def _enqueue(self, command):
+        with self.commands_lock:
+            self.commands.append(command)
+        if self.waker:
+            self.waker()
+
+    def _check_owner(self):
+        current = threading.get_ident()
+        if self.owner_thread is None:
+            self.owner_thread = current
+        elif self.owner_thread != current:
+            raise RuntimeError("TimerScheduler.run_due вызван не из потока-владельца")
+
+    def _apply_commands(self, now):
+        with self.commands_lock:
+            commands, self.commands = self.commands, []
+        for action, payload in commands:
+            if action == 'add':
+                self.jobs[payload.key] = payload
+                self._push(payload, now)
+            elif action == 'remove':
+                self.jobs.pop(payload, None)
+            elif action == 'clear':
+                self.jobs.clear()
+                self.heap = []
+
+    def _push(self, job, now):
+        job.schedule_next(now)
+        self.sequence += 1
+        heapq.heappush(self.heap, (job.next_run, self.sequence, job))
+
+    def run_due(self, now=None):
+        """Запускает наступившие задания и возвращает паузу в секундах до следующего"""
+        self._check_owner()
+        now = now or datetime.now(self.tz)
+        self._apply_commands(now)
+
+        while self.heap and self.heap[0][0] <= now:
+            _, _, job = heapq.heappop(self.heap)
+            # Удаленные или замененные задания остаются в куче до своего срока
+            if self.jobs.get(job.key) is not job:
+                continue
+            job.record_run(now)
+            try:
+                job.func()
             except Exception as e:
-                logger.error(f"❌ Ошибка при отправке: {str(e)}")
-                return False
+                logger.error(f"❌ Ошибка запуска задания {job.name}: {e}")
+            self._push(job, now)
+
+        if not self.heap:
+            return self.MAX_SLEEP_SECONDS
+        delay = (self.heap[0][0] - datetime.now(self.tz)).total_seconds()
+        return min(max(delay, 0.01), self.MAX_SLEEP_SECONDS)
+
+    def get_stats(self):
+        jobs = sorted(list(self.jobs.values()), key=lambda job: job.next_run or datetime.max.replace(tzinfo=self.tz))
+        return {
+            "jobs_count": len(jobs),
+            "next_run": jobs[0].next_run.isoformat() if jobs and jobs[0].next_run else None,
+            "max_lateness_seconds": round(max((job.max_lateness for job in jobs), default=0.0), 3),
+            "jobs": {job.key: job.get_stats() for job in jobs}
+        }
+
+# ========== ПРЕДВАРИТЕЛЬНАЯ ГЕНЕРАЦИЯ КОНТЕНТА ==========
+
+class ContentPregenerator:
+    """Заранее генерирует ближайшие посты расписания в очередь готового контента"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.lookahead = timedelta(hours=Config.PREGENERATE_LOOKAHEAD_HOURS)
+        self.max_posts = Config.PREGENERATE_MAX_POSTS
+        self.interval = Config.PREGENERATE_INTERVAL_SECONDS
+        self.ready = {}
+        self.ready_lock = Lock()
+        self.fill_lock = Lock()
+        self.is_running = False
+        self.loop = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_slot_key(kemerovo_date, kemerovo_time, method_name):
+        return f"{kemerovo_date}_{kemerovo_time}_{method_name}"
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+
+        def fill_step():
+            self.fill()
+            return self.interval
+
+        # Шаг генерирует до max_posts постов подряд: каждому свой порог зависания
+        self.loop = self.scheduler.runtime.run_loop('pregenerator', fill_step, retry_delay=self.interval,
+                                                    step_budget=self.max_posts * Config.KEEP_ALIVE_STALL_SECONDS)
+        logger.info(f"🔮 Предварительная генерация запущена (окно: {self.lookahead}, постов: {self.max_posts})")
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.loop.cancel()
+        with self.ready_lock:
+            self.ready.clear()
+
+    def fill(self):
+        """Генерирует недостающие посты для ближайших слотов и убирает устаревшие"""
+        if not self.fill_lock.acquire(blocking=False):
+            return
+        try:
+            self._fill()
+        finally:
+            self.fill_lock.release()
+
+    def _fill(self):
+        now = datetime.now(Config.KEMEROVO_TZ)
+        with self.ready_lock:
+            stale = [key for key, entry in self.ready.items() if entry['slot_time'] < now - timedelta(hours=1)]
+            for key in stale:
+                del self.ready[key]
+
+        for slot_time, event in self.scheduler.get_upcoming_events(self.max_posts, self.lookahead):
+            slot_key = self.make_slot_key(slot_time.strftime('%Y-%m-%d'), slot_time.strftime('%H:%M'), event['method'])
+            with self.ready_lock:
+                if slot_key in self.ready:
+                    continue
+
+            method = getattr(self.scheduler.generator, event['method'], None)
+            if method is None:
+                continue
+
+            started = time.time()
+            content = method()
+            if content:
+                with self.ready_lock:
+                    self.ready[slot_key] = {'content': content, 'slot_time': slot_time, 'generated_at': time.time()}
+                logger.info(f"🔮 Пост подготовлен заранее: {event['name']} на {slot_time.strftime('%Y-%m-%d %H:%M')} "
+                            f"({time.time() - started:.1f}с)")
+
+    def take(self, slot_key):
+        """Забирает готовый пост для слота; None если его нет в очереди"""
+        with self.ready_lock:
+            entry = self.ready.pop(slot_key, None)
+            if entry:
+                self.hits += 1
+                return entry['content']
+            self.misses += 1
+            return None
+
+    def get_stats(self):
+        with self.ready_lock:
+            return {
+                "ready_posts": len(self.ready),
+                "ready_slots": sorted(self.ready.keys()),
+                "queue_hits": self.hits,
+                "queue_misses": self.misses
+            }
 
 # ========== УЛУЧШЕННЫЙ ПЛАНИРОВЩИК КОНТЕНТА ==========
 
 class EnhancedContentScheduler:
-    def __init__(self):
-        # ОБНОВЛЕННОЕ РАСПИСАНИЕ БЕЗ ТРЕНИРОВОК ДЛЯ СНОУБОРДА И ОТЦА С СЫНОМ
-        self.kemerovo_schedule = {
-            # ПОНЕДЕЛЬНИК (0) - НЕЙРОПИТАНИЕ
-            0: {
-                "08:30": {"name": "🧠 Нейропитание для старта недели", "type": "monday_science", "method": "generate_monday_science"},
-                "09:00": {"name": "🍳 Завтрак для когнитивных функций", "type": "cognitive_breakfast", "method": "generate_cognitive_breakfast"},
-                "13:00": {"name": "🍲 Обед для ментальной энергии", "type": "mental_energy_lunch", "method": "generate_mental_energy_lunch"},
-                "19:00": {"name": "🥗 Ужин для восстановления нейронов", "type": "neuro_recovery_dinner", "method": "generate_neuro_recovery_dinner"}
-            },
-            # ВТОРНИК (1) - БЕЛКОВЫЙ МЕТАБОЛИЗМ
-            1: {
-                "08:30": {"name": "💪 Белковый метаболизм и восстановление", "type": "tuesday_science", "method": "generate_tuesday_science"},
-                "09:00": {"name": "🥚 Завтрак: Чередование белков", "type": "protein_rotation_breakfast", "method": "generate_protein_rotation_breakfast"},
-                "13:00": {"name": "🍗 Обед: Новый источник белка", "type": "novel_protein_lunch", "method": "generate_novel_protein_lunch"},
-                "19:00": {"name": "🐟 Ужин: Морские белки", "type": "seafood_dinner", "method": "generate_seafood_dinner"}
-            },
-            # СРЕДА (2) - ДЕТОКС И ОЧИЩЕНИЕ
-            2: {
-                "08:30": {"name": "🍃 Детокс и очищение в середине недели", "type": "wednesday_science", "method": "generate_wednesday_science"},
-                "09:00": {"name": "🥬 Овощной завтрак", "type": "veggie_breakfast", "method": "generate_veggie_breakfast"},
-                "13:00": {"name": "🥦 Обед: Овощное разнообразие", "type": "veggie_lunch", "method": "generate_veggie_lunch"},
-                "19:00": {"name": "🥑 Ужин: Легкие овощные блюда", "type": "veggie_dinner", "method": "generate_veggie_dinner"}
-            },
-            # ЧЕТВЕРГ (3) - ЭНЕРГЕТИЧЕСКИЙ МЕТАБОЛИЗМ
-            3: {
-                "08:30": {"name": "⚡ Энергетический метаболизм для финала недели", "type": "thursday_science", "method": "generate_thursday_science"},
-                "09:00": {"name": "🍠 Углеводный завтрак", "type": "carbs_breakfast", "method": "generate_carbs_breakfast"},
-                "13:00": {"name": "🍚 Обед: Сложные углеводы", "type": "carbs_lunch", "method": "generate_carbs_lunch"},
-                "19:00": {"name": "🥔 Ужин: Углеводы для восстановления", "type": "carbs_dinner", "method": "generate_carbs_dinner"}
-            },
-            # ПЯТНИЦА (4) - БАЛАНС ПИТАНИЯ
-            4: {
-                "08:30": {"name": "⭐ Баланс питания и психология", "type": "friday_science", "method": "generate_friday_science"},
-                "09:00": {"name": "🥞 Сбалансированный завтрак", "type": "balance_breakfast", "method": "generate_balance_breakfast"},
-                "13:00": {"name": "🍝 Обед: Идеальный баланс", "type": "balance_lunch", "method": "generate_balance_lunch"},
-                "19:00": {"name": "🍽️ Ужин: Сбалансированный финал недели", "type": "balance_dinner", "method": "generate_balance_dinner"}
-            },
-            # СУББОТА (5) - СЕМЕЙНАЯ НУТРИЦИОЛОГИЯ
-            5: {
-                "08:30": {"name": "👨‍👩‍👧‍👦 Семейная нутрициология", "type": "saturday_science", "method": "generate_saturday_science"},
-                "10:00": {"name": "🍳 Семейный завтрак", "type": "family_breakfast", "method": "generate_family_breakfast"},
-                "13:00": {"name": "👨‍🍳 Семейный обед", "type": "family_lunch", "method": "generate_family_lunch"},
-                "16:00": {"name": "🎂 Семейный десерт", "type": "saturday_dessert", "method": "generate_saturday_dessert"},
-                "19:00": {"name": "🍽️ Семейный ужин", "type": "family_dinner", "method": "generate_family_dinner"}
-            },
-            # ВОСКРЕСЕНЬЕ (6) - ПЛАНИРОВАНИЕ И АКТИВНЫЙ ОТДЫХ
-            6: {
-                "08:30": {"name": "📊 Планирование питания на неделю", "type": "sunday_science", "method": "generate_sunday_science"},
-                "10:00": {"name": "☀️ Воскресный бранч", "type": "sunday_breakfast", "method": "generate_sunday_breakfast"},
-                "13:00": {"name": "🛒 Обед + план на неделю", "type": "sunday_lunch", "method": "generate_sunday_lunch"},
-                "16:00": {"name": "🍰 Воскресный десерт", "type": "sunday_dessert", "method": "generate_sunday_dessert"},
-                "17:00": {"name": "🎒 Полезные перекусы для активного отдыха", "type": "active_snacks", "method": "generate_active_snacks"},
-                "19:00": {"name": "📋 Ужин для подготовки", "type": "week_prep_dinner", "method": "generate_week_prep_dinner"}
-            }
-        }
+    def __init__(self, telegram=None, generator=None, runtime=None, library=None):
+        # Расписание по времени Кемерово - из файла контента, обновляется без перезапуска
+        self.library = library or content_library
+        self.kemerovo_schedule = self.library.get('schedule')
+        self.timeline = WeeklyTimeline(self.kemerovo_schedule)
 
         self.server_schedule = self._convert_schedule_to_server()
         self.is_running = False
-        self.telegram = TelegramManager()
-        self.generator = EnhancedContentGenerator()
+        self.telegram = telegram or TelegramManager()
+        self.generator = generator or EnhancedContentGenerator()
+        self.runtime = runtime or background_runtime
+        self.scheduler_loop = None
+        self.timer = TimerScheduler(Config.SERVER_TZ)
         self.scheduler_lock = RLock()
         self.running_jobs = set()
+        self.pregenerator = ContentPregenerator(self)
+        self.library.subscribe('schedule', self.apply_schedule, validate=self.validate_schedule)
 
     def _convert_schedule_to_server(self):
+        """Расписание по дню и времени сервера; ранние слоты Кемерово уходят на предыдущий день UTC"""
         server_schedule = {}
         for day, day_schedule in self.kemerovo_schedule.items():
-            server_schedule[day] = {}
             for kemerovo_time, event in day_schedule.items():
-                server_time = TimeManager.kemerovo_to_server(kemerovo_time)
-                server_schedule[day][server_time] = event
+                server_day, server_time = self.timeline.server_slot(day, kemerovo_time)
+                server_schedule.setdefault(server_day, {})[server_time] = {
+                    **event, 'kemerovo_day': day, 'kemerovo_time': kemerovo_time
+                }
         return server_schedule
 
+    def _server_slots(self):
+        """(день, время Кемерово) -> (день, время сервера) для текущего расписания"""
+        return {(event['kemerovo_day'], event['kemerovo_time']): (server_day, server_time)
+                for server_day, day_schedule in self.server_schedule.items()
+                for server_time, event in day_schedule.items()}
+
     def start_scheduler(self):
         if self.is_running:
             return
@@ -2478,7 +5055,7 @@ class EnhancedContentScheduler:
             logger.error("❌ Критические ошибки валидации! Планировщик не запущен.")
             return False
 
-        schedule.clear()
+        self.timer.clear()
 
         for day, day_schedule in self.server_schedule.items():
             for server_time, event in day_schedule.items():
@@ -2486,17 +5063,28 @@ class EnhancedContentScheduler:
 
         self.is_running = True
         self._run_scheduler()
+        self.pregenerator.start()
 
         logger.info("✅ Улучшенный планировщик запущен")
         return True
 
+    def stop_scheduler(self):
+        """Останавливает публикации в этом процессе (например, при потере лидерства)"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.scheduler_loop.cancel()
+        # Новый цикл будет работать в другом потоке, поэтому и куча нужна новая
+        self.timer = TimerScheduler(Config.SERVER_TZ)
+        self.pregenerator.stop()
+        logger.info("⏹️ Планировщик остановлен")
+
+    def _missing_methods(self, schedule):
+        return [event['method'] for day_schedule in schedule.values() for event in day_schedule.values()
+                if not hasattr(self.generator, event['method'])]
+
     def validate_generator_methods(self):
-        missing_methods = []
-        for day_schedule in self.kemerovo_schedule.values():
-            for event in day_schedule.values():
-                method_name = event['method']
-                if not hasattr(self.generator, method_name):
-                    missing_methods.append(method_name)
+        missing_methods = self._missing_methods(self.kemerovo_schedule)
 
         if missing_methods:
             logger.error(f"❌ Отсутствующие методы: {missing_methods}")
@@ -2505,6 +5093,50 @@ class EnhancedContentScheduler:
         logger.info("✅ Все методы генерации валидированы")
         return True
 
+    def validate_schedule(self, schedule):
+        """Проверяет новое расписание до применения: дни, время и методы генерации"""
+        for day, day_schedule in schedule.items():
+            if day not in range(7):
+                raise ValueError(f"неизвестный день недели {day}")
+            for kemerovo_time, event in day_schedule.items():
+                datetime.strptime(kemerovo_time, '%H:%M')
+                missing = [key for key in ('name', 'type', 'method') if key not in event]
+                if missing:
+                    raise ValueError(f"в слоте {day} {kemerovo_time} нет полей {missing}")
+        missing_methods = self._missing_methods(schedule)
+        if missing_methods:
+            raise ValueError(f"отсутствующие методы генерации {missing_methods}")
+
+    def apply_schedule(self, schedule):
+        """Применяет новое расписание: перерегистрирует только добавленные, удаленные и измененные слоты"""
+        with self.scheduler_lock:
+            old_slots = {(day, kemerovo_time): event
+                         for day, day_schedule in self.kemerovo_schedule.items()
+                         for kemerovo_time, event in day_schedule.items()}
+            new_slots = {(day, kemerovo_time): event
+                         for day, day_schedule in schedule.items()
+                         for kemerovo_time, event in day_schedule.items()}
+            removed = [slot for slot in old_slots if slot not in new_slots]
+            added = [slot for slot in new_slots if slot not in old_slots]
+            changed = [slot for slot in new_slots if slot in old_slots and old_slots[slot] != new_slots[slot]]
+
+            old_server_slots = self._server_slots()
+            self.kemerovo_schedule = schedule
+            self.timeline = WeeklyTimeline(schedule)
+            self.server_schedule = self._convert_schedule_to_server()
+            new_server_slots = self._server_slots()
+
+            if self.is_running:
+                # Задания с тем же ключом заменяются, удаленные снимаются; остальные не трогаем
+                for slot in removed:
+                    self.timer.remove_job("{}_{}".format(*old_server_slots[slot]))
+                for slot in added + changed:
+                    server_day, server_time = new_server_slots[slot]
+                    self._schedule_event(server_day, server_time, self.server_schedule[server_day][server_time])
+
+        logger.info(f"🔁 Расписание обновлено: добавлено {len(added)}, удалено {len(removed)}, изменено {len(changed)}")
+        return {"added": len(added), "removed": len(removed), "changed": len(changed)}
+
     def _schedule_event(self, day, server_time, event):
         def job():
             job_key = f"{day}_{server_time}_{event['method']}"
@@ -2529,19 +5161,30 @@ class EnhancedContentScheduler:
 
                 method_name = event['method']
                 if hasattr(self.generator, method_name):
-                    method = getattr(self.generator, method_name)
-                    content = method()
+                    # Сначала берем заранее подготовленный пост, при промахе генерируем сейчас
+                    slot_key = ContentPregenerator.make_slot_key(
+                        current_times['kemerovo_date'], event['kemerovo_time'], method_name
+                    )
+                    content = self.pregenerator.take(slot_key)
+                    if content:
+                        logger.info(f"⚡ Используем заранее подготовленный пост: {event['name']}")
+                    else:
+                        logger.info(f"🔄 Готового поста нет в очереди, генерируем: {event['name']}")
+                        content = getattr(self.generator, method_name)()
 
                     if content:
-                        content_with_time = f"{content}\n\n⏰ Опубликовано: {current_times['kemerovo_time']}"
+                        content_with_time = telegram_html.append(content, f"\n\n⏰ Опубликовано: {current_times['kemerovo_time']}")
 
-                        success = self.telegram.send_with_fallback(
-                            content_with_time, 
+                        results = self.telegram.publish(
+                            content_with_time,
                             event['name'],
-                            max_retries=3
+                            max_retries=3,
+                            slot_key=slot_key,
+                            priority=TelegramSendQueue.PRIORITY_HIGH
                         )
 
-                        if success:
+                        if any(results.values()):
+                            self.generator.record_published(content)
                             logger.info(f"✅ Успешная публикация: {event['name']}")
                         else:
                             logger.error(f"❌ Ошибка публикации: {event['name']}")
@@ -2560,199 +5203,89 @@ class EnhancedContentScheduler:
                 with self.scheduler_lock:
                     self.running_jobs.discard(job_key)
 
-        job_func = getattr(schedule.every(), self._get_day_name(day))
-        job_func.at(server_time).do(job)
+        # Публикация уходит в пул рантайма, чтобы не задерживать остальные задания
+        self.timer.add_job(f"{day}_{server_time}", event['name'], day, server_time, lambda: self.runtime.submit(job))
 
-        logger.info(f"📌 Запланировано: {self._get_day_name(day).capitalize()} {server_time} - {event['name']}")
+        logger.info(f"📌 Запланировано: {self._get_day_name(day).capitalize()} {server_time} UTC "
+                    f"({event['kemerovo_time']} Кемерово) - {event['name']}")
 
     def _get_day_name(self, day_num):
         days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
         return days[day_num]
 
     def _run_scheduler(self):
-        def run():
-            while self.is_running:
-                try:
-                    schedule.run_pending()
-                    time.sleep(60)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле планировщика: {e}")
-                    time.sleep(60)
+        self.scheduler_loop = self.runtime.run_loop('scheduler', self.timer.run_due, retry_delay=60, blocking=False)
+        self.timer.waker = self.scheduler_loop.wake
+        logger.info(f"✅ Планировщик запущен (рантайм: {self.runtime.name})")
 
-        scheduler_thread = Thread(target=run, daemon=True)
-        scheduler_thread.start()
-        logger.info("✅ Планировщик запущен в отдельном потоке")
+    def get_upcoming_events(self, count, horizon):
+        """Ближайшие события расписания: список (время Кемерово, событие) в пределах окна"""
+        now = datetime.now(Config.SERVER_TZ)
+        return [(slot.at.astimezone(Config.KEMEROVO_TZ), slot.event)
+                for slot in self.timeline.upcoming(now + horizon, count, now=now)]
 
     def get_next_event(self):
-        try:
-            current_times = TimeManager.get_current_times()
-            current_kemerovo_time = current_times['kemerovo_time'][:5]
-
-            current_weekday = TimeManager.get_kemerovo_weekday()
-            today_schedule = self.kemerovo_schedule.get(current_weekday, {})
-
-            for time_str, event in sorted(today_schedule.items()):
-                if time_str > current_kemerovo_time:
-                    return time_str, event
-
-            tomorrow = (current_weekday + 1) % 7
-            tomorrow_schedule = self.kemerovo_schedule.get(tomorrow, {})
-            if tomorrow_schedule:
-                first_time = min(tomorrow_schedule.keys())
-                return first_time, tomorrow_schedule[first_time]
-
-            return "08:30", {"name": "Следующий пост", "type": "general"}
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения следующего события: {e}")
-            return "08:30", {"name": "Следующий пост", "type": "general"}
-
-# ========== FLASK МАРШРУТЫ ==========
-
-@app.route('/')
-def smart_dashboard():
-    try:
-        current_times = TimeManager.get_current_times()
-        current_weekday = TimeManager.get_kemerovo_weekday()
-        monitor_status = service_monitor.get_status()
-
-        member_count = telegram_manager.get_member_count()
-        next_time, next_event = content_scheduler.get_next_event()
-
-        total_posts = 42
-        posts_sent = monitor_status['sent_messages']
-        posts_remaining = total_posts - posts_sent
-
-        cache_info = gpt_generator.get_cache_info()
-
-        weekly_stats = {
-            'posts_sent': posts_sent,
-            'posts_remaining': posts_remaining,
-            'total_posts': total_posts,
-            'completion_percentage': int((posts_sent / total_posts) * 100) if total_posts > 0 else 0
-        }
-
-        today_schedule = content_scheduler.kemerovo_schedule.get(current_weekday, {})
-
-        html = f"""
-        <!DOCTYPE html>
-        <html lang="ru">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Умный дашборд @ppsupershef</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }}
-                .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-                .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-bottom: 20px; }}
-                .stats-grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 15px; margin: 20px 0; }}
-                .stat-card {{ background: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center; border-left: 4px solid #667eea; }}
-                .stat-number {{ font-size: 24px; font-weight: bold; color: #333; }}
-                .stat-label {{ font-size: 14px; color: #666; margin-top: 5px; }}
-                .schedule-item {{ display: flex; align-items: center; padding: 12px; margin: 8px 0; background: #f8f9fa; border-radius: 8px; border-left: 4px solid #28a745; }}
-                .schedule-time {{ font-weight: bold; color: #333; min-width: 60px; }}
-                .schedule-text {{ flex: 1; margin-left: 15px; }}
-                .btn {{ background: #667eea; color: white; border: none; padding: 10px 15px; border-radius: 5px; cursor: pointer; margin: 5px; }}
-                .btn:hover {{ background: #5a6fd8; }}
-                .btn-secondary {{ background: #6c757d; color: white; }}
-                .btn-secondary:hover {{ background: #5a6268; }}
-                .btn-success {{ background: #28a745; color: white; }}
-                .btn-success:hover {{ background: #218838; }}
-                .btn-warning {{ background: #ffc107; color: black; }}
-                .btn-warning:hover {{ background: #e0a800; }}
-                .progress {{ background: #e9ecef; border-radius: 10px; height: 20px; margin: 10px 0; }}
-                .progress-bar {{ background: #28a745; height: 100%; border-radius: 10px; text-align: center; color: white; font-size: 12px; line-height: 20px; }}
-                .modal {{ display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.5); }}
-                .modal-content {{ background-color: white; margin: 5% auto; padding: 20px; border-radius: 10px; width: 80%; max-width: 800px; max-height: 80vh; overflow-y: auto; }}
-                .close {{ color: #aaa; float: right; font-size: 28px; font-weight: bold; cursor: pointer; }}
-                .close:hover {{ color: black; }}
-                .form-group {{ margin: 15px 0; }}
-                .form-label {{ display: block; margin-bottom: 5px; font-weight: bold; }}
-                .form-textarea {{ width: 100%; height: 200px; padding: 10px; border: 1px solid #ddd; border-radius: 5px; resize: vertical; }}
-                .preview-area {{ background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 10px 0; white-space: pre-wrap; font-family: Arial; }}
-                .cache-stats {{ background: #e8f5e8; padding: 15px; border-radius: 8px; margin: 15px 0; }}
-                .diversity-stats {{ background: #e3f2fd; padding: 15px; border-radius: 8px; margin: 15px 0; }}
-                .error-logs {{ background: #fff3cd; padding: 15px; border-radius: 8px; margin: 15px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🎪 Умный дашборд @ppsupershef</h1>
-                    <p>Клуб Осознанного Питания - 42 поста в неделю с научным подходом и системой разнообразия</p>
-                    <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 15px;">
-                        <div>🟢 СИСТЕМА РАЗНООБРАЗИЯ АКТИВНА</div>
-                        <div>⏰ Кемерово: {current_times['kemerovo_time']}</div>
-                        <div>📅 {current_times['kemerovo_weekday_name']}</div>
-                    </div>
-                </div>
-
-                <div class="stats-grid">
-                    <div class="stat-card">
-                        <div class="stat-number">{weekly_stats['posts_sent']}/{weekly_stats['total_posts']}</div>
-                        <div class="stat-label">📊 Постов отправлено</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{weekly_stats['completion_percentage']}%</div>
-                        <div class="stat-label">🎯 Выполнение плана</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{member_count}</div>
-                        <div class="stat-label">👥 Подписчики (реальные)</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{enhanced_keep_alive.ping_count}</div>
-                        <div class="stat-label">🔄 Keep-alive пинги</div>
-                    </div>
-                </div>
+        """Ближайшее событие (время Кемерово, событие): бинарный поиск по недельной ленте"""
+        try:
+            slot = self.timeline.next_event()
+            if slot:
+                return slot.kemerovo_time, slot.event
 
-                <div class="diversity-stats">
-                    <h3>🎯 Статистика системы разнообразия</h3>
-                    <div class="stats-grid">
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['unique_ingredients_used']}</div>
-                            <div class="stat-label">🥕 Уникальных ингредиентов</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['cooking_methods_used']}</div>
-                            <div class="stat-label">🍳 Методов приготовления</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info.get('dessert_combinations', 0)}</div>
-                            <div class="stat-label">🍰 Комбинаций десертов</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['regeneration_attempts']}</div>
-                            <div class="stat-label">🔄 Попыток регенерации</div>
-                        </div>
-                    </div>
-                    <p><small>💡 Система автоматически предотвращает повторение рецептов и ингредиентов</small></p>
-                </div>
+            return "08:30", {"name": "Следующий пост", "type": "general"}
 
-                <div class="cache-stats">
-                    <h3>💾 Статистика кэширования (Render-compatible)</h3>
-                    <div class="stats-grid">
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['total_entries']}</div>
-                            <div class="stat-label">📦 Записей в кэше</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['cache_hits']}</div>
-                            <div class="stat-label">🎯 Попадания в кэш</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['cache_misses']}</div>
-                            <div class="stat-label">🔄 Промахи кэша</div>
-                        </div>
-                        <div class="stat-card">
-                            <div class="stat-number">{cache_info['total_requests']}</div>
-                            <div class="stat-label">📊 Всего запросов</div>
-                        </div>
-                    </div>
-                    <p><small>💡 Кэш работает в оперативной памяти (Render-compatible). TTL: 7 дней</small></p>
-                </div>
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения следующего события: {e}")
+            return "08:30", {"name": "Следующий пост", "type": "general"}
+
+# ========== КЭШ РЕНДЕРИНГА ДАШБОРДА ==========
+
+# Неизменные части страницы собираются один раз при импорте
+DASHBOARD_HEAD = """
+        <!DOCTYPE html>
+        <html lang="ru">
+        <head>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <title>Умный дашборд @ppsupershef</title>
+            <style>
+                body { font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }
+                .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-bottom: 20px; }
+                .stats-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 15px; margin: 20px 0; }
+                .stat-card { background: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center; border-left: 4px solid #667eea; }
+                .stat-number { font-size: 24px; font-weight: bold; color: #333; }
+                .stat-label { font-size: 14px; color: #666; margin-top: 5px; }
+                .schedule-item { display: flex; align-items: center; padding: 12px; margin: 8px 0; background: #f8f9fa; border-radius: 8px; border-left: 4px solid #28a745; }
+                .schedule-time { font-weight: bold; color: #333; min-width: 60px; }
+                .schedule-text { flex: 1; margin-left: 15px; }
+                .btn { background: #667eea; color: white; border: none; padding: 10px 15px; border-radius: 5px; cursor: pointer; margin: 5px; }
+                .btn:hover { background: #5a6fd8; }
+                .btn-secondary { background: #6c757d; color: white; }
+                .btn-secondary:hover { background: #5a6268; }
+                .btn-success { background: #28a745; color: white; }
+                .btn-success:hover { background: #218838; }
+                .btn-warning { background: #ffc107; color: black; }
+                .btn-warning:hover { background: #e0a800; }
+                .progress { background: #e9ecef; border-radius: 10px; height: 20px; margin: 10px 0; }
+                .progress-bar { background: #28a745; height: 100%; border-radius: 10px; text-align: center; color: white; font-size: 12px; line-height: 20px; }
+                .modal { display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.5); }
+                .modal-content { background-color: white; margin: 5% auto; padding: 20px; border-radius: 10px; width: 80%; max-width: 800px; max-height: 80vh; overflow-y: auto; }
+                .close { color: #aaa; float: right; font-size: 28px; font-weight: bold; cursor: pointer; }
+                .close:hover { color: black; }
+                .form-group { margin: 15px 0; }
+                .form-label { display: block; margin-bottom: 5px; font-weight: bold; }
+                .form-textarea { width: 100%; height: 200px; padding: 10px; border: 1px solid #ddd; border-radius: 5px; resize: vertical; }
+                .preview-area { background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 10px 0; white-space: pre-wrap; font-family: Arial; }
+                .cache-stats { background: #e8f5e8; padding: 15px; border-radius: 8px; margin: 15px 0; }
+                .diversity-stats { background: #e3f2fd; padding: 15px; border-radius: 8px; margin: 15px 0; }
+                .error-logs { background: #fff3cd; padding: 15px; border-radius: 8px; margin: 15px 0; }
+            </style>
+        </head>
+        <body>
+            <div class="container">
+"""
 
-                <div class="error-logs">
+DASHBOARD_ERROR_LOGS = """                <div class="error-logs">
                     <h3>⚠️ Мониторинг ошибок Telegram API</h3>
                     <div style="display: flex; gap: 10px; margin-bottom: 10px;">
                         <button class="btn" onclick="checkTelegramAPI()">🔍 Проверить Telegram API</button>
@@ -2761,24 +5294,14 @@ def smart_dashboard():
                     <p><small>💡 Отслеживайте ошибки отправки сообщений и проблемы с Telegram API</small></p>
                 </div>
 
-                <div style="background: #e8f5e8; padding: 15px; border-radius: 8px; margin: 15px 0;">
-                    <h3>🎯 Прогресс недели</h3>
-                    <div class="progress">
-                        <div class="progress-bar" style="width: {weekly_stats['completion_percentage']}%">{weekly_stats['completion_percentage']}%</div>
-                    </div>
-                    <p>Осталось отправить: {weekly_stats['posts_remaining']} постов</p>
-                </div>
+"""
 
-                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px;">
+DASHBOARD_SCHEDULE_OPEN = """                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px;">
                     <div>
                         <h3>⏰ Расписание сегодня</h3>
-                        {"".join([f'''
-                        <div class="schedule-item">
-                            <div class="schedule-time">{time}</div>
-                            <div class="schedule-text">{event["name"]}</div>
-                        </div>
-                        ''' for time, event in sorted(today_schedule.items())])}
-                    </div>
+"""
+
+DASHBOARD_CONTROLS = """                    </div>
 
                     <div>
                         <h3>🔧 Управление системой разнообразия</h3>
@@ -2793,8 +5316,9 @@ def smart_dashboard():
 
                         <div style="margin-top: 15px; padding: 15px; background: #fff3cd; border-radius: 8px;">
                             <h4>🎯 Следующий пост</h4>
-                            <p><strong>{next_time}</strong> - {next_event['name']}</p>
-                        </div>
+"""
+
+DASHBOARD_TAIL = """                        </div>
                     </div>
                 </div>
             </div>
@@ -2821,155 +5345,572 @@ def smart_dashboard():
             </div>
 
             <script>
-                function testSend() {{
-                    fetch('/test-send').then(r => r.json()).then(data => {{
+                function testSend() {
+                    fetch('/test-send').then(r => r.json()).then(data => {
                         alert(data.status === 'success' ? '✅ Тест успешен!' : '❌ Ошибка');
-                    }});
-                }}
+                    });
+                }
 
-                function testGPT() {{
-                    fetch('/test-gpt').then(r => r.json()).then(data => {{
+                function testGPT() {
+                    fetch('/test-gpt').then(r => r.json()).then(data => {
                         alert(data.status === 'success' ? '✅ Генерация работает!' : '❌ Ошибка');
-                    }});
-                }}
+                    });
+                }
 
-                function testDessert() {{
-                    fetch('/test-dessert').then(r => r.json()).then(data => {{
+                function testDessert() {
+                    fetch('/test-dessert').then(r => r.json()).then(data => {
                         alert(data.status === 'success' ? '✅ Десерт сгенерирован!' : '❌ Ошибка');
-                    }});
-                }}
+                    });
+                }
 
-                function forceKeepAlive() {{
-                    fetch('/force-keep-alive').then(r => r.json()).then(data => {{
+                function forceKeepAlive() {
+                    fetch('/force-keep-alive').then(r => r.json()).then(data => {
                         alert('Keep-alive: ' + data.ping_count + ' пингов');
-                    }});
-                }}
+                    });
+                }
 
-                function sendActiveSnacks() {{
-                    if (confirm('Отправить пост про перекусы для активного отдыха?')) {{
-                        fetch('/send-active-snacks').then(r => r.json()).then(data => {{
+                function sendActiveSnacks() {
+                    if (confirm('Отправить пост про перекусы для активного отдыха?')) {
+                        fetch('/send-active-snacks').then(r => r.json()).then(data => {
                             alert(data.status === 'success' ? '✅ Перекусы отправлены!' : '❌ Ошибка отправки');
-                        }});
-                    }}
-                }}
-
-                function clearCache() {{
-                    if (confirm('Очистить весь кэш и историю разнообразия? Это вызовет повторную генерацию всех рецептов.')) {{
-                        fetch('/clear-cache').then(r => r.json()).then(data => {{
-                            if (data.status === 'success') {{
+                        });
+                    }
+                }
+
+                function clearCache() {
+                    if (confirm('Очистить весь кэш и историю разнообразия? Это вызовет повторную генерацию всех рецептов.')) {
+                        fetch('/clear-cache').then(r => r.json()).then(data => {
+                            if (data.status === 'success') {
                                 alert('✅ Кэш очищен! Удалено ' + data.cleared_count + ' записей');
-                                location.reload();
-                            }} else {{
+                                fetch('/api/status').then(r => r.json()).then(applyStatus);
+                            } else {
                                 alert('❌ Ошибка очистки кэша');
-                            }}
-                        }});
-                    }}
-                }}
-
-                function updateMemberCount() {{
-                    fetch('/update-member-count').then(r => r.json()).then(data => {{
-                        if (data.status === 'success') {{
+                            }
+                        });
+                    }
+                }
+
+                function updateMemberCount() {
+                    fetch('/update-member-count').then(r => r.json()).then(data => {
+                        if (data.status === 'success') {
                             alert('✅ Статистика обновлена! Подписчиков: ' + data.member_count);
-                            location.reload();
-                        }} else {{
+                            setText('member-count', data.member_count);
+                        } else {
                             alert('❌ Ошибка обновления статистики');
-                        }}
-                    }});
-                }}
+                        }
+                    });
+                }
 
-                function openManualPost() {{
+                function openManualPost() {
                     document.getElementById('manualPostModal').style.display = 'block';
-                }}
+                }
 
-                function closeManualPost() {{
+                function closeManualPost() {
                     document.getElementById('manualPostModal').style.display = 'none';
                     document.getElementById('previewArea').style.display = 'none';
-                }}
+                }
 
-                function previewPost() {{
+                function previewPost() {
                     const content = document.getElementById('postContent').value;
-                    if (content.trim() === '') {{
+                    if (content.trim() === '') {
                         alert('Введите текст поста');
                         return;
-                    }}
+                    }
                     document.getElementById('previewContent').innerHTML = content;
                     document.getElementById('previewArea').style.display = 'block';
-                }}
+                }
 
-                function sendManualPost() {{
+                function sendManualPost() {
                     const content = document.getElementById('postContent').value;
-                    if (content.trim() === '') {{
+                    if (content.trim() === '') {
                         alert('Введите текст поста');
                         return;
-                    }}
+                    }
 
-                    if (confirm('Отправить этот пост в канал?')) {{
-                        fetch('/send-manual-post', {{
+                    if (confirm('Отправить этот пост в канал?')) {
+                        fetch('/send-manual-post', {
                             method: 'POST',
-                            headers: {{ 'Content-Type': 'application/json' }},
-                            body: JSON.stringify({{ content: content }})
-                        }})
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify({ content: content })
+                        })
                         .then(r => r.json())
-                        .then(data => {{
-                            if (data.status === 'success') {{
+                        .then(data => {
+                            if (data.status === 'success') {
                                 alert('✅ Пост успешно отправлен!');
                                 closeManualPost();
                                 document.getElementById('postContent').value = '';
-                            }} else {{
+                            } else {
                                 alert('❌ Ошибка отправки: ' + data.message);
-                            }}
-                        }});
-                    }}
-                }}
-
-                function checkTelegramAPI() {{
-                    fetch('/test-telegram-api').then(r => r.json()).then(data => {{
-                        if (data.status === 'success') {{
+                            }
+                        });
+                    }
+                }
+
+                function checkTelegramAPI() {
+                    fetch('/test-telegram-api').then(r => r.json()).then(data => {
+                        if (data.status === 'success') {
                             alert('✅ Telegram API работает нормально\\nПодписчиков: ' + data.member_count);
-                        }} else {{
+                        } else {
                             alert('❌ Проблемы с Telegram API: ' + (data.message || 'Неизвестная ошибка'));
-                        }}
-                    }});
-                }}
+                        }
+                    });
+                }
 
-                function viewErrorLogs() {{
-                    fetch('/error-logs').then(r => r.json()).then(data => {{
-                        if (data.status === 'success') {{
+                function viewErrorLogs() {
+                    fetch('/error-logs').then(r => r.json()).then(data => {
+                        if (data.status === 'success') {
                             let message = '📋 Логи ошибок:\\n';
-                            if (data.error_logs && data.error_logs.length > 0) {{
-                                data.error_logs.slice(0, 10).forEach(log => {{
+                            if (data.error_logs && data.error_logs.length > 0) {
+                                data.error_logs.slice(0, 10).forEach(log => {
                                     message += '\\n• ' + log;
-                                }});
-                            }} else {{
+                                });
+                            } else {
                                 message += '\\n✅ Ошибок нет!';
-                            }}
+                            }
                             alert(message);
-                        }} else {{
+                        } else {
                             alert('❌ Ошибка получения логов');
-                        }}
-                    }});
-                }}
+                        }
+                    });
+                }
 
                 // Закрытие модального окна при клике вне его
-                window.onclick = function(event) {{
+                window.onclick = function(event) {
                     const modal = document.getElementById('manualPostModal');
-                    if (event.target === modal) {{
+                    if (event.target === modal) {
                         closeManualPost();
-                    }}
-                }}
+                    }
+                }
+
+                // Живые счетчики: сервер присылает только изменившиеся значения
+                const TOTAL_POSTS = 42;
+                const statusFields = {
+                    kemerovo_time: value => setText('kemerovo-time', value),
+                    posts_sent: value => setText('posts-sent', value + '/' + TOTAL_POSTS),
+                    posts_remaining: value => setText('posts-remaining', value),
+                    completion_percentage: value => {
+                        setText('completion-percentage', value + '%');
+                        setText('progress-bar', value + '%');
+                        document.getElementById('progress-bar').style.width = value + '%';
+                    },
+                    member_count: value => setText('member-count', value),
+                    ping_count: value => setText('ping-count', value),
+                    total_entries: value => setText('total-entries', value),
+                    cache_hits: value => setText('cache-hits', value),
+                    cache_misses: value => setText('cache-misses', value),
+                    total_requests: value => setText('total-requests', value),
+                    next_event_time: value => setText('next-event-time', value),
+                    next_event_name: value => setText('next-event-name', value)
+                };
+
+                function setText(id, value) {
+                    const element = document.getElementById(id);
+                    if (element) {
+                        element.textContent = value;
+                    }
+                }
 
-                // Автообновление каждые 30 секунд
-                setInterval(() => location.reload(), 30000);
+                function applyStatus(status) {
+                    Object.keys(status).forEach(key => {
+                        if (statusFields[key]) {
+                            statusFields[key](status[key]);
+                        }
+                    });
+                }
+
+                if (window.EventSource) {
+                    const events = new EventSource('/events');
+                    events.onmessage = event => applyStatus(JSON.parse(event.data));
+                } else {
+                    setInterval(() => fetch('/api/status').then(r => r.json()).then(applyStatus), 30000);
+                }
             </script>
         </body>
         </html>
         """
-        return html
+
+class DashboardRenderer:
+    """Дашборд из секций: каждая перерисовывается только при смене своего ключа.
+
+    Ключ секции - кортеж значений, которые она показывает. Счетчики кэша
+    пересчитываются не чаще раза в DASHBOARD_STATS_TTL_SECONDS, а число
+    подписчиков берется из памяти без сетевого запроса.
+    """
+
+    def __init__(self, telegram=None, generator=None, scheduler=None, keep_alive=None, monitor=None):
+        self.telegram = telegram
+        self.generator = generator
+        self.scheduler = scheduler
+        self.keep_alive = keep_alive
+        self.monitor = monitor or service_monitor
+        self.stats_ttl = Config.DASHBOARD_STATS_TTL_SECONDS
+        self.sections = {}
+        self.page = (None, None)
+        self.cache_info = None
+        self.cache_info_time = 0
+        self.render_lock = Lock()
+        self.renders = 0
+        self.page_hits = 0
+        if scheduler is not None:
+            # Ключ секции расписания - только день недели, поэтому перезагрузку сообщаем явно
+            scheduler.library.subscribe('schedule', self.on_schedule_reload)
+
+    def invalidate(self, section=None):
+        """Сбрасывает одну секцию или весь кэш (например, после очистки кэша GPT)"""
+        with self.render_lock:
+            if section is None:
+                self.sections.clear()
+            else:
+                self.sections.pop(section, None)
+            self.page = (None, None)
+            if section in (None, 'cache'):
+                self.cache_info_time = 0
+
+    def on_schedule_reload(self, _schedule):
+        self.invalidate('schedule')
+
+    def _get_cache_info(self):
+        now = time.time()
+        if self.cache_info is None or now - self.cache_info_time >= self.stats_ttl:
+            self.cache_info = self.generator.get_cache_info()
+            self.cache_info_time = now
+        return self.cache_info
+
+    def _section(self, name, key, render):
+        cached = self.sections.get(name)
+        if cached and cached[0] == key:
+            return key, cached[1]
+        html = render()
+        self.sections[name] = (key, html)
+        self.renders += 1
+        return key, html
+
+    def render(self):
+        current_times = TimeManager.get_current_times()
+        posts_sent = self.monitor.get_status()['sent_messages']
+        weekly_stats = self._weekly_stats(posts_sent)
+        member_count = self.telegram.get_member_count()
+        ping_count = self.keep_alive.ping_count
+        next_time, next_event = self.scheduler.get_next_event()
+
+        with self.render_lock:
+            cache_info = self._get_cache_info()
+            # Часы в шапке с точностью до минуты: секунды обновляет поток /events, а страница не пересобирается каждую секунду
+            clock = current_times['kemerovo_time'][:5]
+            parts = [
+                self._section('header', (clock, current_times['kemerovo_weekday_name']),
+                              lambda: self._render_header(current_times, clock)),
+                self._section('stats', (posts_sent, member_count, ping_count),
+                              lambda: self._render_stats(weekly_stats, member_count, ping_count)),
+                self._section('cache', tuple(sorted(cache_info.items())),
+                              lambda: self._render_cache(cache_info)),
+                self._section('progress', (posts_sent,),
+                              lambda: self._render_progress(weekly_stats)),
+                self._section('schedule', (current_times['kemerovo_weekday'],),
+                              lambda: self._render_schedule(current_times['kemerovo_weekday'])),
+                self._section('next_event', (next_time, next_event['name']),
+                              lambda: self._render_next_event(next_time, next_event))
+            ]
+            page_key = tuple(key for key, _ in parts)
+            if self.page[0] == page_key:
+                self.page_hits += 1
+                return self.page[1]
+
+            header, stats, cache, progress, schedule_html, next_event_html = (html for _, html in parts)
+            page = (DASHBOARD_HEAD + header + stats + cache + DASHBOARD_ERROR_LOGS + progress
+                    + DASHBOARD_SCHEDULE_OPEN + schedule_html + DASHBOARD_CONTROLS + next_event_html + DASHBOARD_TAIL)
+            self.page = (page_key, page)
+            return page
+
+    def _render_header(self, current_times, clock):
+        return f"""                <div class="header">
+                    <h1>🎪 Умный дашборд @ppsupershef</h1>
+                    <p>Клуб Осознанного Питания - 42 поста в неделю с научным подходом и системой разнообразия</p>
+                    <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 15px;">
+                        <div>🟢 СИСТЕМА РАЗНООБРАЗИЯ АКТИВНА</div>
+                        <div>⏰ Кемерово: <span id="kemerovo-time">{clock}</span></div>
+                        <div>📅 {current_times['kemerovo_weekday_name']}</div>
+                    </div>
+                </div>
+
+"""
+
+    def _render_stats(self, weekly_stats, member_count, ping_count):
+        return f"""                <div class="stats-grid">
+                    <div class="stat-card">
+                        <div class="stat-number" id="posts-sent">{weekly_stats['posts_sent']}/{weekly_stats['total_posts']}</div>
+                        <div class="stat-label">📊 Постов отправлено</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-number" id="completion-percentage">{weekly_stats['completion_percentage']}%</div>
+                        <div class="stat-label">🎯 Выполнение плана</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-number" id="member-count">{member_count}</div>
+                        <div class="stat-label">👥 Подписчики (реальные)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-number" id="ping-count">{ping_count}</div>
+                        <div class="stat-label">🔄 Keep-alive пинги</div>
+                    </div>
+                </div>
+
+"""
+
+    def _render_cache(self, cache_info):
+        return f"""                <div class="diversity-stats">
+                    <h3>🎯 Статистика системы разнообразия</h3>
+                    <div class="stats-grid">
+                        <div class="stat-card">
+                            <div class="stat-number">{cache_info['unique_ingredients_used']}</div>
+                            <div class="stat-label">🥕 Уникальных ингредиентов</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number">{cache_info['cooking_methods_used']}</div>
+                            <div class="stat-label">🍳 Методов приготовления</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number">{cache_info.get('dessert_combinations', 0)}</div>
+                            <div class="stat-label">🍰 Комбинаций десертов</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number">{cache_info['regeneration_attempts']}</div>
+                            <div class="stat-label">🔄 Попыток регенерации</div>
+                        </div>
+                    </div>
+                    <p><small>💡 Система автоматически предотвращает повторение рецептов и ингредиентов</small></p>
+                </div>
+
+                <div class="cache-stats">
+                    <h3>💾 Статистика кэширования (Render-compatible)</h3>
+                    <div class="stats-grid">
+                        <div class="stat-card">
+                            <div class="stat-number" id="total-entries">{cache_info['total_entries']}</div>
+                            <div class="stat-label">📦 Записей в кэше</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number" id="cache-hits">{cache_info['cache_hits']}</div>
+                            <div class="stat-label">🎯 Попадания в кэш</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number" id="cache-misses">{cache_info['cache_misses']}</div>
+                            <div class="stat-label">🔄 Промахи кэша</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-number" id="total-requests">{cache_info['total_requests']}</div>
+                            <div class="stat-label">📊 Всего запросов</div>
+                        </div>
+                    </div>
+                    <p><small>💡 Хранилище кэша: {cache_info['storage_type']} (Render-compatible). TTL: 7 дней</small></p>
+                </div>
+
+"""
+
+    def _render_progress(self, weekly_stats):
+        return f"""                <div style="background: #e8f5e8; padding: 15px; border-radius: 8px; margin: 15px 0;">
+                    <h3>🎯 Прогресс недели</h3>
+                    <div class="progress">
+                        <div class="progress-bar" id="progress-bar" style="width: {weekly_stats['completion_percentage']}%">{weekly_stats['completion_percentage']}%</div>
+                    </div>
+                    <p>Осталось отправить: <span id="posts-remaining">{weekly_stats['posts_remaining']}</span> постов</p>
+                </div>
+
+"""
+
+    def _render_schedule(self, weekday):
+        today_schedule = self.scheduler.kemerovo_schedule.get(weekday, {})
+        return f"""                        {"".join([f'''
+                        <div class="schedule-item">
+                            <div class="schedule-time">{time}</div>
+                            <div class="schedule-text">{event["name"]}</div>
+                        </div>
+                        ''' for time, event in sorted(today_schedule.items())])}
+"""
+
+    def _render_next_event(self, next_time, next_event):
+        return f"""                            <p><strong id="next-event-time">{next_time}</strong> - <span id="next-event-name">{next_event['name']}</span></p>
+"""
+
+    def get_status(self):
+        """Компактный снимок счетчиков дашборда для /api/status и /events"""
+        current_times = TimeManager.get_current_times()
+        monitor_status = self.monitor.get_status()
+        weekly_stats = self._weekly_stats(monitor_status['sent_messages'])
+        next_time, next_event = self.scheduler.get_next_event()
+        with self.render_lock:
+            cache_info = self._get_cache_info()
+        return {
+            "kemerovo_time": current_times['kemerovo_time'],
+            "posts_sent": weekly_stats['posts_sent'],
+            "posts_remaining": weekly_stats['posts_remaining'],
+            "completion_percentage": weekly_stats['completion_percentage'],
+            "missed_messages": monitor_status['missed_messages'],
+            "member_count": self.telegram.get_member_count(),
+            "ping_count": self.keep_alive.ping_count,
+            "total_entries": cache_info['total_entries'],
+            "cache_hits": cache_info['cache_hits'],
+            "cache_misses": cache_info['cache_misses'],
+            "total_requests": cache_info['total_requests'],
+            "cache_hit_rate": cache_info['hit_rate'],
+            "next_event_time": next_time,
+            "next_event_name": next_event['name']
+        }
+
+    @staticmethod
+    def _weekly_stats(posts_sent):
+        total_posts = 42
+        return {
+            'posts_sent': posts_sent,
+            'posts_remaining': total_posts - posts_sent,
+            'total_posts': total_posts,
+            'completion_percentage': int((posts_sent / total_posts) * 100) if total_posts > 0 else 0
+        }
+
+    def get_stats(self):
+        return {
+            "sections_cached": len(self.sections),
+            "section_renders": self.renders,
+            "page_cache_hits": self.page_hits
+        }
+
+class DashboardEventStream:
+    """Один расчет статуса на процесс: всем SSE-клиентам рассылаются только изменения"""
+
+    HEARTBEAT_SECONDS = 15
+    RECONNECT_MILLISECONDS = 1000
+
+    def __init__(self, renderer, runtime=None):
+        self.renderer = renderer
+        self.runtime = runtime or background_runtime
+        self.interval = Config.DASHBOARD_PUSH_INTERVAL_SECONDS
+        self.lifetime = Config.DASHBOARD_STREAM_SECONDS
+        self.subscribers = set()
+        self.stream_lock = Lock()
+        self.last_status = {}
+        self.loop = None
+        self.broadcasts = 0
+        self.resyncs = 0
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=1000)
+        with self.stream_lock:
+            self.subscribers.add(subscriber)
+            if self.loop is None:
+                self.loop = self.runtime.run_loop('dashboard-events', self._broadcast, initial_delay=self.interval)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.stream_lock:
+            self.subscribers.discard(subscriber)
+
+    def _broadcast(self):
+        with self.stream_lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return self.interval
+
+        status = self.renderer.get_status()
+        changes = {key: value for key, value in status.items() if self.last_status.get(key) != value}
+        self.last_status = status
+        if changes:
+            payload = json.dumps(changes, ensure_ascii=False)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(payload)
+                except queue.Full:
+                    self._resync(subscriber)
+            self.broadcasts += 1
+        return self.interval
+
+    def _resync(self, subscriber):
+        """Клиент отстал и потерял бы изменения: очередь сбрасывается, вместо нее - метка полного снимка"""
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait(None)
+        self.resyncs += 1
+
+    def stream(self):
+        """SSE для одного клиента: полный снимок, затем только изменения.
+        Поток живет не дольше lifetime, чтобы не упираться в таймаут воркера; браузер переподключится сам"""
+        subscriber = self.subscribe()
+        deadline = time.monotonic() + self.lifetime
+        try:
+            status = self.renderer.get_status()
+            if not self.last_status:
+                self.last_status = status
+            yield f"retry: {self.RECONNECT_MILLISECONDS}\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    payload = subscriber.get(timeout=min(self.HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if payload is None:
+                    payload = json.dumps(self.renderer.get_status(), ensure_ascii=False)
+                yield f"data: {payload}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_stats(self):
+        with self.stream_lock:
+            return {"subscribers": len(self.subscribers), "broadcasts": self.broadcasts, "resyncs": self.resyncs,
+                    "stream_lifetime_seconds": self.lifetime}
+
+# ========== FLASK МАРШРУТЫ ==========
+
+@app.before_request
+def track_request():
+    g.request_started = time.perf_counter()
+    service_monitor.increment_request()
+
+@app.after_request
+def observe_request(response):
+    if hasattr(g, 'request_started'):
+        http_request_seconds.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or 'unknown')
+    return response
+
+@app.route('/')
+def smart_dashboard():
+    try:
+        return dashboard_renderer.render()
 
     except Exception as e:
         logger.error(f"❌ Ошибка дашборда: {e}")
         return f"Ошибка загрузки дашборда: {str(e)}"
 
+@app.route('/api/status')
+def api_status():
+    """Компактный снимок счетчиков дашборда"""
+    try:
+        return jsonify(dashboard_renderer.get_status())
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/events')
+def dashboard_events():
+    """SSE поток изменений счетчиков дашборда"""
+    return Response(
+        dashboard_stream.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ping')
+def ping():
+    """Минимальный эндпоинт для внешнего keep-alive"""
+    return 'pong', 200, {'Content-Type': 'text/plain'}
+
 @app.route('/health')
 def health_check():
     return jsonify(service_monitor.get_status())
@@ -2977,14 +5918,14 @@ def health_check():
 @app.route('/test-send')
 def test_send():
     cache_info = gpt_generator.get_cache_info()
-    success = telegram_manager.send_message("🧪 <b>ТЕСТ СИСТЕМЫ РАЗНООБРАЗИЯ</b>\n\n✅ 42 поста в неделю\n🤖 Улучшенная генерация с ротацией\n🛡️ Система предотвращения повторов\n👥 Подписчики: " + str(telegram_manager.get_member_count()) + f"\n🎯 Уникальных ингредиентов: {cache_info['unique_ingredients_used']}")
+    success = telegram_manager.send_message("🧪 <b>ТЕСТ СИСТЕМЫ РАЗНООБРАЗИЯ</b>\n\n✅ 42 поста в неделю\n🤖 Улучшенная генерация с ротацией\n🛡️ Система предотвращения повторов\n👥 Подписчики: " + str(telegram_manager.get_member_count()) + f"\n🎯 Уникальных ингредиентов: {cache_info['unique_ingredients_used']}", priority=TelegramSendQueue.PRIORITY_LOW)
     return jsonify({"status": "success" if success else "error"})
 
 @app.route('/test-gpt')
 def test_gpt():
     try:
         test_content = content_generator.generate_monday_science()
-        success = telegram_manager.send_message(test_content)
+        success = telegram_manager.send_message(test_content, priority=TelegramSendQueue.PRIORITY_LOW)
         return jsonify({"status": "success" if success else "error"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
@@ -2993,7 +5934,7 @@ def test_gpt():
 def test_dessert():
     try:
         test_content = content_generator.generate_sunday_dessert()
-        success = telegram_manager.send_message(test_content)
+        success = telegram_manager.send_message(test_content, priority=TelegramSendQueue.PRIORITY_LOW)
         return jsonify({"status": "success" if success else "error"})
     except Exception as e:
         logger.error(f"❌ Ошибка теста десерта: {e}")
@@ -3017,14 +5958,25 @@ def send_active_snacks():
 @app.route('/update-member-count')
 def update_member_count():
     """Принудительное обновление количества подписчиков"""
-    count = telegram_manager.get_member_count()
+    count = telegram_manager.refresh_member_count()
     return jsonify({"status": "success", "member_count": count})
 
+@app.route('/member-count-history')
+def member_count_history():
+    """История количества подписчиков"""
+    history = telegram_manager.get_member_history()
+    return jsonify({
+        "status": "success",
+        "member_count": telegram_manager.get_member_count(),
+        "history": [{"time": recorded_at, "count": count} for recorded_at, count in history]
+    })
+
 @app.route('/clear-cache')
 def clear_cache():
     """Очистка кэша GPT и системы разнообразия"""
     try:
         cleared_count = gpt_generator.clear_cache()
+        dashboard_renderer.invalidate('cache')
         logger.info(f"🧹 Кэш и история разнообразия очищены вручную: удалено {cleared_count} записей")
         return jsonify({"status": "success", "cleared_count": cleared_count})
     except Exception as e:
@@ -3036,7 +5988,71 @@ def cache_info():
     """Информация о состоянии кэша и системы разнообразия"""
     try:
         cache_info = gpt_generator.get_cache_info()
-        return jsonify({"status": "success", "cache_info": cache_info})
+        return jsonify({
+            "status": "success",
+            "cache_info": cache_info,
+            "pregeneration": content_scheduler.pregenerator.get_stats(),
+            "sent_messages": telegram_manager.sent_store.get_stats(),
+            "cleanup": cache_janitor.get_stats()
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/http-info')
+def http_info():
+    """Статистика пулов HTTP соединений"""
+    try:
+        return jsonify({
+            "status": "success",
+            "http_clients": http_clients.get_stats(),
+            "telegram_send_queue": telegram_manager.send_queue.get_stats(),
+            "publish_chats": telegram_manager.publish_chats
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/scheduler-info')
+def scheduler_info():
+    """Расписание таймерного планировщика и опоздания запусков по заданиям"""
+    try:
+        return jsonify({
+            "status": "success",
+            "scheduler": content_scheduler.timer.get_stats(),
+            "timeline": content_scheduler.timeline.get_stats()
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/runtime-info')
+def runtime_info():
+    """Состояние фоновых циклов и их heartbeat"""
+    try:
+        return jsonify({
+            "status": "success",
+            "runtime": services.runtime.get_stats(),
+            "leader": services.leader_election.get_stats()
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/admin/reload-content', methods=['POST'])
+@require_auth
+@rate_limit
+def reload_content():
+    """Перечитывает файл библиотеки контента и перерегистрирует измененные слоты расписания"""
+    try:
+        force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+        result = content_library.reload(force=force)
+        return jsonify(result), 400 if result["status"] == "error" else 200
+    except Exception as e:
+        logger.error(f"❌ Ошибка перезагрузки библиотеки контента: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/content-info')
+def content_info():
+    """Версия и состояние библиотеки контента"""
+    try:
+        return jsonify({"status": "success", "library": content_library.get_stats()})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
@@ -3065,8 +6081,8 @@ def send_manual_post():
 def test_telegram_api():
     """Тест работы Telegram API"""
     try:
-        count = telegram_manager.get_member_count()
-        success = telegram_manager.send_message("✅ <b>ТЕСТ TELEGRAM API</b>\n\n🤖 Бот работает нормально\n📊 Подписчиков: " + str(count) + "\n⏰ Время: " + datetime.now().strftime("%H:%M:%S"))
+        count = telegram_manager.refresh_member_count()
+        success = telegram_manager.send_message("✅ <b>ТЕСТ TELEGRAM API</b>\n\n🤖 Бот работает нормально\n📊 Подписчиков: " + str(count) + "\n⏰ Время: " + datetime.now().strftime("%H:%M:%S"), priority=TelegramSendQueue.PRIORITY_LOW)
         return jsonify({"status": "success" if success else "error", "member_count": count})
     except Exception as e:
         logger.error(f"❌ Ошибка теста Telegram API: {e}")
@@ -3088,11 +6104,88 @@ def error_logs():
 
 # ========== ИНИЦИАЛИЗАЦИЯ И ЗАПУСК ==========
 
-security_manager = SecurityManager()
-telegram_manager = TelegramManager()
-gpt_generator = EnhancedYandexGPTGenerator()
-content_generator = EnhancedContentGenerator()
-content_scheduler = EnhancedContentScheduler()
+class ServiceContainer:
+    """Контейнер сервисов: по одному экземпляру каждого компонента на процесс"""
+
+    def __init__(self):
+        self._instances = {}
+        self.container_lock = RLock()
+
+    def _get(self, name, factory):
+        with self.container_lock:
+            if name not in self._instances:
+                self._instances[name] = factory()
+            return self._instances[name]
+
+    @property
+    def runtime(self):
+        return background_runtime
+
+    @property
+    def leader_election(self):
+        return self._get('leader_election', lambda: LeaderElection(runtime=self.runtime))
+
+    @property
+    def security_manager(self):
+        return self._get('security_manager', SecurityManager)
+
+    @property
+    def keep_alive(self):
+        return self._get('keep_alive', lambda: EnhancedKeepAlive(runtime=self.runtime))
+
+    @property
+    def telegram_manager(self):
+        return self._get('telegram_manager', lambda: TelegramManager(runtime=self.runtime))
+
+    @property
+    def near_duplicates(self):
+        return self._get('near_duplicates', create_near_duplicate_index)
+
+    @property
+    def gpt_generator(self):
+        return self._get('gpt_generator', lambda: EnhancedYandexGPTGenerator(
+            runtime=self.runtime,
+            near_duplicates=self.near_duplicates
+        ))
+
+    @property
+    def content_generator(self):
+        return self._get('content_generator', lambda: EnhancedContentGenerator(
+            gpt_generator=self.gpt_generator
+        ))
+
+    @property
+    def dashboard(self):
+        return self._get('dashboard', lambda: DashboardRenderer(
+            telegram=self.telegram_manager,
+            generator=self.gpt_generator,
+            scheduler=self.content_scheduler,
+            keep_alive=self.keep_alive
+        ))
+
+    @property
+    def dashboard_events(self):
+        return self._get('dashboard_events', lambda: DashboardEventStream(self.dashboard, runtime=self.runtime))
+
+    @property
+    def content_scheduler(self):
+        return self._get('content_scheduler', lambda: EnhancedContentScheduler(
+            telegram=self.telegram_manager,
+            generator=self.content_generator,
+            runtime=self.runtime
+        ))
+
+services = ServiceContainer()
+
+# Модульные имена для маршрутов и дашборда указывают на общие экземпляры
+security_manager = services.security_manager
+enhanced_keep_alive = services.keep_alive
+telegram_manager = services.telegram_manager
+gpt_generator = services.gpt_generator
+content_generator = services.content_generator
+content_scheduler = services.content_scheduler
+dashboard_renderer = services.dashboard
+dashboard_stream = services.dashboard_events
 
 # Обработчики сигналов
 def signal_handler(sig, frame):
@@ -3100,38 +6193,52 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 def on_exit():
+    services.leader_election.stop()
+    background_runtime.stop()
     logger.info("🔴 Бот остановлен")
 
 signal.signal(signal.SIGINT, signal_handler)
 atexit.register(on_exit)
 
-try:
-    # Запускаем системы
-    start_enhanced_keep_alive()
-    success = content_scheduler.start_scheduler()
-
-    if success:
-        logger.info("🚀 УЛУЧШЕННАЯ СИСТЕМА ЗАПУЩЕНА")
-        logger.info("🧠 Научные подходы: АКТИВНЫ (8:30 каждый день)")
-        logger.info("🎯 Система разнообразия: АКТИВНА")
-        logger.info("🛡️ Защита от сна: АКТИВНА")
-        logger.info("💾 Render-Compatible Cache: АКТИВЕН (7 дней TTL)")
-        logger.info("🍰 Десерты правильного питания: ДОБАВЛЕНЫ")
-        logger.info("🎒 Активные перекусы: ДОБАВЛЕНЫ")
-        logger.info("📊 Реальный счетчик подписчиков: АКТИВЕН")
-        
-        # Получаем реальное количество подписчиков при запуске
-        member_count = telegram_manager.get_member_count()
-        logger.info(f"👥 Реальное количество подписчиков: {member_count}")
-
-        # Получаем информацию о системе разнообразия
-        cache_info = gpt_generator.get_cache_info()
-        logger.info(f"💾 Инициализирована система разнообразия: {cache_info['unique_ingredients_used']} ингредиентов, {cache_info['cooking_methods_used']} методов")
-        logger.info(f"🍰 Десерты: {cache_info.get('dessert_combinations', 0)} уникальных комбинаций")
+keep_alive_loop = None
+startup_announced = False
 
-        # Тестовое сообщение о запуске улучшенной системы
-        current_times = TimeManager.get_current_times()
-        telegram_manager.send_with_fallback(f"""
+def start_leader_services():
+    """Запускается только в процессе-лидере: планировщик, keep-alive и сообщение о запуске.
+    Сообщение о запуске уходит один раз за жизнь процесса, а не при каждом переизбрании"""
+    global keep_alive_loop, startup_announced
+    try:
+        # Запускаем системы
+        keep_alive_loop = start_enhanced_keep_alive()
+        telegram_manager.start_member_refresher()
+        success = content_scheduler.start_scheduler()
+
+        if success:
+            logger.info("🚀 УЛУЧШЕННАЯ СИСТЕМА ЗАПУЩЕНА")
+            logger.info("🧠 Научные подходы: АКТИВНЫ (8:30 каждый день)")
+            logger.info("🎯 Система разнообразия: АКТИВНА")
+            logger.info("🛡️ Защита от сна: АКТИВНА")
+            logger.info("💾 Render-Compatible Cache: АКТИВЕН (7 дней TTL)")
+            logger.info("🍰 Десерты правильного питания: ДОБАВЛЕНЫ")
+            logger.info("🎒 Активные перекусы: ДОБАВЛЕНЫ")
+            logger.info("📊 Реальный счетчик подписчиков: АКТИВЕН")
+        
+            # Получаем реальное количество подписчиков при запуске
+            member_count = telegram_manager.refresh_member_count()
+            logger.info(f"👥 Реальное количество подписчиков: {member_count}")
+
+            # Получаем информацию о системе разнообразия
+            cache_info = gpt_generator.get_cache_info()
+            logger.info(f"💾 Инициализирована система разнообразия: {cache_info['unique_ingredients_used']} ингредиентов, {cache_info['cooking_methods_used']} методов")
+            logger.info(f"🍰 Десерты: {cache_info.get('dessert_combinations', 0)} уникальных комбинаций")
+
+            if startup_announced:
+                return
+            startup_announced = True
+
+            # Тестовое сообщение о запуске улучшенной системы
+            current_times = TimeManager.get_current_times()
+            telegram_manager.send_with_fallback(f"""
 🎪 <b>УЛУЧШЕННАЯ СИСТЕМА @ppsupershef АКТИВИРОВАНА!</b>
 
 ✅ <b>Запущены все улучшенные функции:</b>
@@ -3160,11 +6267,24 @@ try:
 🔄 Поделиться с друзьми
         """, "Запуск улучшенной системы")
 
-    else:
-        logger.error("❌ Не удалось запустить улучшенную систему")
+        else:
+            logger.error("❌ Не удалось запустить улучшенную систему")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска улучшенной системы: {e}")
+
+def stop_leader_services():
+    """Процесс потерял лидерство: дальше только обслуживает HTTP"""
+    content_scheduler.stop_scheduler()
+    telegram_manager.stop_member_refresher()
+    if keep_alive_loop:
+        keep_alive_loop.cancel()
+
+# Правку файла контента подхватывает каждый процесс, а не только лидер
+content_library.watch()
 
-except Exception as e:
-    logger.error(f"❌ Ошибка запуска улучшенной системы: {e}")
+# Публикует только один процесс; остальные gunicorn-воркеры обслуживают HTTP
+services.leader_election.start(start_leader_services, stop_leader_services)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))